@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from batch_message import encode_batch
+
+# Sends sensor readings to IoT Hub in batches instead of one message per frame. Readings are
+# added without waiting for the network, a batch is sent when it has max_batch readings or its
+# first reading is max_wait seconds old. The sender connects the client itself, a failed connect
+# or send is retried with exponential backoff and the client is connected again first.
+#
+# The client only needs the methods of azure.iot.device.aio.IoTHubDeviceClient that are used here:
+#
+#   async connect(), async send_message(message), async shutdown()
+#
+# FakeIoTHubClient in fake_iothub.py implements them in process, for tests and benchmarks.
+#
+# Without a spool, batches waiting to be sent are kept in memory and up to max_in_flight are sent
+# at the same time, when more than max_pending are waiting the oldest is dropped. With a
+# MessageSpool every batch is written to disk first and the spool is sent one message at a time,
+# oldest first, at most drain_rate messages per second, so a long outage is sent in order once the
+# connection is back without flooding the hub.
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSender:
+    def __init__(
+        self,
+        client,
+        client_id,
+        max_batch=60,
+        max_wait=60,
+        max_in_flight=2,
+        max_pending=1440,
+        compress=False,
+        message_factory=None,
+        retry_delay=1,
+        max_retry_delay=300,
+        spool=None,
+        drain_rate=10,
+    ):
+        self.client = client
+        self.client_id = client_id
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.compress = compress
+        # turns the encoded body into what send_message expects, e.g. an azure.iot.device.Message
+        self.message_factory = message_factory or (lambda body: body)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.spool = spool
+        self.drain_rate = drain_rate
+
+        self._batch = []
+        self._batch_started = None
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._spooled = asyncio.Event()
+        # the send tasks of the in-memory batches, and the seq of the spooled message being sent
+        self._send_tasks = set()
+        self._draining = None
+        self._connect_lock = asyncio.Lock()
+
+        self.connected = False
+        self.sent_messages = 0
+        self.sent_readings = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def add(self, timestamp, pm25, pm10):
+        # queue a reading (epoch seconds), never waits for the network or the disk
+        if not self._batch:
+            self._batch_started = time.monotonic()
+            # run() waits without a timeout while there is no batch, let it start the max_wait timer
+            self._wakeup.set()
+        self._batch.append((timestamp, pm25, pm10))
+
+        if len(self._batch) >= self.max_batch:
+            self._close_batch()
+
+    def _close_batch(self):
+        if not self._batch:
+            return
+
+        self._pending.append(self._batch)
+        self._batch = []
+        self._batch_started = None
+
+        while len(self._pending) > self.max_pending:
+            dropped = self._pending.popleft()
+            self.dropped += len(dropped)
+
+        self._wakeup.set()
+
+    def stats(self):
+        stats = {
+            "connected": self.connected,
+            "buffered": len(self._batch),
+            "pending": len(self._pending),
+            "in_flight": len(self._send_tasks) + (self._draining is not None),
+            "sent_messages": self.sent_messages,
+            "sent_readings": self.sent_readings,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+        if self.spool is not None:
+            stats["spooled"] = self.spool.count
+        return stats
+
+    async def _connect(self):
+        # several sends can fail at the same time, only one of them reconnects
+        async with self._connect_lock:
+            if not self.connected:
+                await self.client.connect()
+                self.connected = True
+                logger.info("Connected to IoT hub")
+
+    async def _send(self, body):
+        await self._connect()
+        try:
+            await self.client.send_message(self.message_factory(body))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.connected = False
+            raise
+
+    async def _send_with_retry(self, batch):
+        body = encode_batch(batch, self.client_id, compress=self.compress)
+        delay = self.retry_delay
+        while True:
+            try:
+                await self._send(body)
+                self.sent_messages += 1
+                self.sent_readings += len(batch)
+                return
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Could not send %d readings: %s, retrying in %s seconds", len(batch), e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    async def _drain(self):
+        # send the spool oldest first, a message is only removed once it was sent
+        delay = self.retry_delay
+        next_send = 0
+        while True:
+            self._spooled.clear()
+            messages = await asyncio.to_thread(self.spool.peek, 1)
+            if not messages:
+                await self._spooled.wait()
+                continue
+
+            # at most drain_rate sends are started per second
+            if self.drain_rate:
+                wait = next_send - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                next_send = time.monotonic() + 1 / self.drain_rate
+
+            message = messages[0]
+            self._draining = message.seq
+            try:
+                await self._send(message.body)
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                self.failed += 1
+                logger.warning(
+                    "Could not send spooled message %d: %s, %d spooled, retrying in %s seconds",
+                    message.seq,
+                    e,
+                    self.spool.count,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+
+            finally:
+                self._draining = None
+
+            delay = self.retry_delay
+            await asyncio.to_thread(self.spool.remove, message.seq)
+            self.sent_messages += 1
+            self.sent_readings += message.readings
+
+    async def _spool_pending(self):
+        while self._pending:
+            batch = self._pending.popleft()
+            body = encode_batch(batch, self.client_id, compress=self.compress)
+            evicted = await asyncio.to_thread(self.spool.append, body, len(batch))
+            if evicted:
+                logger.warning("Spool is full, evicted %d of the oldest readings", evicted)
+                self.dropped += evicted
+            self._spooled.set()
+
+    async def run(self):
+        # send batches until cancelled, start with asyncio.create_task(sender.run())
+        drainer = asyncio.create_task(self._drain()) if self.spool is not None else None
+        try:
+            while True:
+                timeout = None
+                if self._batch_started is not None:
+                    timeout = max(self._batch_started + self.max_wait - time.monotonic(), 0)
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    self._close_batch()
+                self._wakeup.clear()
+
+                if drainer is not None:
+                    if drainer.done():
+                        # should never happen, restart it so the spool is not stuck
+                        logger.error("Spool drain stopped: %s", drainer.exception())
+                        drainer = asyncio.create_task(self._drain())
+                    await self._spool_pending()
+                    continue
+
+                while self._pending and len(self._send_tasks) < self.max_in_flight:
+                    task = asyncio.create_task(self._send_with_retry(self._pending.popleft()))
+                    self._send_tasks.add(task)
+                    task.add_done_callback(self._sent)
+
+                if self._pending and len(self._send_tasks) >= self.max_in_flight:
+                    # all send slots are busy, wait until one is free
+                    await asyncio.wait(self._send_tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if drainer is not None:
+                drainer.cancel()
+
+    def _sent(self, task):
+        self._send_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Exception: %s", task.exception(), exc_info=task.exception())
+        self._wakeup.set()
+
+    async def flush(self, timeout=60):
+        # send everything buffered and wait until it is sent, at most timeout seconds (None waits until
+        # it is sent). Returns False if something is still waiting, spooled messages stay on disk.
+        self._close_batch()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._pending or self._send_tasks or self._draining is not None or (
+            self.spool is not None and self.spool.count
+        ):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            await asyncio.sleep(0.01)
+        return True
@@ -0,0 +1,251 @@
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import sendDataToMiljoDir as miljodir
+from structured_logging import setup_logging
+from sendDataToMiljoDir import (
+    PM10_TIMESERIES_ID,
+    PM25_TIMESERIES_ID,
+    STATION_ID_MILJODIR,
+    get_all_measurements_taken,
+    get_client,
+    parse_last_received_array,
+    send_data_to_miljodir,
+    tz,
+)
+
+# Backfill everything Miljødirektoratet has not received yet from the YYYY/MM/DD/measurements.csv files.
+#
+# The day files covering the gap after last-received are parsed in parallel, and the measurements are
+# POSTed in chunks with a limited number of requests in flight. Progress is written to a state file
+# after every chunk, if the backfill is stopped it continues from the first chunk that was not sent.
+# The outbox is acknowledged up to the same point, so sendDataToMiljoDir.py does not send the
+# backfilled measurements again.
+#
+#   python backfill.py                    # everything after last-received
+#   python backfill.py --since 2023-10-01 # ignore last-received and the state file
+#   python backfill.py --dry-run          # only list what would be sent
+
+logger = logging.getLogger("backfill")
+
+STATE_FILE = f"miljodir-station-{STATION_ID_MILJODIR}-backfill.json"
+TIMESERIES_IDS = (PM10_TIMESERIES_ID, PM25_TIMESERIES_ID)
+
+
+def get_last_received_per_timeseries():
+    response = get_client().get_last_received(STATION_ID_MILJODIR)
+    response.raise_for_status()
+
+    last_received = {}
+    for time_series in parse_last_received_array(response.json()):
+        if time_series.lastReceived:
+            last_received[time_series.timeSeriesId] = dt.datetime.fromisoformat(
+                time_series.lastReceived
+            )
+
+    return last_received
+
+
+def read_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            state = json.load(f)
+        return {int(key): dt.datetime.fromisoformat(value) for key, value in state.items()}
+
+    except FileNotFoundError:
+        return None
+
+
+def write_state(sent_until):
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({str(key): value.isoformat() for key, value in sent_until.items()}, f)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def days_between(start, end):
+    day = start.date()
+    while day <= end.date():
+        yield day
+        day += dt.timedelta(days=1)
+
+
+def measurement_files(start, end):
+    # the day files that exist between start and end
+    for day in days_between(start, end):
+        if miljodir.fileExist(day.year, day.month, day.day):
+            yield day
+
+
+def read_day(day):
+    return day, get_all_measurements_taken(day.year, day.month, day.day)
+
+
+def build_chunks(days, sent_until, until, chunk_size):
+    # rows are (pm10, pm25) InputTimeValue pairs, each timeseries only keeps values after its own offset
+    rows = []
+    for day, (pm10_time_values, pm25_time_values) in sorted(days, key=lambda item: item[0]):
+        rows.extend(zip(pm10_time_values, pm25_time_values))
+
+    rows = [
+        (pm10, pm25)
+        for pm10, pm25 in rows
+        if pm10.from_time <= until
+        and (
+            pm10.from_time > sent_until[PM10_TIMESERIES_ID]
+            or pm25.from_time > sent_until[PM25_TIMESERIES_ID]
+        )
+    ]
+    rows.sort(key=lambda row: row[0].from_time)
+
+    # last_sent is the from_time each timeseries has before the chunk: the end of the previous chunk,
+    # or sent_until for the first one. The gap after it is filled, but with no more than chunk_size
+    # values, like Station.send_pending.
+    chunks = []
+    previous_last_time = None
+    for index in range(0, len(rows), chunk_size):
+        chunk = rows[index : index + chunk_size]
+        pm10_time_values = [pm10 for pm10, pm25 in chunk if pm10.from_time > sent_until[PM10_TIMESERIES_ID]]
+        pm25_time_values = [pm25 for pm10, pm25 in chunk if pm25.from_time > sent_until[PM25_TIMESERIES_ID]]
+
+        earliest = chunk[0][0].from_time - chunk_size * dt.timedelta(minutes=1)
+        last_sent = {}
+        for timeseries_id in TIMESERIES_IDS:
+            last_sent[timeseries_id] = max(sent_until[timeseries_id], earliest)
+            if previous_last_time is not None:
+                last_sent[timeseries_id] = max(last_sent[timeseries_id], previous_last_time)
+
+        last_time = chunk[-1][0].from_time
+        chunks.append((last_time, last_sent, pm10_time_values, pm25_time_values))
+        previous_last_time = last_time
+
+    return chunks
+
+
+def ack_outbox(outbox, sent_until):
+    # the outbox rows up to sent_until are at the API now
+    for timeseries_id in TIMESERIES_IDS:
+        seq = outbox.last_seq_until(sent_until[timeseries_id])
+        if seq is not None:
+            outbox.ack(timeseries_id, seq)
+
+
+def send_chunks(chunks, sent_until, max_in_flight, outbox=None):
+    # chunks can finish out of order, the state (and the outbox) only moves past a chunk when every
+    # chunk before it is sent
+    done = [False] * len(chunks)
+    next_pending = 0
+    sent = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {
+            executor.submit(send_data_to_miljodir, pm10_time_values, pm25_time_values, last_sent): index
+            for index, (last_time, last_sent, pm10_time_values, pm25_time_values) in enumerate(chunks)
+        }
+
+        for future in as_completed(futures):
+            index = futures[future]
+            last_time, last_sent, pm10_time_values, pm25_time_values = chunks[index]
+
+            try:
+                ok = future.result()
+            except Exception as e:
+                logger.exception("Exception: %s", e)
+                ok = False
+
+            if not ok:
+                logger.warning("Chunk %d/%d ending %s failed", index + 1, len(chunks), last_time)
+                continue
+
+            done[index] = True
+            sent += len(pm10_time_values) + len(pm25_time_values)
+
+            while next_pending < len(chunks) and done[next_pending]:
+                chunk_last_time = chunks[next_pending][0]
+                sent_until[PM10_TIMESERIES_ID] = max(sent_until[PM10_TIMESERIES_ID], chunk_last_time)
+                sent_until[PM25_TIMESERIES_ID] = max(sent_until[PM25_TIMESERIES_ID], chunk_last_time)
+                next_pending += 1
+
+            write_state(sent_until)
+            if outbox is not None:
+                ack_outbox(outbox, sent_until)
+
+            elapsed = time.perf_counter() - start
+            logger.info(
+                "Progress: %d/%d chunks, %d values sent, %.0f values/sec, sent until %s",
+                done.count(True),
+                len(chunks),
+                sent,
+                sent / elapsed,
+                sent_until[PM10_TIMESERIES_ID],
+            )
+
+    return all(done)
+
+
+def backfill(since=None, until=None, chunk_size=360, max_in_flight=4, workers=None, dry_run=False):
+    until = until if until is not None else dt.datetime.now(tz)
+
+    if since is not None:
+        sent_until = {PM10_TIMESERIES_ID: since, PM25_TIMESERIES_ID: since}
+    else:
+        # resume from the state file, it is never ahead of what was actually sent
+        sent_until = read_state() or get_last_received_per_timeseries()
+
+    default = until - dt.timedelta(days=7)
+    for timeseries_id in TIMESERIES_IDS:
+        sent_until.setdefault(timeseries_id, default)
+
+    start = min(sent_until[PM10_TIMESERIES_ID], sent_until[PM25_TIMESERIES_ID])
+    days = list(measurement_files(start, until))
+    logger.info("Backfilling from %s to %s, %d day file(s)", start, until, len(days))
+
+    if not days:
+        return True
+
+    parse_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsed = list(executor.map(read_day, days))
+    logger.info("Parsed %d day file(s) in %.2f seconds", len(days), time.perf_counter() - parse_start)
+
+    chunks = build_chunks(parsed, sent_until, until, chunk_size)
+    count = sum(len(pm10) + len(pm25) for last_time, last_sent, pm10, pm25 in chunks)
+    logger.info("%d values to send in %d chunk(s) of up to %d measurements", count, len(chunks), chunk_size)
+
+    if dry_run or not chunks:
+        return True
+
+    ok = send_chunks(chunks, sent_until, max_in_flight, miljodir.get_station().outbox)
+    if ok:
+        os.remove(STATE_FILE)
+        logger.info("Backfill complete")
+    else:
+        logger.warning("Backfill incomplete, run again to continue from %s", sent_until[PM10_TIMESERIES_ID])
+
+    return ok
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Backfill measurements to Miljødirektoratet")
+    arg_parser.add_argument("--since", type=dt.datetime.fromisoformat, help="send everything after this time")
+    arg_parser.add_argument("--until", type=dt.datetime.fromisoformat, help="stop at this time, default now")
+    arg_parser.add_argument("--chunk-size", type=int, default=miljodir.UPLOAD_CHUNK_SIZE)
+    arg_parser.add_argument("--max-in-flight", type=int, default=4)
+    arg_parser.add_argument("--workers", type=int, help="processes used to parse the day files")
+    arg_parser.add_argument("--dry-run", action="store_true")
+    args = arg_parser.parse_args()
+
+    # the backfill and the upload functions log the same way, LOG_LEVEL and LOG_FORMAT apply to both
+    setup_logging()
+
+    # datetimes without an offset are in the same timezone as the measurements
+    since = args.since.replace(tzinfo=tz) if args.since and args.since.tzinfo is None else args.since
+    until = args.until.replace(tzinfo=tz) if args.until and args.until.tzinfo is None else args.until
+
+    ok = backfill(since, until, args.chunk_size, args.max_in_flight, args.workers, args.dry_run)
+    exit(0 if ok else 1)
@@ -0,0 +1,142 @@
+import argparse
+import datetime as dt
+import gzip
+import json
+import random
+import time
+import zlib
+
+# Compact IoT Hub message with many readings. Instead of one {"pm2": .., "pm10": .., "client_id": ..}
+# message per frame, the readings of a batch are sent as columns:
+#
+#   {"v": 1, "client_id": "raspberry-pi-jan", "t0": 1697616000123,
+#    "dt": [0, 1001, 999, ...], "pm2": [152, 149, ...], "pm10": [301, 298, ...]}
+#
+# t0 is the time of the first reading in epoch milliseconds, dt the milliseconds since the previous
+# reading (about 1000 for the SDS011) and pm2/pm10 are in tenths, the sensor's resolution. The
+# message can be gzip compressed, decode_batch recognises both.
+
+FORMAT_VERSION = 1
+CONTENT_TYPE = "application/json"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def encode_batch(readings, client_id, compress=False):
+    # readings are (epoch seconds, pm25, pm10), oldest first. returns the message body as bytes
+    t0 = None
+    previous = None
+    times = []
+    pm2 = []
+    pm10 = []
+    for timestamp, pm25_value, pm10_value in readings:
+        millis = int(round(timestamp * 1000))
+        if t0 is None:
+            t0 = previous = millis
+        times.append(millis - previous)
+        previous = millis
+        pm2.append(int(round(pm25_value * 10)))
+        pm10.append(int(round(pm10_value * 10)))
+
+    body = json.dumps(
+        {"v": FORMAT_VERSION, "client_id": client_id, "t0": t0 or 0, "dt": times, "pm2": pm2, "pm10": pm10},
+        separators=(",", ":"),
+    ).encode()
+
+    if compress:
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+    return body
+
+
+def decode_batch(body):
+    # the readings of a message as (epoch seconds, pm25, pm10), and the client id
+    if body[:2] == GZIP_MAGIC:
+        body = gzip.decompress(body)
+
+    message = json.loads(body)
+    if message.get("v") != FORMAT_VERSION:
+        raise ValueError(f"Unknown batch message version: {message.get('v')}")
+
+    readings = []
+    millis = message["t0"]
+    for delta, pm2, pm10 in zip(message["dt"], message["pm2"], message["pm10"]):
+        millis += delta
+        readings.append((millis / 1000, pm2 / 10, pm10 / 10))
+    return readings, message["client_id"]
+
+
+def benchmark(readings_count, batch_size):
+    client_id = "raspberry-pi-jan"
+    rng = random.Random(1)
+    start_time = 1_697_616_000.0
+
+    readings = []
+    timestamp = start_time
+    for _ in range(readings_count):
+        timestamp += rng.uniform(0.98, 1.02)
+        readings.append((timestamp, round(rng.uniform(1, 30), 1), round(rng.uniform(2, 60), 1)))
+
+    def run(name, encode):
+        start = time.perf_counter()
+        total = 0
+        for index in range(0, len(readings), batch_size):
+            for body in encode(readings[index : index + batch_size]):
+                total += len(body)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>34}: {total / len(readings):7.1f} bytes per reading, {elapsed / len(readings) * 1e6:6.2f} us per reading")
+
+    # one message per reading, the format sendTestDataToAzure.py sent before
+    json_payload = '{{"pm2": {pm2}, "pm10": {pm10}, "client_id": "{client_id}"}}'
+    run(
+        "one JSON message per reading",
+        lambda batch: [
+            json_payload.format(pm2=pm25, pm10=pm10, client_id=client_id).encode() for _, pm25, pm10 in batch
+        ],
+    )
+    run(f"batch of {batch_size}, delta encoded", lambda batch: [encode_batch(batch, client_id)])
+    run(f"batch of {batch_size}, delta encoded, gzip", lambda batch: [encode_batch(batch, client_id, compress=True)])
+
+    decoded, _ = decode_batch(encode_batch(readings[:batch_size], client_id, compress=True))
+    assert all(
+        abs(a[0] - b[0]) < 0.001 and a[1:] == b[1:] for a, b in zip(decoded, readings[:batch_size])
+    )
+
+    # a day of minute values to Miljødirektoratet, as sent by send_data_to_miljodir
+    import sendDataToMiljoDir as miljodir
+    from miljodir_client import compress_body
+    from miljodir_station import InputTimeSeries
+    from payload_encoder import PayloadEncoder
+
+    day = dt.datetime(2023, 10, 18, tzinfo=miljodir.tz)
+    def time_values(column):
+        return [
+            miljodir.InputTimeValue(day + dt.timedelta(minutes=minute), day + dt.timedelta(minutes=minute + 1), reading[column], 100)
+            for minute, reading in enumerate(readings[:1440])
+        ]
+
+    pm10_values = time_values(2)
+    payload = PayloadEncoder().encode(
+        [
+            InputTimeSeries(miljodir.PM10_TIMESERIES_ID, "PM10", miljodir.CLIENT_ID, pm10_values),
+            InputTimeSeries(miljodir.PM25_TIMESERIES_ID, "PM2.5", miljodir.CLIENT_ID, time_values(1)),
+        ]
+    )
+    points = 2 * len(pm10_values)
+    print(f"{'Miljødirektoratet day, JSON':>34}: {len(payload) / points:7.1f} bytes per value")
+    for encoding in ("gzip", "deflate"):
+        start = time.perf_counter()
+        body = compress_body(payload, encoding)
+        elapsed = time.perf_counter() - start
+        assert zlib.decompress(body, 47) == payload
+        print(
+            f"{'Miljødirektoratet day, ' + encoding:>34}: {len(body) / points:7.1f} bytes per value, "
+            f"{elapsed / points * 1e6:6.2f} us per value"
+        )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark message sizes")
+    arg_parser.add_argument("--readings", type=int, default=3600)
+    arg_parser.add_argument("--batch-size", type=int, default=60)
+    args = arg_parser.parse_args()
+
+    benchmark(args.readings, args.batch_size)
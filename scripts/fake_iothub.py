@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from azure_sender import BatchSender
+from batch_message import decode_batch
+from message_spool import MessageSpool
+
+# In-process stand-in for azure.iot.device.aio.IoTHubDeviceClient. Every send takes latency
+# seconds (the network round trip), received messages are kept in messages. Set online to False
+# to simulate a lost connection: connect and send_message fail until it is True again.
+
+
+class FakeIoTHubClient:
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.online = True
+        self.connected = False
+        self.messages = []
+
+    async def connect(self):
+        await asyncio.sleep(self.latency)
+        if not self.online:
+            raise ConnectionError("Could not connect, network is down")
+        self.connected = True
+
+    async def send_message(self, message):
+        if not self.connected:
+            raise ConnectionError("Client is not connected")
+        await asyncio.sleep(self.latency)
+        if not self.online:
+            self.connected = False
+            raise ConnectionError("Connection lost")
+        self.messages.append(message)
+
+    async def shutdown(self):
+        self.connected = False
+
+    def readings(self):
+        # every reading in the received batch messages
+        return [reading for message in self.messages for reading in decode_batch(message)[0]]
+
+
+async def benchmark(readings, interval, latency, max_batch, max_in_flight):
+    client_id = "raspberry-pi-jan"
+    json_payload = '{{"pm2": {pm2}, "pm10": {pm10}, "client_id": "{client_id}"}}'
+
+    async def sensor():
+        # readings arrive every interval seconds, like frames from the serial port
+        for index in range(readings):
+            yield time.time(), 10.0 + index % 10, 20.0 + index % 10
+            await asyncio.sleep(interval)
+
+    # the old loop: one message per reading, the next reading waits for the send
+    client = FakeIoTHubClient(latency)
+    await client.connect()
+    start = time.perf_counter()
+    async for timestamp, pm25, pm10 in sensor():
+        await client.send_message(json_payload.format(pm2=pm25, pm10=pm10, client_id=client_id))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{'one message per reading':>26}: {readings / elapsed:7.1f} readings/s, {len(client.messages)} messages"
+    )
+
+    client = FakeIoTHubClient(latency)
+    await client.connect()
+    sender = BatchSender(client, client_id, max_batch=max_batch, max_wait=1, max_in_flight=max_in_flight)
+    task = asyncio.create_task(sender.run())
+    start = time.perf_counter()
+    async for timestamp, pm25, pm10 in sensor():
+        sender.add(timestamp, pm25, pm10)
+    sampling = time.perf_counter() - start
+    await sender.flush(timeout=None)
+    elapsed = time.perf_counter() - start
+    task.cancel()
+
+    assert len(client.readings()) == readings
+    print(
+        f"{'batches of ' + str(max_batch):>26}: {readings / sampling:7.1f} readings/s, {len(client.messages)} messages, "
+        f"all sent after {elapsed:.2f} s"
+    )
+    print(f"sensor rate: {1 / interval if interval else float('inf'):.1f} readings/s, round trip {latency * 1000:.0f} ms")
+
+
+
+async def outage(readings, interval, latency, outage_seconds, max_batch, drain_rate):
+    # readings are spooled while the client is offline and sent in order once it is back
+    client = FakeIoTHubClient(latency)
+    spool = MessageSpool(os.path.join(tempfile.mkdtemp(), "iothub-spool.db"))
+    sender = BatchSender(
+        client, "raspberry-pi-jan", max_batch=max_batch, max_wait=1, spool=spool, drain_rate=drain_rate,
+        retry_delay=0.1, max_retry_delay=0.5,
+    )
+    task = asyncio.create_task(sender.run())
+
+    outage_start = readings // 4
+    outage_end = None
+    worst_add = 0
+    start = time.perf_counter()
+    for index in range(readings):
+        if index == outage_start:
+            client.online = False
+            outage_end = time.perf_counter() + outage_seconds
+        if outage_end is not None and time.perf_counter() >= outage_end:
+            client.online = True
+            outage_end = None
+            back_online = time.perf_counter()
+
+        add_start = time.perf_counter()
+        sender.add(1_697_616_000 + index, 10.0 + index % 10, 20.0 + index % 10)
+        worst_add = max(worst_add, time.perf_counter() - add_start)
+        await asyncio.sleep(interval)
+    if outage_end is not None:
+        client.online = True
+        back_online = time.perf_counter()
+
+    await sender.flush(timeout=None)
+    drained = time.perf_counter()
+    task.cancel()
+
+    received = client.readings()
+    assert [reading[0] for reading in received] == [1_697_616_000 + index for index in range(readings)]
+    print(
+        f"{readings} readings in {drained - start:.2f} s, offline {outage_seconds} s, all sent in order "
+        f"{drained - back_online:.2f} s after the connection was back"
+    )
+    print(f"slowest add: {worst_add * 1e6:.0f} us, {sender.stats()}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark IoT Hub sending with a fake client")
+    arg_parser.add_argument("--readings", type=int, default=600)
+    arg_parser.add_argument("--interval", type=float, default=0.005, help="seconds between readings")
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="seconds per send")
+    arg_parser.add_argument("--max-batch", type=int, default=60)
+    arg_parser.add_argument("--max-in-flight", type=int, default=2)
+    arg_parser.add_argument("--outage", type=float, help="seconds offline, sends through a spool")
+    arg_parser.add_argument("--drain-rate", type=float, default=50, help="messages per second when draining")
+    args = arg_parser.parse_args()
+
+    if args.outage:
+        asyncio.run(outage(args.readings, args.interval, args.latency, args.outage, args.max_batch, args.drain_rate))
+    else:
+        asyncio.run(benchmark(args.readings, args.interval, args.latency, args.max_batch, args.max_in_flight))
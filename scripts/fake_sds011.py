@@ -0,0 +1,41 @@
+import argparse
+import os
+import pty
+import random
+import time
+import tty
+from sds011_decoder import encode_frame
+
+
+def open_fake_sensor():
+    # create a pty pair, the slave path can be opened like /dev/ttyUSB0
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def write_frames(master, interval=1.0, count=None, device_id=0x1234):
+    sent = 0
+    while count is None or sent < count:
+        pm25 = round(random.uniform(1, 30), 1)
+        pm10 = round(pm25 + random.uniform(0, 20), 1)
+        os.write(master, encode_frame(pm25, pm10, device_id))
+        sent += 1
+        if interval:
+            time.sleep(interval)
+    return sent
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Fake SDS011 sensor on a pty")
+    arg_parser.add_argument("--interval", type=float, default=1.0, help="seconds between frames")
+    arg_parser.add_argument("--count", type=int, help="stop after this many frames")
+    args = arg_parser.parse_args()
+
+    master, slave, port = open_fake_sensor()
+    print(f"Fake SDS011 sensor on: {port}", flush=True)
+
+    try:
+        write_frames(master, args.interval, args.count)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,110 @@
+import argparse
+import datetime as dt
+import random
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Gap detection for per-minute timeseries. Times are epoch minutes (epoch seconds // 60), sorted
+# ascending. A gap is returned as a range (first_missing, end): every resolution minutes from
+# first_missing up to, but not including, end is a missing slot. Gaps are found in one pass and
+# produced lazily, so a month long outage costs the same memory as a one minute gap until the
+# fill values are actually created.
+
+MINUTE = 1
+HOUR = 60
+
+
+def find_gaps(slots, resolution=MINUTE, after=None):
+    # after is the last slot that was already sent, a gap between it and the first slot is also returned
+    previous = after
+    for slot in slots:
+        if previous is not None and slot - previous > resolution:
+            yield previous + resolution, slot
+        previous = slot
+
+
+def find_gaps_numpy(slots, resolution=MINUTE, after=None):
+    # same as find_gaps for a numpy array, returns two arrays (first_missing, end)
+    if numpy is None:
+        raise ImportError("numpy is not installed, use pip install numpy")
+
+    slots = numpy.asarray(slots, dtype=numpy.int64)
+    if after is not None:
+        slots = numpy.concatenate(([after], slots))
+
+    index = numpy.nonzero(numpy.diff(slots) > resolution)[0]
+    return slots[index] + resolution, slots[index + 1]
+
+
+def missing_slots(gaps, resolution=MINUTE):
+    for first_missing, end in gaps:
+        yield from range(first_missing, end, resolution)
+
+
+def count_missing(gaps, resolution=MINUTE):
+    return sum(len(range(first_missing, end, resolution)) for first_missing, end in gaps)
+
+
+def synthetic_slots(count, gap_probability=0.01, max_gap=600, seed=1):
+    rng = random.Random(seed)
+    slots = array("q")
+    slot = 27_000_000
+    for _ in range(count):
+        slots.append(slot)
+        slot += rng.randint(2, max_gap) if rng.random() < gap_probability else 1
+    return slots
+
+
+def benchmark(sizes):
+    tz = dt.timezone(dt.timedelta(hours=1))
+
+    for count in sizes:
+        slots = synthetic_slots(count)
+        times = [dt.datetime.fromtimestamp(slot * 60, tz) for slot in slots]
+
+        # the old fill_gaps: walk datetimes and step one interval at a time
+        start = time.perf_counter()
+        legacy = 0
+        previous = None
+        for from_time in times:
+            if previous is not None:
+                current = previous + dt.timedelta(minutes=1)
+                while current < from_time:
+                    legacy += 1
+                    current += dt.timedelta(minutes=1)
+            previous = from_time
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        missing = count_missing(find_gaps(slots))
+        python_time = time.perf_counter() - start
+
+        line = (
+            f"{count:8d} points, {missing:8d} missing: datetime loop {legacy_time:7.3f} s, "
+            f"find_gaps {python_time:7.3f} s"
+        )
+
+        if numpy is not None:
+            values = numpy.frombuffer(slots, dtype=numpy.int64)
+            start = time.perf_counter()
+            first_missing, end = find_gaps_numpy(values)
+            numpy_missing = int((end - first_missing).sum())
+            numpy_time = time.perf_counter() - start
+            assert numpy_missing == missing
+            line += f", numpy {numpy_time:7.4f} s"
+
+        assert legacy == missing
+        print(line)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark gap detection")
+    arg_parser.add_argument("--points", type=int, nargs="+", default=[10_000, 1_000_000])
+    args = arg_parser.parse_args()
+
+    benchmark(args.points)
@@ -1,15 +1,12 @@
 import serial, time, datetime
+from sds011_decoder import FrameDecoder
 
 ser = serial.Serial('/dev/ttyUSB0')
+decoder = FrameDecoder()
 
-while True:
-	data = []
-	for index in range(0,10):
-		datum = ser.read()
-		data.append(datum)
-
-	pmtwofive = int.from_bytes(b''.join(data[2:4]), byteorder='little') / 10
-	pmten = int.from_bytes(b''.join(data[4:6]), byteorder='little') / 10
+for reading in decoder.read_frames(ser):
+	pmtwofive = reading.pm25
+	pmten = reading.pm10
 
 	currentTime = datetime.datetime.now()
 
@@ -0,0 +1,172 @@
+import argparse
+import datetime as dt
+import os
+import shutil
+import tempfile
+import time
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Fast reader for the pm2,pm10,client_id,fromTime,toTime files written by sendDataToMiljoDir.py.
+#
+# Timestamps are written by str(datetime) and always look like "2023-10-18 08:01:00+01:00", so
+# instead of a generic date parser the date part and offset are parsed once per day (cached) and
+# only hh:mm:ss is read per line. The result is one array per column, times as epoch seconds.
+
+CSV_HEADER = "pm2,pm10,client_id,fromTime,toTime"
+
+MeasurementColumns = namedtuple(
+    "MeasurementColumns", ["pm2", "pm10", "from_time", "to_time", "client_id"]
+)
+
+
+def _day_start(date_text, offset_text):
+    # epoch seconds at 00:00 for the date and utc offset, e.g. "2023-10-18" and "+01:00"
+    return int(dt.datetime.fromisoformat(f"{date_text}T00:00:00{offset_text}").timestamp())
+
+
+def parse_timestamp(text, cache):
+    # "YYYY-MM-DD HH:MM:SS[.ffffff][+HH:MM]" to epoch seconds, fractions of a second are dropped
+    offset_text = text[19:]
+    if offset_text.startswith("."):
+        index = 20
+        while index < len(text) and text[index].isdigit():
+            index += 1
+        offset_text = text[index:]
+
+    key = text[:10] + offset_text
+    day_start = cache.get(key)
+    if day_start is None:
+        day_start = cache[key] = _day_start(text[:10], offset_text)
+
+    return day_start + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+
+
+def read_measurements(f):
+    # stream over an open file, lines that can not be parsed are skipped
+    pm2 = array("d")
+    pm10 = array("d")
+    from_time = array("q")
+    to_time = array("q")
+    client_id = None
+
+    cache = {}
+    for line in f:
+        if line.startswith("pm2"):
+            continue
+
+        values = line.rstrip("\r\n").split(",")
+        if len(values) != 5:
+            continue
+
+        try:
+            pm2.append(float(values[0]))
+            pm10.append(float(values[1]))
+            from_time.append(parse_timestamp(values[3], cache))
+            to_time.append(parse_timestamp(values[4], cache))
+        except ValueError:
+            # keep the columns the same length
+            count = len(to_time)
+            del pm2[count:], pm10[count:], from_time[count:]
+            continue
+
+        if client_id is None:
+            client_id = values[2]
+
+    return MeasurementColumns(pm2, pm10, from_time, to_time, client_id)
+
+
+def read_measurements_file(file_path):
+    with open(file_path, "r") as f:
+        return read_measurements(f)
+
+
+def to_numpy(columns):
+    # zero copy views of the column arrays
+    if numpy is None:
+        raise ImportError("numpy is not installed, use pip install numpy")
+
+    return (
+        numpy.frombuffer(columns.pm2, dtype=numpy.float64),
+        numpy.frombuffer(columns.pm10, dtype=numpy.float64),
+        numpy.frombuffer(columns.from_time, dtype=numpy.int64),
+        numpy.frombuffer(columns.to_time, dtype=numpy.int64),
+    )
+
+
+def write_synthetic_days(base_path, start, days, client_id="raspberry-pi-jan"):
+    tz = dt.timezone(dt.timedelta(hours=1))
+    start = dt.datetime(start.year, start.month, start.day, tzinfo=tz)
+
+    for day in range(days):
+        day_start = start + dt.timedelta(days=day)
+        day_path = os.path.join(base_path, f"{day_start.year}/{day_start.month:02d}/{day_start.day:02d}")
+        os.makedirs(day_path, exist_ok=True)
+
+        with open(os.path.join(day_path, "measurements.csv"), "w") as f:
+            f.write(CSV_HEADER)
+            f.write("\n")
+            for minute in range(1440):
+                from_time = day_start + dt.timedelta(minutes=minute)
+                to_time = from_time + dt.timedelta(minutes=1)
+                f.write(f"{minute % 300 / 10},{minute % 700 / 10},{client_id},{from_time},{to_time}\n")
+
+
+def benchmark(sizes):
+    from dateutil import parser
+
+    def legacy_read(file_path):
+        # the parsing done by get_all_measurements_taken before this reader
+        pm10_time_values = []
+        pm25_time_values = []
+        with open(file_path, "r") as f:
+            content = f.readlines()
+        for line in content:
+            if line.startswith("pm2"):
+                continue
+            values = line.split(",")
+            from_time = parser.parse(values[3])
+            to_time = parser.parse(values[4])
+            coverage = int((to_time - from_time).total_seconds() / 60 * 100)
+            pm10_time_values.append((from_time, to_time, float(values[1]), coverage))
+            pm25_time_values.append((from_time, to_time, float(values[0]), coverage))
+        return pm10_time_values
+
+    base_path = tempfile.mkdtemp()
+    try:
+        write_synthetic_days(base_path, dt.date(2023, 1, 1), max(sizes))
+        files = sorted(
+            os.path.join(root, name) for root, dirs, names in os.walk(base_path) for name in names
+        )
+
+        for days in sizes:
+            selected = files[:days]
+
+            start = time.perf_counter()
+            rows = sum(len(legacy_read(file_path)) for file_path in selected)
+            legacy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fast_rows = sum(len(read_measurements_file(file_path).pm2) for file_path in selected)
+            fast = time.perf_counter() - start
+
+            assert rows == fast_rows
+            print(
+                f"{days:4d} day(s), {rows:7d} rows: dateutil {legacy:8.3f} s, "
+                f"columns {fast:7.3f} s, {legacy / fast:5.1f}x faster"
+            )
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the measurement CSV reader")
+    arg_parser.add_argument("--days", type=int, nargs="+", default=[1, 30, 365])
+    args = arg_parser.parse_args()
+
+    benchmark(args.days)
@@ -0,0 +1,278 @@
+import argparse
+import datetime as dt
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from measurement_csv import MeasurementColumns, parse_timestamp, read_measurements, read_measurements_file, write_synthetic_days
+
+# Time-range index over the YYYY/MM/DD/measurements.csv tree. Next to every file there is a small
+# manifest (measurements.csv.idx, JSON) with the first and last timestamp, the row count and the byte
+# offset of the first row of every `interval` minutes block. A range read opens only the days in the
+# range and reads only the bytes between the blocks around it, instead of parsing whole days.
+#
+# MeasurementWriter keeps the manifest of the open file up to date when it is created with
+# index_minutes. A manifest that does not cover the whole file is still used: the bytes after the last
+# offset are read to the end, and build_tree() brings it up to date.
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx"
+INDEX_MINUTES = 15
+
+
+def index_path(csv_path):
+    return csv_path + INDEX_SUFFIX
+
+
+class FileIndex:
+    def __init__(self, interval=INDEX_MINUTES):
+        self.interval = interval
+        self.first = None
+        self.last = None
+        self.rows = 0
+        # bytes of the file the index covers
+        self.size = 0
+        # False when a row was older than a row before it, the offsets can not be searched then
+        self.ordered = True
+        # (timestamp, byte offset) of the first row of every block
+        self.times = array("q")
+        self.offsets = array("q")
+
+    def add(self, timestamp, offset):
+        # a row starting at offset, returns True if it started a new block
+        if self.first is None:
+            self.first = timestamp
+        elif timestamp < self.last:
+            self.ordered = False
+        self.last = timestamp if self.last is None else max(self.last, timestamp)
+        self.rows += 1
+
+        block = timestamp // (self.interval * 60)
+        if not self.times or block > self.times[-1] // (self.interval * 60):
+            self.times.append(timestamp)
+            self.offsets.append(offset)
+            return True
+        return False
+
+    def byte_range(self, start, end):
+        # (from, to) bytes that hold every row with start <= timestamp < end, to is None for the end of the file
+        if not self.ordered or not self.times:
+            return 0, None
+
+        first = bisect_right(self.times, start) - 1
+        after = bisect_left(self.times, end)
+        return (
+            self.offsets[first] if first >= 0 else 0,
+            self.offsets[after] if after < len(self.times) else None,
+        )
+
+    def to_dict(self):
+        return {
+            "interval": self.interval,
+            "first": self.first,
+            "last": self.last,
+            "rows": self.rows,
+            "size": self.size,
+            "ordered": self.ordered,
+            "offsets": [[timestamp, offset] for timestamp, offset in zip(self.times, self.offsets)],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data["interval"])
+        index.first = data["first"]
+        index.last = data["last"]
+        index.rows = data["rows"]
+        index.size = data["size"]
+        index.ordered = data["ordered"]
+        for timestamp, offset in data["offsets"]:
+            index.times.append(timestamp)
+            index.offsets.append(offset)
+        return index
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+def load_index(csv_path):
+    # the saved manifest, None if there is none or it can not be read
+    try:
+        with open(index_path(csv_path), "r") as f:
+            return FileIndex.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Could not read index of %s: %s", csv_path, e)
+        return None
+
+
+def build_index(csv_path, interval=INDEX_MINUTES):
+    # index every row of the file, lines that can not be parsed are skipped
+    index = FileIndex(interval)
+    cache = {}
+    offset = 0
+
+    with open(csv_path, "rb") as f:
+        for line in f:
+            values = line.split(b",")
+            if len(values) == 5 and not line.startswith(b"pm2"):
+                try:
+                    index.add(parse_timestamp(values[3].decode(), cache), offset)
+                except ValueError:
+                    pass
+            offset += len(line)
+
+    index.size = offset
+    return index
+
+
+def file_index(csv_path, interval=INDEX_MINUTES, save=True):
+    # the manifest of csv_path, built (and saved) when it is missing or the file was rewritten
+    index = load_index(csv_path)
+    if index is None or index.size > os.path.getsize(csv_path):
+        index = build_index(csv_path, interval)
+        if save:
+            try:
+                index.save(index_path(csv_path))
+            except OSError as e:
+                logger.warning("Could not save index of %s: %s", csv_path, e)
+    return index
+
+
+def day_paths(base_path, start, end, utc_offset=dt.timedelta(hours=1), file_name="measurements.csv"):
+    # the day files that can hold rows with start <= timestamp < end (epoch seconds), oldest first
+    tz = dt.timezone(utc_offset)
+    day = dt.datetime.fromtimestamp(start, tz).date()
+    last_day = dt.datetime.fromtimestamp(end - 1, tz).date()
+
+    while day <= last_day:
+        yield os.path.join(base_path, f"{day.year}/{day.month:02d}/{day.day:02d}", file_name)
+        day += dt.timedelta(days=1)
+
+
+def read_range(base_path, start, end, utc_offset=dt.timedelta(hours=1)):
+    # every row with start <= from_time < end (epoch seconds), as MeasurementColumns
+    pm2 = array("d")
+    pm10 = array("d")
+    from_time = array("q")
+    to_time = array("q")
+    client_id = None
+
+    for csv_path in day_paths(base_path, start, end, utc_offset):
+        if not os.path.exists(csv_path):
+            continue
+
+        index = file_index(csv_path)
+        # rows appended after the manifest was saved are not in first and last
+        complete = index.size == os.path.getsize(csv_path)
+        if complete and (index.first is None or index.last < start or (index.ordered and index.first >= end)):
+            continue
+
+        begin, stop = index.byte_range(start, end)
+        with open(csv_path, "rb") as f:
+            f.seek(begin)
+            data = f.read() if stop is None else f.read(stop - begin)
+
+        columns = read_measurements(io.StringIO(data.decode()))
+        for index_row, timestamp in enumerate(columns.from_time):
+            if start <= timestamp < end:
+                pm2.append(columns.pm2[index_row])
+                pm10.append(columns.pm10[index_row])
+                from_time.append(timestamp)
+                to_time.append(columns.to_time[index_row])
+        if client_id is None:
+            client_id = columns.client_id
+
+    return MeasurementColumns(pm2, pm10, from_time, to_time, client_id)
+
+
+def build_tree(base_path, interval=INDEX_MINUTES, file_name="measurements.csv"):
+    # build or refresh the manifest of every measurement file, returns the number of files indexed
+    count = 0
+    for root, dirs, names in os.walk(base_path):
+        dirs.sort()
+        if file_name not in names:
+            continue
+
+        csv_path = os.path.join(root, file_name)
+        index = load_index(csv_path)
+        if index is None or index.size != os.path.getsize(csv_path) or index.interval != interval:
+            build_index(csv_path, interval).save(index_path(csv_path))
+            count += 1
+    return count
+
+
+def benchmark(days, queries):
+    base_path = tempfile.mkdtemp()
+    try:
+        first_day = dt.date(2023, 1, 1)
+        write_synthetic_days(base_path, first_day, days)
+
+        start = time.perf_counter()
+        build_tree(base_path)
+        print(f"{days} days, indexed in {time.perf_counter() - start:.2f} s")
+
+        tz = dt.timezone(dt.timedelta(hours=1))
+        year_start = int(dt.datetime(first_day.year, first_day.month, first_day.day, tzinfo=tz).timestamp())
+        random.seed(1)
+
+        for name, length in (("1 hour", 3600), ("1 day", 86400), ("7 days", 7 * 86400)):
+            ranges = [
+                (range_start, range_start + length)
+                for range_start in (
+                    year_start + random.randrange(0, days * 86400 - length) // 60 * 60 for _ in range(queries)
+                )
+            ]
+
+            # without the index: parse every day in the range, then filter
+            start = time.perf_counter()
+            parsed_rows = 0
+            for range_start, range_end in ranges:
+                for csv_path in day_paths(base_path, range_start, range_end):
+                    columns = read_measurements_file(csv_path)
+                    parsed_rows += sum(1 for timestamp in columns.from_time if range_start <= timestamp < range_end)
+            parsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            indexed_rows = sum(len(read_range(base_path, *query).pm2) for query in ranges)
+            indexed = time.perf_counter() - start
+
+            assert parsed_rows == indexed_rows
+            print(
+                f"{name:>7} ranges: whole days {parsed / queries * 1000:7.2f} ms, "
+                f"indexed {indexed / queries * 1000:6.2f} ms per query, {parsed / indexed:5.1f}x faster"
+            )
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Index the measurement files and read time ranges from them")
+    arg_parser.add_argument("base_path", nargs="?", default=".", help="directory with the YYYY/MM/DD folders")
+    arg_parser.add_argument("--from", dest="range_from", help="start of the range, e.g. 2023-10-18T08:00+01:00")
+    arg_parser.add_argument("--to", dest="range_to", help="end of the range (exclusive)")
+    arg_parser.add_argument("--benchmark", type=int, metavar="DAYS", help="compare range reads with and without the index")
+    arg_parser.add_argument("--queries", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.queries)
+    elif args.range_from:
+        range_from = int(dt.datetime.fromisoformat(args.range_from).timestamp())
+        range_to = int(dt.datetime.fromisoformat(args.range_to).timestamp()) if args.range_to else range_from + 3600
+        columns = read_range(args.base_path, range_from, range_to)
+        tz = dt.timezone(dt.timedelta(hours=1))
+        for pm2, pm10, from_time in zip(columns.pm2, columns.pm10, columns.from_time):
+            print(f"{dt.datetime.fromtimestamp(from_time, tz).isoformat()},{pm2},{pm10}")
+    else:
+        print(f"Indexed {build_tree(args.base_path)} file(s)")
@@ -0,0 +1,367 @@
+import argparse
+import datetime as dt
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from measurement_csv import parse_timestamp, read_measurements_file, write_synthetic_days
+from rolling_average import Average, FixedWindowMean
+
+# Hour and day rollups of the minute measurements, kept next to every measurements.csv:
+#
+#   rollup-hour.csv: one row per hour of the day with measurements
+#   rollup-day.csv:  one row for the whole day
+#
+# A row has the sum, count, min and max of PM2.5 and PM10 and the coverage (count of the expected
+# minutes), so means over any number of hours or days are computed without reading minute rows.
+# RollupWriter adds every minute to the open hour and day in O(1). The two files are rewritten when
+# an hour or the day closes (and on close), the open hour is only kept in memory until then. Between
+# two writes measurements.csv is newer than the rollups, rollup_current() is False and readers use the
+# minute rows. rebuild_tree() regenerates the rollups from the measurement files in parallel.
+
+logger = logging.getLogger(__name__)
+
+HOUR_FILE = "rollup-hour.csv"
+DAY_FILE = "rollup-day.csv"
+ROLLUP_HEADER = "start,count,coverage,pm2_sum,pm2_min,pm2_max,pm10_sum,pm10_min,pm10_max"
+
+
+class Bucket:
+    __slots__ = ("start", "count", "pm2_sum", "pm2_min", "pm2_max", "pm10_sum", "pm10_min", "pm10_max")
+
+    def __init__(self, start):
+        # start in epoch seconds
+        self.start = start
+        self.count = 0
+        self.pm2_sum = 0.0
+        self.pm2_min = None
+        self.pm2_max = None
+        self.pm10_sum = 0.0
+        self.pm10_min = None
+        self.pm10_max = None
+
+    def add(self, pm2, pm10):
+        self.count += 1
+        self.pm2_sum += pm2
+        self.pm10_sum += pm10
+        if self.count == 1:
+            self.pm2_min = self.pm2_max = pm2
+            self.pm10_min = self.pm10_max = pm10
+            return
+        if pm2 < self.pm2_min:
+            self.pm2_min = pm2
+        elif pm2 > self.pm2_max:
+            self.pm2_max = pm2
+        if pm10 < self.pm10_min:
+            self.pm10_min = pm10
+        elif pm10 > self.pm10_max:
+            self.pm10_max = pm10
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.pm2_min, self.pm2_max = other.pm2_min, other.pm2_max
+            self.pm10_min, self.pm10_max = other.pm10_min, other.pm10_max
+        else:
+            self.pm2_min = min(self.pm2_min, other.pm2_min)
+            self.pm2_max = max(self.pm2_max, other.pm2_max)
+            self.pm10_min = min(self.pm10_min, other.pm10_min)
+            self.pm10_max = max(self.pm10_max, other.pm10_max)
+        self.count += other.count
+        self.pm2_sum += other.pm2_sum
+        self.pm10_sum += other.pm10_sum
+
+    def average(self, minutes):
+        # as the Average of a FixedWindowMean of minutes long windows
+        return Average(
+            self.start // 60,
+            self.pm2_sum / self.count,
+            self.pm10_sum / self.count,
+            self.count,
+            round(self.count / minutes * 100, 2),
+        )
+
+    def to_row(self, minutes, tz):
+        start = dt.datetime.fromtimestamp(self.start, tz)
+        return (
+            f"{start},{self.count},{round(self.count / minutes * 100, 2)},"
+            f"{round(self.pm2_sum, 3)},{self.pm2_min},{self.pm2_max},"
+            f"{round(self.pm10_sum, 3)},{self.pm10_min},{self.pm10_max}"
+        )
+
+    @classmethod
+    def from_row(cls, line, cache):
+        values = line.rstrip("\n").split(",")
+        bucket = cls(parse_timestamp(values[0], cache))
+        bucket.count = int(values[1])
+        bucket.pm2_sum = float(values[3])
+        bucket.pm2_min = float(values[4])
+        bucket.pm2_max = float(values[5])
+        bucket.pm10_sum = float(values[6])
+        bucket.pm10_min = float(values[7])
+        bucket.pm10_max = float(values[8])
+        return bucket
+
+
+def read_rollup_file(path):
+    # the buckets in a rollup file, oldest first, an empty list if there is no file
+    buckets = []
+    cache = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                if line.startswith("start") or not line.strip():
+                    continue
+                try:
+                    buckets.append(Bucket.from_row(line, cache))
+                except (ValueError, IndexError):
+                    logger.warning("Skipping invalid line in %s: %s", path, line.rstrip())
+    except FileNotFoundError:
+        pass
+    return buckets
+
+
+def write_rollup_file(path, buckets, minutes, tz):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(ROLLUP_HEADER)
+        f.write("\n")
+        for bucket in buckets:
+            f.write(bucket.to_row(minutes, tz))
+            f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def rollup_current(csv_path):
+    # True if the rollups of the day were written after its last measurement
+    hour_path = os.path.join(os.path.dirname(csv_path), HOUR_FILE)
+    try:
+        return os.path.getmtime(hour_path) >= os.path.getmtime(csv_path)
+    except FileNotFoundError:
+        return False
+
+
+class RollupWriter:
+    def __init__(self, base_path=".", utc_offset=dt.timedelta(hours=1), file_name="measurements.csv"):
+        self.base_path = base_path
+        self.utc_offset = utc_offset
+        self.tz = dt.timezone(utc_offset)
+        self.file_name = file_name
+
+        self._lock = threading.Lock()
+        self._day_path = None
+        self._hours = {}
+        self._day = None
+        self._hour_start = None
+        self._pending = 0
+
+    def _open(self, day_start, before):
+        # continue the rollups of the day if they were written before (restart during the day). If the
+        # process stopped without writing them, the minutes before this one are read from measurements.csv.
+        day = dt.datetime.fromtimestamp(day_start, self.tz)
+        self._day_path = os.path.join(self.base_path, f"{day.year}/{day.month:02d}/{day.day:02d}")
+        csv_path = os.path.join(self._day_path, self.file_name)
+
+        if os.path.exists(csv_path) and not rollup_current(csv_path):
+            hours, _ = rollup_columns(read_measurements_file(csv_path), self.utc_offset, before)
+        else:
+            hours = read_rollup_file(os.path.join(self._day_path, HOUR_FILE))
+
+        self._hours = {bucket.start: bucket for bucket in hours}
+        self._day = Bucket(day_start)
+        for bucket in self._hours.values():
+            self._day.merge(bucket)
+
+    def add(self, from_time, pm2, pm10):
+        # the measurement of the minute starting at from_time (datetime)
+        timestamp = int(from_time.timestamp())
+        offset = int(self.utc_offset.total_seconds())
+        day_start = (timestamp + offset) // 86400 * 86400 - offset
+        hour_start = timestamp - (timestamp + offset) % 3600
+
+        with self._lock:
+            if self._day is None or self._day.start != day_start:
+                self._flush()
+                self._open(day_start, timestamp)
+                self._hour_start = hour_start
+
+            hour = self._hours.get(hour_start)
+            if hour is None:
+                hour = self._hours[hour_start] = Bucket(hour_start)
+            hour.add(pm2, pm10)
+            self._day.add(pm2, pm10)
+            self._pending += 1
+
+            if hour_start != self._hour_start:
+                # the previous hour is closed, written together with the first minute of this one
+                self._hour_start = hour_start
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # rewrites at most 24 hour rows and the day row
+        if self._day is None or not self._pending:
+            return
+        try:
+            os.makedirs(self._day_path, exist_ok=True)
+            hours = [self._hours[start] for start in sorted(self._hours)]
+            write_rollup_file(os.path.join(self._day_path, HOUR_FILE), hours, 60, self.tz)
+            write_rollup_file(os.path.join(self._day_path, DAY_FILE), [self._day], 1440, self.tz)
+            self._pending = 0
+        except OSError as e:
+            logger.warning("Could not write rollups to %s: %s", self._day_path, e)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._day = None
+
+
+def rollup_columns(columns, utc_offset=dt.timedelta(hours=1), before=None):
+    # (hour buckets, day bucket or None) of one day of MeasurementColumns, the minutes before before
+    # (epoch seconds) if it is given
+    offset = int(utc_offset.total_seconds())
+    hours = {}
+    day = None
+    for from_time, pm2, pm10 in zip(columns.from_time, columns.pm2, columns.pm10):
+        if before is not None and from_time >= before:
+            continue
+        hour_start = from_time - (from_time + offset) % 3600
+        hour = hours.get(hour_start)
+        if hour is None:
+            hour = hours[hour_start] = Bucket(hour_start)
+        hour.add(pm2, pm10)
+        if day is None:
+            day = Bucket((from_time + offset) // 86400 * 86400 - offset)
+        day.add(pm2, pm10)
+    return [hours[start] for start in sorted(hours)], day
+
+
+def rebuild_day(csv_path, utc_offset=dt.timedelta(hours=1)):
+    # regenerate the rollups of one day from its measurements.csv, returns the number of minutes
+    hours, day = rollup_columns(read_measurements_file(csv_path), utc_offset)
+    tz = dt.timezone(utc_offset)
+    day_path = os.path.dirname(csv_path)
+    write_rollup_file(os.path.join(day_path, HOUR_FILE), hours, 60, tz)
+    write_rollup_file(os.path.join(day_path, DAY_FILE), [day] if day is not None else [], 1440, tz)
+    return day.count if day is not None else 0
+
+
+def rebuild_tree(base_path, workers=None, force=False, file_name="measurements.csv"):
+    # rebuild the rollups of every day (only the outdated ones unless force), one process per day file
+    csv_paths = sorted(
+        os.path.join(root, file_name) for root, dirs, names in os.walk(base_path) if file_name in names
+    )
+    if not force:
+        csv_paths = [csv_path for csv_path in csv_paths if not rollup_current(csv_path)]
+
+    if workers == 1:
+        return sum(rebuild_day(csv_path) for csv_path in csv_paths), len(csv_paths)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(rebuild_day, csv_paths, chunksize=8)), len(csv_paths)
+
+
+def rollup_windows(buckets, minutes, utc_offset=dt.timedelta(hours=1), start=None, end=None):
+    # merge buckets into windows of minutes (a multiple of the bucket size, aligned to local midnight),
+    # returns the Average of every window starting in start <= time < end, oldest first
+    offset = int(utc_offset.total_seconds())
+    window = minutes * 60
+
+    windows = {}
+    for bucket in buckets:
+        window_start = bucket.start - (bucket.start + offset) % window
+        if (start is not None and window_start < start) or (end is not None and window_start >= end):
+            continue
+        merged = windows.get(window_start)
+        if merged is None:
+            merged = windows[window_start] = Bucket(window_start)
+        merged.merge(bucket)
+
+    return [windows[window_start].average(minutes) for window_start in sorted(windows)]
+
+
+def read_rollups(base_path, start, end, minutes=60, utc_offset=dt.timedelta(hours=1)):
+    # the Averages of every window of minutes (a multiple of an hour) starting in start <= time < end
+    # (epoch seconds), from the rollup files only
+    tz = dt.timezone(utc_offset)
+    offset = int(utc_offset.total_seconds())
+    file_name = DAY_FILE if minutes % 1440 == 0 else HOUR_FILE
+
+    buckets = []
+    day_start = (start + offset) // 86400 * 86400 - offset
+    while day_start < end:
+        day = dt.datetime.fromtimestamp(day_start, tz)
+        buckets.extend(read_rollup_file(os.path.join(base_path, f"{day.year}/{day.month:02d}/{day.day:02d}", file_name)))
+        day_start += 86400
+
+    return rollup_windows(buckets, minutes, utc_offset, start, end)
+
+
+def benchmark(days):
+    base_path = tempfile.mkdtemp()
+    try:
+        first_day = dt.date(2023, 1, 1)
+        write_synthetic_days(base_path, first_day, days)
+
+        for workers in (1, None):
+            start = time.perf_counter()
+            minutes, files = rebuild_tree(base_path, workers=workers, force=True)
+            name = "1 process" if workers == 1 else f"{os.cpu_count()} processes"
+            print(f"rebuild {files} days ({minutes} minutes), {name:>12}: {time.perf_counter() - start:6.2f} s")
+
+        tz = dt.timezone(dt.timedelta(hours=1))
+        range_start = int(dt.datetime(first_day.year, first_day.month, first_day.day, tzinfo=tz).timestamp())
+        range_end = range_start + days * 86400
+
+        for name, minutes in (("hourly", 60), ("8 hour", 480), ("daily", 1440)):
+            # without rollups: parse the minute rows of every day and average them
+            start = time.perf_counter()
+            expected = []
+            for root, dirs, names in sorted(os.walk(base_path)):
+                if "measurements.csv" not in names:
+                    continue
+                columns = read_measurements_file(os.path.join(root, "measurements.csv"))
+                means = FixedWindowMean(minutes, 60)
+                for from_time, pm2, pm10 in zip(columns.from_time, columns.pm2, columns.pm10):
+                    closed = means.add(from_time // 60, pm2, pm10)
+                    if closed is not None:
+                        expected.append(closed)
+                expected.append(means.close())
+            from_minutes = time.perf_counter() - start
+
+            start = time.perf_counter()
+            averages = read_rollups(base_path, range_start, range_end, minutes)
+            from_rollups = time.perf_counter() - start
+
+            assert len(averages) == len(expected)
+            assert all(abs(a.pm2 - b.pm2) < 1e-3 and a.count == b.count for a, b in zip(averages, expected))
+            print(
+                f"{name:>7} means over {days} days: minute rows {from_minutes:6.2f} s, "
+                f"rollups {from_rollups:6.3f} s, {from_minutes / from_rollups:6.1f}x faster"
+            )
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build the hour and day rollups of the measurement files")
+    arg_parser.add_argument("base_path", nargs="?", default=".", help="directory with the YYYY/MM/DD folders")
+    arg_parser.add_argument("--workers", type=int, help="processes, default one per CPU")
+    arg_parser.add_argument("--force", action="store_true", help="also rebuild days whose rollups are up to date")
+    arg_parser.add_argument("--benchmark", type=int, metavar="DAYS", help="compare long range means with and without rollups")
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        start = time.perf_counter()
+        minutes, files = rebuild_tree(args.base_path, args.workers, args.force)
+        print(f"Rebuilt the rollups of {files} day(s), {minutes} minutes, in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,212 @@
+import argparse
+import datetime as dt
+import gzip
+import mmap
+import os
+import struct
+from collections import namedtuple
+from measurement_csv import read_measurements_file
+
+# Binary measurement store, one file per day next to the CSV: YYYY/MM/DD/measurements.bin
+#
+# The file starts with a 16 byte header, followed by one fixed-width record for every minute of the
+# day, so the record for a minute is always at HEADER_SIZE + minute_of_day * RECORD_SIZE and a range
+# read is a single slice. Minutes without a measurement have epoch_minute 0.
+#
+#   header: magic "AQMS", version, record size, slots per day, epoch minute of slot 0
+#   record: epoch minute (uint32), pm2 and pm10 in tenths (uint16), coverage in percent (uint8)
+#
+# A day file is 13 KB (the CSV is about 110 KB). Closed days can be gzip compressed to
+# measurements.bin.gz, those are decompressed in memory when read.
+
+MAGIC = b"AQMS"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHI4x")
+RECORD = struct.Struct("<IHHB")
+HEADER_SIZE = HEADER.size
+RECORD_SIZE = RECORD.size
+SLOTS_PER_DAY = 1440
+FILE_NAME = "measurements.bin"
+
+StoredMeasurement = namedtuple("StoredMeasurement", ["epoch_minute", "pm2", "pm10", "coverage"])
+
+
+class MeasurementStore:
+    def __init__(self, base_path=".", utc_offset=dt.timedelta(hours=1)):
+        self.base_path = base_path
+        self.utc_offset_minutes = int(utc_offset.total_seconds() // 60)
+
+        # the day file currently written to, kept open between writes
+        self._day_start = None
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._day_start = None
+
+    def day_start(self, epoch_minute):
+        # epoch minute of local midnight for the day the minute belongs to
+        local_minute = epoch_minute + self.utc_offset_minutes
+        return local_minute - local_minute % SLOTS_PER_DAY - self.utc_offset_minutes
+
+    def day_path(self, day_start):
+        day = dt.datetime.fromtimestamp(
+            (day_start + self.utc_offset_minutes) * 60, dt.timezone.utc
+        )
+        return os.path.join(self.base_path, f"{day.year}/{day.month:02d}/{day.day:02d}", FILE_NAME)
+
+    def _open_for_write(self, day_start):
+        if self._day_start == day_start:
+            return self._file
+
+        self.close()
+        file_path = self.day_path(day_start)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        if not os.path.exists(file_path) and os.path.exists(file_path + ".gz"):
+            # a late minute or a backfill for a compressed day, write into the decompressed file,
+            # a new empty file would hide the compressed minutes (reads prefer the .bin file)
+            with gzip.open(file_path + ".gz", "rb") as f:
+                data = f.read()
+            with open(file_path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(file_path + ".tmp", file_path)
+            os.remove(file_path + ".gz")
+
+        if not os.path.exists(file_path):
+            with open(file_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, SLOTS_PER_DAY, day_start))
+                f.write(bytes(SLOTS_PER_DAY * RECORD_SIZE))
+
+        self._file = open(file_path, "r+b")
+        self._day_start = day_start
+        return self._file
+
+    def write(self, epoch_minute, pm2, pm10, coverage=100, flush=True):
+        day_start = self.day_start(epoch_minute)
+        f = self._open_for_write(day_start)
+
+        f.seek(HEADER_SIZE + (epoch_minute - day_start) * RECORD_SIZE)
+        f.write(
+            RECORD.pack(
+                epoch_minute,
+                min(int(round(pm2 * 10)), 0xFFFF),
+                min(int(round(pm10 * 10)), 0xFFFF),
+                max(0, min(int(coverage), 100)),
+            )
+        )
+        if flush:
+            f.flush()
+
+    def _read_day(self, day_start):
+        # the day's file contents as a buffer, or None if there is no file
+        file_path = self.day_path(day_start)
+
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if os.path.exists(file_path + ".gz"):
+            with gzip.open(file_path + ".gz", "rb") as f:
+                return f.read()
+
+        return None
+
+    def read_range(self, start_minute, end_minute):
+        # measurements with start_minute <= epoch_minute < end_minute, oldest first
+        day_start = self.day_start(start_minute)
+
+        while day_start < end_minute:
+            data = self._read_day(day_start)
+
+            if data is not None:
+                magic, version, record_size, slots, file_day_start = HEADER.unpack_from(data, 0)
+                if magic != MAGIC or record_size != RECORD_SIZE:
+                    raise ValueError(f"Not a measurement store file: {self.day_path(day_start)}")
+
+                first = max(start_minute - day_start, 0)
+                last = min(end_minute - day_start, slots)
+
+                view = memoryview(data)[HEADER_SIZE + first * RECORD_SIZE : HEADER_SIZE + last * RECORD_SIZE]
+                for epoch_minute, pm2, pm10, coverage in RECORD.iter_unpack(view):
+                    if epoch_minute:
+                        yield StoredMeasurement(epoch_minute, pm2 / 10, pm10 / 10, coverage)
+                view.release()
+
+                if isinstance(data, mmap.mmap):
+                    data.close()
+
+            day_start += SLOTS_PER_DAY
+
+    def compress_day(self, day_start):
+        # replace a closed day file with measurements.bin.gz
+        file_path = self.day_path(day_start)
+        if self._day_start == day_start:
+            self.close()
+
+        with open(file_path, "rb") as f:
+            data = f.read()
+        with gzip.open(file_path + ".gz", "wb") as f:
+            f.write(data)
+        os.remove(file_path)
+
+
+def convert_csv(csv_path, store):
+    # write every row of a measurements.csv file into the store, returns the number of rows
+    columns = read_measurements_file(csv_path)
+
+    for pm2, pm10, from_time, to_time in zip(
+        columns.pm2, columns.pm10, columns.from_time, columns.to_time
+    ):
+        coverage = int((to_time - from_time) / 60 * 100)
+        store.write(from_time // 60, pm2, pm10, coverage, flush=False)
+
+    store.close()
+    return len(columns.pm2)
+
+
+def convert_tree(base_path, compress=False, utc_offset=dt.timedelta(hours=1)):
+    store = MeasurementStore(base_path, utc_offset)
+    today = store.day_start(int(dt.datetime.now(dt.timezone.utc).timestamp() // 60))
+
+    csv_bytes = 0
+    rows = 0
+    for root, dirs, names in sorted(os.walk(base_path)):
+        if "measurements.csv" not in names:
+            continue
+
+        csv_path = os.path.join(root, "measurements.csv")
+        csv_bytes += os.path.getsize(csv_path)
+        rows += convert_csv(csv_path, store)
+        print(f'Converted "{csv_path}"')
+
+    store_bytes = 0
+    for root, dirs, names in os.walk(base_path):
+        for name in names:
+            if name == FILE_NAME and compress:
+                file_path = os.path.join(root, name)
+                with open(file_path, "rb") as f:
+                    day_start = HEADER.unpack(f.read(HEADER_SIZE))[4]
+                if day_start < today:
+                    store.compress_day(day_start)
+                    name = name + ".gz"
+            if name in (FILE_NAME, FILE_NAME + ".gz"):
+                store_bytes += os.path.getsize(os.path.join(root, name))
+
+    print(
+        f"Converted {rows} rows, CSV: {csv_bytes} bytes, store: {store_bytes} bytes"
+        + (f" ({csv_bytes / store_bytes:.1f}x smaller)" if store_bytes else "")
+    )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Convert measurements.csv files to the binary store")
+    arg_parser.add_argument("base_path", nargs="?", default=".")
+    arg_parser.add_argument("--compress", action="store_true", help="gzip days before today")
+    args = arg_parser.parse_args()
+
+    convert_tree(args.base_path, args.compress)
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import portalocker
+import metrics
+from measurement_index import build_index, index_path, load_index
+
+# Keeps the current day's YYYY/MM/DD/measurements.csv open and rolls over to a new file at midnight.
+# Rows are buffered and written out when flush_every rows are waiting or flush_interval seconds have
+# passed since the last flush, whichever comes first. append only checks flush_interval when a row
+# arrives, run flush_periodically in the event loop so rows are also written when the sensor stops
+# sending. What a flush does depends on the sync mode:
+#
+#   none:  rows are handed to the OS when Python's file buffer is full, lost if the process dies
+#   flush: rows are written to the OS on every flush, survive a crash of the process
+#   fsync: flush and fsync, rows survive a power cut once flushed (every fsync wears the SD card)
+#
+# The file lock is only taken while flushing, once per batch instead of once per row.
+
+logger = logging.getLogger(__name__)
+
+SYNC_NONE = "none"
+SYNC_FLUSH = "flush"
+SYNC_FSYNC = "fsync"
+
+flush_seconds = metrics.histogram("writer_flush_seconds", "Time to write (and lock, flush or fsync) a batch of rows")
+rows_written = metrics.counter("writer_lines_total", "Lines (rows and headers) written to measurement files")
+
+
+class MeasurementWriter:
+    def __init__(
+        self,
+        header,
+        base_path=".",
+        file_name="measurements.csv",
+        flush_every=1,
+        flush_interval=None,
+        sync=SYNC_FLUSH,
+        lock_timeout=20,
+        index_minutes=None,
+    ):
+        self.header = header
+        self.base_path = base_path
+        self.file_name = file_name
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.sync = sync
+        self.lock_timeout = lock_timeout
+        # keep a time-range manifest (measurement_index) of the open file, with an offset every index_minutes
+        self.index_minutes = index_minutes
+
+        self._lock = threading.Lock()
+        self._day = None
+        self._file = None
+        self._rows = []
+        # epoch seconds of every buffered row, None for the header
+        self._times = []
+        self._index = None
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def file_path(self, day):
+        return os.path.join(
+            self.base_path, f"{day.year}/{day.month:02d}/{day.day:02d}", self.file_name
+        )
+
+    def _open(self, day):
+        file_path = self.file_path(day)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        self._file = open(file_path, "a")
+        self._day = day
+        self._size = self._file.tell()
+
+        if self._size == 0:
+            self._rows.insert(0, self.header)
+            self._times.insert(0, None)
+
+        if self.index_minutes is not None:
+            index = load_index(file_path)
+            if index is None or index.size != self._size or index.interval != self.index_minutes:
+                index = build_index(file_path, self.index_minutes)
+            self._index = index
+
+    def append(self, current_time, row):
+        with self._lock:
+            day = current_time.date()
+            if day != self._day:
+                # new day, write what is buffered to the old file before switching
+                self._flush_before_close()
+                self._close()
+                self._open(day)
+
+            self._rows.append(row)
+            self._times.append(int(current_time.timestamp()))
+
+            if len(self._rows) >= self.flush_every or (
+                self.flush_interval is not None
+                and time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_if_due(self):
+        # flush if flush_interval has passed since the last flush, returns the seconds until the next check
+        with self._lock:
+            remaining = self._last_flush + self.flush_interval - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._rows:
+                self._flush()
+            return self.flush_interval
+
+    async def flush_periodically(self):
+        # the flush_interval timer, the flush itself runs in a worker thread
+        while True:
+            await asyncio.sleep(await asyncio.to_thread(self.flush_if_due))
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if self._file is None or not self._rows:
+            return
+
+        try:
+            with flush_seconds.time():
+                if self.sync == SYNC_NONE:
+                    self._write_rows()
+                else:
+                    self._lock_file()
+                    try:
+                        self._write_rows()
+                        self._file.flush()
+                        if self.sync == SYNC_FSYNC:
+                            os.fsync(self._file.fileno())
+                    finally:
+                        portalocker.unlock(self._file)
+
+            rows_written.inc(len(self._rows))
+            self._update_index()
+            self._rows.clear()
+            self._times.clear()
+
+        except portalocker.exceptions.LockException:
+            # rows stay buffered and are written with the next flush
+            logger.warning("Could not acquire lock on %s within %s seconds", self._file.name, self.lock_timeout)
+
+        except Exception as e:
+            logger.exception("Could not write to %s: %s", self._file.name, e)
+
+    def _flush_before_close(self):
+        # the rows belong to the open file, if the lock could not be taken they are written without
+        # it instead of staying buffered and ending up in the next file
+        self._flush()
+        if self._file is None or not self._rows:
+            return
+
+        logger.warning("Writing %d rows to %s without the lock", len(self._rows), self._file.name)
+        try:
+            self._write_rows()
+            self._file.flush()
+            rows_written.inc(len(self._rows))
+            self._update_index()
+        except Exception as e:
+            logger.exception("Could not write to %s, %d rows lost: %s", self._file.name, len(self._rows), e)
+        self._rows.clear()
+        self._times.clear()
+
+    def _lock_file(self):
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                portalocker.lock(self._file, portalocker.LOCK_EX | portalocker.LOCK_NB)
+                return
+            except portalocker.exceptions.LockException:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _update_index(self):
+        # rows were written at self._size, the manifest is saved when a row starts a new block
+        new_block = False
+        for row, timestamp in zip(self._rows, self._times):
+            if self._index is not None and timestamp is not None:
+                new_block |= self._index.add(timestamp, self._size)
+            self._size += len(row.encode()) + 1
+
+        if self._index is not None:
+            self._index.size = self._size
+            if new_block:
+                self._save_index()
+
+    def _save_index(self):
+        try:
+            self._index.save(index_path(self._file.name))
+        except OSError as e:
+            logger.warning("Could not save index of %s: %s", self._file.name, e)
+
+    def _write_rows(self):
+        self._file.write("\n".join(self._rows))
+        self._file.write("\n")
+
+    def _close(self):
+        if self._file is not None:
+            if self._index is not None:
+                self._save_index()
+                self._index = None
+            self._file.close()
+            self._file = None
+            self._day = None
+
+    def close(self):
+        with self._lock:
+            self._flush_before_close()
+            self._close()
+
+
+def benchmark(rows):
+    # write calls are counted from /proc/self/io (Linux only)
+    def write_syscalls():
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("syscw:"):
+                    return int(line.split()[1])
+
+    os.chdir(tempfile.mkdtemp())
+    import sendDataToMiljoDir as miljodir
+    from station_daemon import CSV_HEADER
+
+    now = dt.datetime.now(miljodir.tz)
+    row = f"1.5,3.0,{miljodir.CLIENT_ID},{now},{now}"
+
+    def run(name, append, close=None):
+        shutil.rmtree(str(now.year), ignore_errors=True)
+        syscalls = write_syscalls()
+        start = time.perf_counter()
+        for _ in range(rows):
+            append(now, row)
+        if close is not None:
+            close()
+        elapsed = time.perf_counter() - start
+        syscalls = write_syscalls() - syscalls
+        print(f"{name:>28}: {elapsed / rows * 1e6:8.1f} us per append, {syscalls / rows:5.2f} write syscalls per append")
+
+    # the old save_data_to_file opened, locked and closed the file for every row, its open, close,
+    # stat, mkdir and flock calls are not included in the count
+    def legacy_save(current_time, data):
+        file_path = os.path.join(f"{current_time.year}/{current_time.month:02d}/{current_time.day:02d}", "measurements.csv")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if not os.path.exists(file_path):
+            with portalocker.Lock(file_path, mode="w", timeout=20) as f:
+                f.write(CSV_HEADER)
+                f.write("\n")
+        with portalocker.Lock(file_path, mode="a", timeout=20) as f:
+            f.write(data)
+            f.write("\n")
+
+    run("open/lock/close per row", legacy_save)
+
+    for name, flush_every, sync in (
+        ("flush every row", 1, SYNC_FLUSH),
+        ("fsync every row", 1, SYNC_FSYNC),
+        ("flush every 60 rows", 60, SYNC_FLUSH),
+        ("fsync every 60 rows", 60, SYNC_FSYNC),
+    ):
+        writer = MeasurementWriter(CSV_HEADER, flush_every=flush_every, sync=sync)
+        run(name, writer.append, writer.close)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark measurement file appends")
+    arg_parser.add_argument("--rows", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    benchmark(args.rows)
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+from collections import namedtuple
+
+# Outgoing messages waiting to be sent, kept on disk in an SQLite database (WAL mode) so they
+# survive a lost connection and a restart. Messages are sent in the order they were added. The
+# spool is bounded: when the bodies take more than max_bytes, the oldest messages are evicted.
+
+SpooledMessage = namedtuple("SpooledMessage", ["seq", "readings", "body"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    readings INTEGER NOT NULL,
+    body     BLOB    NOT NULL
+);
+"""
+
+
+class MessageSpool:
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        # used from the event loop and worker threads, all access goes through the lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+        self.count, self.bytes, self.readings = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0), COALESCE(SUM(readings), 0) FROM messages"
+        ).fetchone()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def append(self, body, readings):
+        # add a message, returns the number of readings in evicted messages
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO messages (readings, body) VALUES (?, ?)", (readings, body))
+            self.count += 1
+            self.bytes += len(body)
+            self.readings += readings
+
+            evicted = 0
+            while self.bytes > self.max_bytes and self.count > 1:
+                seq, old_readings, size = self._db.execute(
+                    "SELECT seq, readings, LENGTH(body) FROM messages ORDER BY seq LIMIT 1"
+                ).fetchone()
+                self._db.execute("DELETE FROM messages WHERE seq = ?", (seq,))
+                self.count -= 1
+                self.bytes -= size
+                self.readings -= old_readings
+                evicted += old_readings
+
+            return evicted
+
+    def peek(self, limit=1):
+        # the oldest messages, they stay in the spool until removed
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, readings, body FROM messages ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        return [SpooledMessage(seq, readings, body) for seq, readings, body in rows]
+
+    def remove(self, seq):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT readings, LENGTH(body) FROM messages WHERE seq = ?", (seq,)
+            ).fetchone()
+            if row is None:
+                return
+            self._db.execute("DELETE FROM messages WHERE seq = ?", (seq,))
+            self.count -= 1
+            self.readings -= row[0]
+            self.bytes -= row[1]
+
+    def stats(self):
+        return {"messages": self.count, "readings": self.readings, "bytes": self.bytes}
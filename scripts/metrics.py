@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters, gauges and histograms for the daemons. Metrics are registered once at import time
+# (metrics.counter("name", "help")) and updated in the hot paths. Until metrics.enable() is called
+# an update is a single attribute check, so the instrumentation can stay in the code.
+#
+# The values can be served in the Prometheus text format (serve) or written as JSON to a file
+# every interval seconds (dump_periodically).
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a fast serial read to a slow upload
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} is already registered as a {existing.kind}")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def render_prometheus(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {name: metric.value() for name, metric in list(self.metrics.items())}
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.registry = registry
+        self.count = 0
+
+    def inc(self, amount=1):
+        if self.registry.enabled:
+            self.count += amount
+
+    def value(self):
+        return self.count
+
+    def samples(self):
+        return [f"{self.name} {self.count}"]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.registry = registry
+        self.current = 0
+
+    def set(self, value):
+        if self.registry.enabled:
+            self.current = value
+
+    def value(self):
+        return self.current
+
+    def samples(self):
+        return [f"{self.name} {self.current}"]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.registry = registry
+        self.buckets = tuple(buckets)
+        # one count per bucket and one for values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        if not self.registry.enabled:
+            return
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def time(self):
+        # with histogram.time(): ... observes the seconds the block took
+        if not self.registry.enabled:
+            return _NO_TIMER
+        return _Timer(self)
+
+    def value(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "max": round(self.max, 6),
+            "buckets": dict(zip([str(bucket) for bucket in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(f'{self.name}_bucket{{le="{bucket}"}} {cumulative}')
+        samples.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        samples.append(f"{self.name}_sum {self.sum}")
+        samples.append(f"{self.name}_count {self.count}")
+        return samples
+
+
+def counter(name, help):
+    return REGISTRY._register(Counter(name, help))
+
+
+def gauge(name, help):
+    return REGISTRY._register(Gauge(name, help))
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    return REGISTRY._register(Histogram(name, help, buckets))
+
+
+def enable():
+    REGISTRY.enabled = True
+
+
+def enabled():
+    return REGISTRY.enabled
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = REGISTRY.render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(REGISTRY.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port, host="127.0.0.1"):
+    # serve /metrics (Prometheus) and /metrics.json from a background thread
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Metrics on http://%s:%d/metrics", host, server.server_address[1])
+    return server
+
+
+def write_json(path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"time": time.time(), "metrics": REGISTRY.snapshot()}, f)
+    os.replace(tmp_path, path)
+
+
+async def dump_periodically(path, interval=60):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(write_json, path)
+        except Exception as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
+
+
+def start_from_env():
+    # METRICS_PORT serves the metrics over HTTP, METRICS_FILE writes them as JSON every
+    # METRICS_INTERVAL seconds (needs a running event loop). Metrics stay disabled if neither is set.
+    port = os.getenv("METRICS_PORT")
+    path = os.getenv("METRICS_FILE")
+    if not port and not path:
+        return None
+
+    enable()
+    if port:
+        serve(int(port))
+    if path:
+        return asyncio.create_task(dump_periodically(path, float(os.getenv("METRICS_INTERVAL", "60"))))
+    return None
+
+
+def benchmark(calls):
+    registry = Registry()
+    calls_counter = Counter("calls_total", "calls", registry)
+    calls_histogram = Histogram("call_seconds", "call time", registry=registry)
+
+    def run(name):
+        start = time.perf_counter()
+        for _ in range(calls):
+            calls_counter.inc()
+            with calls_histogram.time():
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"{name:>9}: {elapsed / calls * 1e9:6.0f} ns per counter increment and timed block")
+
+    run("disabled")
+    registry.enabled = True
+    run("enabled")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the cost of the metrics")
+    arg_parser.add_argument("--calls", type=int, default=1_000_000)
+    args = arg_parser.parse_args()
+
+    benchmark(args.calls)
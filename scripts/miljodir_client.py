@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MILJODIR_API_URL = os.getenv(
+    "MILJODIR_API_URL", "https://luftmalinger-api.d.aks.miljodirektoratet.no"
+)
+
+logger = logging.getLogger(__name__)
+
+# request bodies can be sent compressed (Content-Encoding: gzip or deflate), the JSON payload
+# repeats the same keys and timestamps for every value and shrinks to about a tenth.
+# Bodies smaller than COMPRESS_MIN_SIZE are sent as they are.
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_DEFLATE = "deflate"
+COMPRESS_MIN_SIZE = 1024
+
+
+token_fetches = metrics.counter("miljodir_token_fetches_total", "Access tokens fetched from Maskinporten")
+token_fetch_seconds = metrics.histogram("miljodir_token_fetch_seconds", "Time to fetch an access token")
+request_seconds = metrics.histogram("miljodir_request_seconds", "Time of a request to the API, including retries")
+request_errors = metrics.counter("miljodir_request_errors_total", "Requests answered with a status of 400 or higher")
+request_bytes = metrics.counter("miljodir_request_bytes_total", "Bytes of request bodies sent to the API")
+
+
+def compress_body(data, encoding, level=6):
+    if encoding == COMPRESSION_GZIP:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    elif encoding == COMPRESSION_DEFLATE:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 15)
+    else:
+        raise ValueError(f"Unknown compression: {encoding}")
+    return compressor.compress(data) + compressor.flush()
+
+
+class TokenProvider:
+    # Caches the Maskinporten access token and only fetches a new one shortly before it expires.
+    # Threads asking for a token while it is being refreshed wait for that refresh instead of
+    # starting their own. If cache_path is set the token is also stored on disk, so a restart
+    # does not cost an extra token round trip.
+
+    def __init__(
+        self,
+        token_url,
+        api_key=None,
+        refresh_margin=30,
+        default_expires_in=60,
+        cache_path=None,
+        session=None,
+        timeout=None,
+    ):
+        self.token_url = token_url
+        self.api_key = api_key
+        self.refresh_margin = refresh_margin
+        self.default_expires_in = default_expires_in
+        self.cache_path = cache_path
+        self.session = session if session is not None else requests
+        self.timeout = timeout
+
+        self.fetch_count = 0
+
+        self._lock = threading.Lock()
+        self._access_token = None
+        self._expires_at = 0.0
+
+        if self.cache_path is not None:
+            self._load()
+
+    def _valid(self):
+        return self._access_token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def get_token(self):
+        if self._valid():
+            return self._access_token
+
+        with self._lock:
+            # another thread may have refreshed the token while we were waiting for the lock
+            if not self._valid():
+                self._refresh()
+
+            return self._access_token
+
+    def invalidate(self):
+        # call when the API rejects the token (401), the next get_token() fetches a new one
+        with self._lock:
+            self._access_token = None
+            self._expires_at = 0.0
+
+    def _refresh(self):
+        # update the APIKEY from the environment variable in case it has changed
+        api_key = self.api_key if self.api_key is not None else os.getenv("XAPIKEY")
+
+        logger.debug("GET: %s", self.token_url)
+        token_fetches.inc()
+        with token_fetch_seconds.time():
+            response = self.session.get(
+                self.token_url,
+                headers={"X-API-Key": api_key, "Content-Type": "application/json"},
+                verify=False,
+                timeout=self.timeout,
+            )
+        logger.info("Fetched access token, status code: %d", response.status_code)
+        response.raise_for_status()
+
+        token_response = response.json()
+        self.fetch_count += 1
+
+        self._access_token = token_response["access_token"]
+        self._expires_at = time.time() + float(
+            token_response.get("expires_in", self.default_expires_in)
+        )
+
+        if self.cache_path is not None:
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                cached = json.load(f)
+
+            self._access_token = cached["access_token"]
+            self._expires_at = float(cached["expires_at"])
+
+        except FileNotFoundError:
+            pass
+
+        except Exception as e:
+            logger.warning("Could not read token cache %s: %s", self.cache_path, e)
+
+    def _save(self):
+        try:
+            # the token gives access to the API, only the current user may read it
+            tmp_path = self.cache_path + ".tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {"access_token": self._access_token, "expires_at": self._expires_at}, f
+                )
+            os.replace(tmp_path, self.cache_path)
+
+        except Exception as e:
+            logger.exception("Exception: %s", e)
+
+
+class MiljodirClient:
+    # Client for the Miljødirektoratet provider API. All requests go through one pooled
+    # requests.Session, so the TCP and TLS connection is kept alive between calls instead of being
+    # set up again for every request. GET requests are retried with exponential backoff after
+    # connection errors and 429/5xx responses. A POST is only retried when the connection could not be
+    # made: after a read error or a 5xx the API may have stored the measurements already, the outbox
+    # sends them again on the next upload. A 401 fetches a new token and retries once.
+
+    def __init__(
+        self,
+        base_url=MILJODIR_API_URL,
+        api_key=None,
+        token_cache_path=None,
+        timeout=(5, 30),
+        retries=3,
+        backoff_factor=1,
+        pool_maxsize=4,
+        verify=False,
+        compression=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.compression = compression
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.verify = verify
+        self.session.headers["Content-Type"] = "application/json"
+
+        self.tokens = TokenProvider(
+            f"{self.base_url}/provider/maskinporten/token",
+            api_key=api_key,
+            cache_path=token_cache_path,
+            session=self.session,
+            timeout=timeout,
+        )
+
+    def request(self, method, path, extra_headers=None, **kwargs):
+        url = f"{self.base_url}{path}"
+
+        for attempt in range(2):
+            headers = {"Authorization": "Bearer " + self.tokens.get_token()}
+            if extra_headers:
+                headers.update(extra_headers)
+            logger.debug("%s: %s", method, url)
+
+            with request_seconds.time():
+                response = self.session.request(
+                    method, url, headers=headers, timeout=self.timeout, **kwargs
+                )
+            logger.log(
+                logging.WARNING if response.status_code >= 400 else logging.DEBUG,
+                "MiljoDir Response status code: %d",
+                response.status_code,
+            )
+
+            if "data" in kwargs:
+                request_bytes.inc(len(kwargs["data"]))
+            if response.status_code >= 400:
+                request_errors.inc()
+
+            if response.status_code != 401:
+                break
+
+            # token expired or revoked, get a new one and try again
+            self.tokens.invalidate()
+
+        return response
+
+    def get_last_received(self, station_id):
+        return self.request("GET", f"/provider/stations/{station_id}/last-received")
+
+    def post_measurements(self, station_id, payload):
+        # payload is either already encoded JSON (bytes) or a list of timeseries dicts
+        path = f"/provider/stations/{station_id}/measurements"
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = json.dumps(payload).encode()
+
+        if self.compression is not None and len(payload) >= COMPRESS_MIN_SIZE:
+            body = compress_body(payload, self.compression)
+            logger.debug("Compressed payload from %d to %d bytes (%s)", len(payload), len(body), self.compression)
+            return self.request(
+                "POST", path, extra_headers={"Content-Encoding": self.compression}, data=body
+            )
+
+        return self.request("POST", path, data=payload)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,255 @@
+import datetime as dt
+import logging
+import pprint
+import metrics
+from gap_fill import find_gaps
+from payload_encoder import PayloadEncoder
+
+# The Miljødirektoratet measurement payload (InputTimeSeries of InputTimeValue, like the C# classes in
+# AirQuality.Common) and Station, which sends the outbox of one sensor to its station and timeseries.
+# sendDataToMiljoDir.py has one Station, station_daemon.py one per configured sensor.
+
+logger = logging.getLogger(__name__)
+
+fill_gaps_seconds = metrics.histogram("fill_gaps_seconds", "Time of InputTimeSeries.fill_gaps")
+
+
+# Equivalent C# InputTimeValue class
+class InputTimeValue:
+    # no per-object __dict__, a day of minute values for two series is 2880 objects
+    __slots__ = ("from_time", "to_time", "value", "dataCoverage")
+
+    def __init__(
+        self, from_time, to_time, value, data_coverage=None, instrument_flag=None
+    ):
+        self.from_time = from_time
+        self.to_time = to_time
+        self.value = value
+        self.dataCoverage = data_coverage if data_coverage is not None else -9900
+        # self.instrument_flag = instrument_flag
+
+    def __str__(self):
+        return '{{"fromTime": "{}", "toTime": "{}", "value": {}, "dataCoverage": {}}}'.format(
+            self.from_time.isoformat(),
+            self.to_time.isoformat(),
+            self.value,
+            self.dataCoverage,
+            # self.instrument_flag if self.instrument_flag is not None else ""
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def to_dict(self):
+        return {
+            "fromTime": self.from_time.isoformat(),
+            "toTime": self.to_time.isoformat(),
+            "value": self.value,
+            "dataCoverage": self.dataCoverage,
+            # "instrumentFlag": self.instrument_flag,
+        }
+
+
+class InputTimeSeries:
+    def __init__(self, id, component, equipment_serial_number, time_values):
+        self.id = id
+        self.component = component
+        self.serialNumber = equipment_serial_number
+        self.timeValues = time_values
+
+    def __str__(self):
+        return '{{"id": {}, "component": "{}", "serialNumber": "{}", "timeValues": {}}}'.format(
+            self.id,
+            self.component,
+            self.serialNumber,
+            [tv.__str__() for tv in self.timeValues],
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "component": self.component,
+            "serialNumber": self.serialNumber,
+            "timeValues": [tv.to_dict() for tv in self.timeValues],
+        }
+
+    # fill in missing values with -9900, values must be sorted by from_time
+    # resolution is the interval of the series, last_sent is the from_time of the last value the API
+    # already has, so the gap between it and the first value in this series is filled as well
+    # returns the number of fill values created
+    def fill_gaps(self, resolution=dt.timedelta(minutes=1), last_sent=None):
+        if not self.timeValues:
+            return 0
+
+        with fill_gaps_seconds.time():
+            return self._fill_gaps(resolution, last_sent)
+
+    def _fill_gaps(self, resolution, last_sent):
+        step = int(resolution.total_seconds() // 60)
+        slots = [int(tv.from_time.timestamp()) // 60 for tv in self.timeValues]
+        after = int(last_sent.timestamp()) // 60 if last_sent is not None else None
+
+        filled_time_values = []
+        index = 0
+        fill_count = 0
+
+        for gap_start, gap_end in find_gaps(slots, step, after):
+            while index < len(slots) and slots[index] < gap_start:
+                filled_time_values.append(self.timeValues[index])
+                index += 1
+
+            fill_values = self._create_fill_values(gap_start, gap_end, step)
+            fill_count += len(fill_values)
+            filled_time_values.extend(fill_values)
+
+        if fill_count:
+            logger.info("Created %d fill value(s) for timeseries %d", fill_count, self.id, extra={"timeseries_id": self.id})
+            filled_time_values.extend(self.timeValues[index:])
+            self.timeValues = filled_time_values
+        return fill_count
+
+    def _create_fill_values(self, gap_start, gap_end, step):
+        tzinfo = self.timeValues[0].from_time.tzinfo
+        return [
+            InputTimeValue(
+                from_time=dt.datetime.fromtimestamp(slot * 60, tzinfo),
+                to_time=dt.datetime.fromtimestamp((slot + step) * 60, tzinfo),
+                value=-9900,
+            )
+            for slot in range(gap_start, gap_end, step)
+        ]
+
+
+def pretty_format(obj):
+    if isinstance(obj, list):
+        return "\n".join(pprint.pformat(item.__dict__) for item in obj)
+    return pprint.pformat(obj.__dict__)
+
+
+class Station:
+    # One sensor's measurements at Miljødirektoratet: the station, the PM10 and PM2.5 timeseries and
+    # the outbox they are sent from. The client is passed to every call, so all stations in a process
+    # can share one connection pool and access token.
+
+    def __init__(
+        self,
+        station_id,
+        pm10_timeseries_id,
+        pm25_timeseries_id,
+        serial_number,
+        outbox,
+        encoder=None,
+        chunk_size=360,
+    ):
+        self.station_id = station_id
+        self.pm10_timeseries_id = pm10_timeseries_id
+        self.pm25_timeseries_id = pm25_timeseries_id
+        self.serial_number = serial_number
+        self.outbox = outbox
+        self.encoder = encoder if encoder is not None else PayloadEncoder()
+        self.chunk_size = chunk_size
+
+        # every station in the process has its own metrics, like the named schedulers
+        self._fill_values_created = metrics.counter(
+            f"station_{station_id}_fill_values_total", f"Fill values created for missing minutes of station {station_id}"
+        )
+        self._outbox_backlog = metrics.gauge(
+            f"station_{station_id}_outbox_backlog", f"Measurements of station {station_id} not yet acknowledged by the API"
+        )
+
+    # last_sent is an optional dict with the from_time of the last value the API has for each timeseries id
+    def build_payload(self, pm10_time_values, pm25_time_values, last_sent=None):
+        # TODO: filter out invalid data, where dataCoverage is less than 10 (10%)
+
+        # Create the JSON payload
+        pm10_timeseries = InputTimeSeries(
+            self.pm10_timeseries_id, "PM10", self.serial_number, pm10_time_values
+        )
+        pm25_timeseries = InputTimeSeries(
+            self.pm25_timeseries_id, "PM2.5", self.serial_number, pm25_time_values
+        )
+
+        combined = [pm10_timeseries, pm25_timeseries]
+
+        # the whole request is only formatted when it is logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("request:\n%s", pretty_format(combined))
+
+        # fill gaps, including the gap from the last sent time to the first from_time in the list
+        last_sent = last_sent if last_sent is not None else {}
+        fill_count = pm25_timeseries.fill_gaps(last_sent=last_sent.get(self.pm25_timeseries_id))
+        fill_count += pm10_timeseries.fill_gaps(last_sent=last_sent.get(self.pm10_timeseries_id))
+        if fill_count:
+            self._fill_values_created.inc(fill_count)
+
+        # Encode the JSON payload, a timeseries without new values is left out
+        return self.encoder.encode(
+            [timeseries for timeseries in combined if timeseries.timeValues]
+        )
+
+    def send(self, client, pm10_time_values, pm25_time_values, last_sent=None):
+        payload = self.build_payload(pm10_time_values, pm25_time_values, last_sent)
+
+        try:
+            response = client.post_measurements(self.station_id, payload)
+            if response.status_code == 200:
+                return True
+
+        except Exception as e:
+            logger.exception("Exception: %s", e)
+
+        return False
+
+    def send_pending(self, client):
+        # send everything the API has not acknowledged yet, oldest first
+        # the acknowledged offset per timeseries replaces the old lastSent files, so an outage of any
+        # length is recovered by sending only the missing measurements
+        outbox = self.outbox
+        timeseries_ids = [self.pm10_timeseries_id, self.pm25_timeseries_id]
+
+        while True:
+            pm10_acked = outbox.acked(self.pm10_timeseries_id)
+            pm25_acked = outbox.acked(self.pm25_timeseries_id)
+
+            rows = outbox.pending(min(pm10_acked, pm25_acked), self.chunk_size)
+            if not rows:
+                return True
+
+            pm10_time_values = [
+                InputTimeValue(row.from_time, row.to_time, row.pm10, row.coverage)
+                for row in rows
+                if row.seq > pm10_acked
+            ]
+            pm25_time_values = [
+                InputTimeValue(row.from_time, row.to_time, row.pm25, row.coverage)
+                for row in rows
+                if row.seq > pm25_acked
+            ]
+
+            # the gap before the first row is filled from the last acknowledged value, but with no more
+            # than chunk_size fill values, a long outage does not turn into one huge request
+            earliest = rows[0].from_time - self.chunk_size * dt.timedelta(minutes=1)
+            last_sent = {}
+            for timeseries_id in timeseries_ids:
+                acked_time = outbox.acked_time(timeseries_id)
+                last_sent[timeseries_id] = max(acked_time, earliest) if acked_time is not None else None
+
+            if not self.send(client, pm10_time_values, pm25_time_values, last_sent):
+                return False
+
+            for timeseries_id in timeseries_ids:
+                outbox.ack(timeseries_id, rows[-1].seq)
+
+            backlog = outbox.backlog(timeseries_ids)
+            self._outbox_backlog.set(backlog)
+            logger.info(
+                "Sent %d measurements to station %d, %d left to send",
+                len(rows),
+                self.station_id,
+                backlog,
+                extra={"station_id": self.station_id},
+            )
+
+            if len(rows) < self.chunk_size:
+                outbox.prune(timeseries_ids)
+                return True
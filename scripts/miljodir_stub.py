@@ -0,0 +1,184 @@
+import argparse
+import datetime as dt
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for luftmalinger-api, used to benchmark the upload path without hitting the real API.
+# Point the scripts at it with: export MILJODIR_API_URL=http://127.0.0.1:8080
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this keep-alive connections wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _count(self, name):
+        with self.server.lock:
+            self.server.requests[name] += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        if self.path.endswith("/maskinporten/token"):
+            self._count("token")
+            self._reply(
+                200,
+                {
+                    "access_token": f"stub-token-{time.time()}",
+                    "expires_in": self.server.expires_in,
+                    "token_type": "Bearer",
+                },
+            )
+
+        elif self.path.endswith("/last-received"):
+            self._count("last-received")
+            if self.server.status is not None:
+                self._reply(self.server.status, {"error": "stub status"})
+                return
+            self._reply(
+                200,
+                [
+                    {"timeSeriesId": timeseries_id, "component": component, "lastReceived": self.server.last_received}
+                    for timeseries_id, component in ((4375, "PM10"), (4376, "PM2.5"))
+                ],
+            )
+
+        elif self.path == "/stats":
+            self._reply(200, dict(self.server.requests))
+
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if self.path.endswith("/measurements"):
+            self._count("measurements")
+            if self.server.status is not None:
+                self._reply(self.server.status, {"error": "stub status"})
+                return
+            with self.server.lock:
+                self.server.bytes_received += len(body)
+
+            # bytes_received counts what was on the wire, the body has to be valid JSON once decoded
+            encoding = self.headers.get("Content-Encoding")
+            try:
+                if encoding in ("gzip", "deflate"):
+                    body = zlib.decompress(body, 47)
+                elif encoding is not None:
+                    self._reply(415, {"error": f"unsupported Content-Encoding: {encoding}"})
+                    return
+                json.loads(body)
+            except (zlib.error, ValueError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+
+            self._reply(200, {})
+        else:
+            self._reply(404, {"error": "not found"})
+
+
+def start_stub_server(port=0, latency=0.0, expires_in=120):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    server.bytes_received = 0
+    server.latency = latency
+    server.expires_in = expires_in
+    # set to answer last-received and measurements with this status instead
+    server.status = None
+    server.last_received = dt.datetime.now(dt.timezone.utc).isoformat()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def benchmark(cycles, latency):
+    server, url = start_stub_server(latency=latency)
+    os.environ["MILJODIR_API_URL"] = url
+    os.environ.setdefault("XAPIKEY", "stub")
+
+    # imported here so MILJODIR_API_URL points at the stub, and the outbox is created in a temporary directory
+    os.chdir(tempfile.mkdtemp())
+    import sendDataToMiljoDir as miljodir
+
+    now = dt.datetime.now(miljodir.tz).replace(second=0, microsecond=0)
+
+    client = miljodir.get_client()
+
+    def run(name, fresh_token, keep_alive):
+        server.requests.clear()
+        client.tokens.invalidate()
+
+        def before_request():
+            if fresh_token:
+                client.tokens.invalidate()
+            if not keep_alive:
+                # drop pooled connections, every request opens a new one
+                client.session.close()
+
+        start = time.perf_counter()
+        for _ in range(cycles):
+            before_request()
+            miljodir.get_last_received_miljodir()
+
+            before_request()
+            pm10 = [miljodir.InputTimeValue(now, now + dt.timedelta(minutes=1), 10.0, 100)]
+            pm25 = [miljodir.InputTimeValue(now, now + dt.timedelta(minutes=1), 5.0, 100)]
+            miljodir.send_data_to_miljodir(pm10, pm25)
+
+        elapsed = time.perf_counter() - start
+        request_count = sum(server.requests.values())
+        return name, elapsed / cycles * 1000, elapsed / request_count * 1000, dict(server.requests)
+
+    results = [
+        run("token per call, new connections", True, False),
+        run("cached token, new connections", False, False),
+        run("cached token, keep-alive", False, True),
+    ]
+
+    print("")
+    for name, cycle_ms, request_ms, requests in results:
+        print(
+            f"{name:>32}: {cycle_ms:7.2f} ms per upload cycle, {request_ms:6.2f} ms per request, requests: {requests}"
+        )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Local stub for the Miljødirektoratet API")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    arg_parser.add_argument("--expires-in", type=int, default=120)
+    arg_parser.add_argument("--benchmark", type=int, metavar="CYCLES", help="run upload cycles against the stub")
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.latency)
+    else:
+        server, url = start_stub_server(args.port, args.latency, args.expires_in)
+        print(f"Miljodir stub listening on {url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
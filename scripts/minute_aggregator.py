@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from scheduler import Scheduler
+
+# Per-minute aggregates of every frame the sensor sends. The SDS011 sends about one frame per
+# second, each frame is added to the running sum, min and max of the minute it was received in,
+# so a minute costs the same memory however many frames it has. A minute is closed by the first
+# frame after it, or by a Scheduler tick at the minute boundary when the sensor has stopped sending.
+#
+# Coverage is the share of the expected frames that were received: 30 frames in a minute is 50%.
+
+logger = logging.getLogger(__name__)
+
+FRAMES_PER_MINUTE = 60
+
+MinuteAggregate = namedtuple(
+    "MinuteAggregate",
+    ["minute", "count", "coverage", "pm25", "pm25_min", "pm25_max", "pm10", "pm10_min", "pm10_max"],
+)
+
+
+class MinuteAggregator:
+    def __init__(self, frames_per_minute=FRAMES_PER_MINUTE):
+        self.frames_per_minute = frames_per_minute
+
+        # epoch minute of the open bucket, None until the first frame
+        self.minute = None
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.pm25_sum = 0.0
+        self.pm25_min = None
+        self.pm25_max = None
+        self.pm10_sum = 0.0
+        self.pm10_min = None
+        self.pm10_max = None
+
+    def add(self, pm25, pm10, timestamp):
+        # add a frame received at timestamp (epoch seconds), returns the previous minute if this closed it
+        minute = int(timestamp // 60)
+        closed = None
+        if minute != self.minute:
+            closed = self._close()
+            self.minute = minute
+
+        self.count += 1
+        self.pm25_sum += pm25
+        self.pm10_sum += pm10
+        if self.count == 1:
+            self.pm25_min = self.pm25_max = pm25
+            self.pm10_min = self.pm10_max = pm10
+        else:
+            if pm25 < self.pm25_min:
+                self.pm25_min = pm25
+            elif pm25 > self.pm25_max:
+                self.pm25_max = pm25
+            if pm10 < self.pm10_min:
+                self.pm10_min = pm10
+            elif pm10 > self.pm10_max:
+                self.pm10_max = pm10
+
+        return closed
+
+    def close_until(self, timestamp):
+        # close the open minute if timestamp is past its end, returns it or None
+        if self.minute is not None and timestamp >= (self.minute + 1) * 60:
+            closed = self._close()
+            self.minute = None
+            return closed
+        return None
+
+    def _close(self):
+        if self.minute is None or self.count == 0:
+            return None
+
+        # the sensor reports in tenths, the mean is rounded to the same resolution
+        aggregate = MinuteAggregate(
+            self.minute,
+            self.count,
+            min(100, self.count * 100 // self.frames_per_minute),
+            round(self.pm25_sum / self.count, 1),
+            self.pm25_min,
+            self.pm25_max,
+            round(self.pm10_sum / self.count, 1),
+            self.pm10_min,
+            self.pm10_max,
+        )
+        self._reset()
+        return aggregate
+
+
+async def aggregate_minutes(reader, aggregator=None, scheduler=None):
+    # yields a MinuteAggregate for every minute the reader delivered frames in, right after the minute ends
+    if aggregator is None:
+        aggregator = MinuteAggregator()
+    if scheduler is None:
+        scheduler = Scheduler(60, name="minute")
+    clock = scheduler.clock
+
+    # a minute is closed by the first frame after it, or by the scheduler at the minute boundary
+    closed = asyncio.Queue()
+
+    async def add_frames():
+        while True:
+            reading = await reader.get()
+            aggregate = aggregator.add(reading.pm25, reading.pm10, clock())
+            if aggregate is not None:
+                closed.put_nowait(aggregate)
+
+    async def close_minutes():
+        async for tick in scheduler.ticks():
+            if tick.missed:
+                logger.warning("Event loop was blocked, %d minute boundaries were missed", tick.missed)
+            aggregate = aggregator.close_until(tick.time)
+            if aggregate is not None:
+                closed.put_nowait(aggregate)
+
+    tasks = [asyncio.create_task(add_frames()), asyncio.create_task(close_minutes())]
+    try:
+        while True:
+            getter = asyncio.ensure_future(closed.get())
+            done, pending = await asyncio.wait([getter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                # a task stopped, its exception is raised here
+                getter.cancel()
+                for task in tasks:
+                    if task.done():
+                        task.result()
+            yield getter.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def benchmark(frames):
+    aggregator = MinuteAggregator()
+    values = [(i % 97 / 10, i % 89 / 10) for i in range(frames)]
+
+    start = time.perf_counter()
+    minutes = 0
+    for second, (pm25, pm10) in enumerate(values):
+        if aggregator.add(pm25, pm10, 1_700_000_000 + second) is not None:
+            minutes += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{frames} frames, {minutes} minutes closed: {elapsed / frames * 1e6:.2f} us per frame")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the minute aggregator")
+    arg_parser.add_argument("--frames", type=int, default=86_400)
+    args = arg_parser.parse_args()
+
+    benchmark(args.frames)
@@ -0,0 +1,151 @@
+import datetime as dt
+import sqlite3
+import threading
+from collections import namedtuple
+
+# Write-ahead outbox for measurements that have to be uploaded. Every measurement is appended to
+# an SQLite database (in WAL mode) before anything is sent, and every timeseries keeps the
+# sequence number of the last measurement the API acknowledged. After an outage only the rows
+# after that offset are sent again, however many days that covers.
+
+OutboxRow = namedtuple("OutboxRow", ["seq", "from_time", "to_time", "pm25", "pm10", "coverage"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    from_time  TEXT    NOT NULL,
+    from_epoch INTEGER NOT NULL,
+    to_time    TEXT    NOT NULL,
+    pm25       REAL    NOT NULL,
+    pm10       REAL    NOT NULL,
+    coverage   INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS acks (
+    timeseries_id INTEGER PRIMARY KEY,
+    seq           INTEGER NOT NULL,
+    acked_at      TEXT    NOT NULL
+);
+"""
+
+
+class Outbox:
+    def __init__(self, path):
+        self.path = path
+
+        # used from the event loop and the upload worker thread, all access goes through the lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._add_from_epoch()
+        self._db.commit()
+
+    def _add_from_epoch(self):
+        # outboxes created before from_epoch existed: add the column and fill it in once
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(measurements)")]
+        if "from_epoch" in columns:
+            return
+
+        self._db.execute("ALTER TABLE measurements ADD COLUMN from_epoch INTEGER NOT NULL DEFAULT 0")
+        self._db.executemany(
+            "UPDATE measurements SET from_epoch = ? WHERE seq = ?",
+            [
+                (int(dt.datetime.fromisoformat(from_time).timestamp()), seq)
+                for seq, from_time in self._db.execute("SELECT seq, from_time FROM measurements")
+            ],
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def append(self, from_time, to_time, pm25, pm10, coverage):
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                """
+                INSERT INTO measurements (from_time, from_epoch, to_time, pm25, pm10, coverage)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (from_time.isoformat(), int(from_time.timestamp()), to_time.isoformat(), pm25, pm10, coverage),
+            )
+            return cursor.lastrowid
+
+    def acked(self, timeseries_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT seq FROM acks WHERE timeseries_id = ?", (timeseries_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def acked_time(self, timeseries_id):
+        # from_time of the last acknowledged measurement, None if nothing is acknowledged or it was pruned
+        with self._lock:
+            row = self._db.execute(
+                "SELECT m.from_time FROM acks a JOIN measurements m ON m.seq = a.seq WHERE a.timeseries_id = ?",
+                (timeseries_id,),
+            ).fetchone()
+        return dt.datetime.fromisoformat(row[0]) if row else None
+
+    def last_seq_until(self, time):
+        # seq of the last measurement with from_time <= time, None if there is none
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(seq) FROM measurements WHERE from_epoch <= ?", (int(time.timestamp()),)
+            ).fetchone()
+        return row[0]
+
+    def ack(self, timeseries_id, seq):
+        # offsets only move forward, an old response can never cause data to be skipped or resent
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                INSERT INTO acks (timeseries_id, seq, acked_at) VALUES (?, ?, ?)
+                ON CONFLICT (timeseries_id) DO UPDATE SET seq = excluded.seq, acked_at = excluded.acked_at
+                WHERE excluded.seq > acks.seq
+                """,
+                (timeseries_id, seq, dt.datetime.now(dt.timezone.utc).isoformat()),
+            )
+
+    def pending(self, after_seq, limit):
+        # the next chunk of rows after after_seq, oldest first
+        with self._lock:
+            rows = self._db.execute(
+                """
+                SELECT seq, from_time, to_time, pm25, pm10, coverage FROM measurements
+                WHERE seq > ? ORDER BY seq LIMIT ?
+                """,
+                (after_seq, limit),
+            ).fetchall()
+
+        return [
+            OutboxRow(
+                seq,
+                dt.datetime.fromisoformat(from_time),
+                dt.datetime.fromisoformat(to_time),
+                pm25,
+                pm10,
+                coverage,
+            )
+            for seq, from_time, to_time, pm25, pm10, coverage in rows
+        ]
+
+    def backlog(self, timeseries_ids):
+        # rows that at least one of the timeseries has not acknowledged yet
+        acked = min(self.acked(timeseries_id) for timeseries_id in timeseries_ids)
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM measurements WHERE seq > ?", (acked,)
+            ).fetchone()[0]
+
+    def prune(self, timeseries_ids, keep_days=7):
+        # delete rows every timeseries has acknowledged and that are older than keep_days
+        acked = min(self.acked(timeseries_id) for timeseries_id in timeseries_ids)
+        cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=keep_days)
+
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM measurements WHERE seq <= ? AND from_epoch < ?", (acked, int(cutoff.timestamp()))
+            )
+            return cursor.rowcount
@@ -0,0 +1,130 @@
+import argparse
+import datetime as dt
+import json
+import time
+import tracemalloc
+
+# Writes the Miljødirektoratet measurements payload straight from InputTimeSeries objects, instead of
+# building a dict per value (with two isoformat() calls) and letting requests serialise it again.
+#
+# Timestamps are whole minutes, so "2023-10-18T08:" and ":00+01:00" are formatted once per hour
+# and cached, each timestamp then only formats its minute.
+
+
+class PayloadEncoder:
+    def __init__(self, max_cached_hours=10000):
+        self.max_cached_hours = max_cached_hours
+        self._hours = {}
+
+    def format_time(self, value):
+        if value.second or value.microsecond:
+            return value.isoformat()
+
+        # tzinfo is part of the key, pytz uses a different tzinfo for summer and winter time
+        key = (value.year, value.month, value.day, value.hour, value.tzinfo)
+        hour = self._hours.get(key)
+        if hour is None:
+            if len(self._hours) >= self.max_cached_hours:
+                self._hours.clear()
+            text = value.replace(minute=0).isoformat()
+            hour = self._hours[key] = (text[:14], text[16:])
+
+        return f"{hour[0]}{value.minute:02d}{hour[1]}"
+
+    def encode(self, time_series):
+        # same JSON as json.dumps([ts.to_dict() for ts in time_series]), as utf-8 bytes
+        format_time = self.format_time
+        parts = ["["]
+
+        for index, series in enumerate(time_series):
+            parts.append(
+                f'{", " if index else ""}{{"id": {series.id}, "component": {json.dumps(series.component)}, '
+                f'"serialNumber": {json.dumps(series.serialNumber)}, "timeValues": ['
+            )
+
+            separator = ""
+            for tv in series.timeValues:
+                parts.append(
+                    f'{separator}{{"fromTime": "{format_time(tv.from_time)}", "toTime": "{format_time(tv.to_time)}", '
+                    f'"value": {tv.value!r}, "dataCoverage": {tv.dataCoverage}}}'
+                )
+                separator = ", "
+
+            parts.append("]}")
+
+        parts.append("]")
+        return "".join(parts).encode()
+
+
+def benchmark(points, rounds):
+    import sendDataToMiljoDir as miljodir
+    from miljodir_station import InputTimeSeries, InputTimeValue
+
+    # the InputTimeValue from before __slots__ was added
+    class DictInputTimeValue:
+        def __init__(self, from_time, to_time, value, data_coverage=None):
+            self.from_time = from_time
+            self.to_time = to_time
+            self.value = value
+            self.dataCoverage = data_coverage if data_coverage is not None else -9900
+
+        def to_dict(self):
+            return {
+                "fromTime": self.from_time.isoformat(),
+                "toTime": self.to_time.isoformat(),
+                "value": self.value,
+                "dataCoverage": self.dataCoverage,
+            }
+
+    start_time = dt.datetime(2023, 10, 18, tzinfo=miljodir.tz)
+
+    def make_series(value_class):
+        time_values = []
+        for minute in range(points):
+            from_time = start_time + dt.timedelta(minutes=minute)
+            time_values.append(value_class(from_time, from_time + dt.timedelta(minutes=1), minute / 10, 100))
+        return [
+            InputTimeSeries(miljodir.PM10_TIMESERIES_ID, "PM10", miljodir.CLIENT_ID, time_values),
+            InputTimeSeries(miljodir.PM25_TIMESERIES_ID, "PM2.5", miljodir.CLIENT_ID, list(time_values)),
+        ]
+
+    def measure(name, value_class, encode):
+        tracemalloc.start()
+        series = make_series(value_class)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        encode(series)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            payload = encode(series)
+        elapsed = (time.perf_counter() - start) / rounds
+
+        print(
+            f"{name:>28}: {elapsed * 1000:7.2f} ms per payload, values {size / 1024:6.0f} KiB, "
+            f"encode peak {peak / 1024:6.0f} KiB, {len(payload)} bytes"
+        )
+        return payload
+
+    legacy = measure(
+        "dict values, to_dict + json",
+        DictInputTimeValue,
+        lambda series: json.dumps([ts.to_dict() for ts in series]).encode(),
+    )
+    encoder = PayloadEncoder()
+    fast = measure("slotted values, encoder", InputTimeValue, encoder.encode)
+
+    assert json.loads(legacy) == json.loads(fast)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark payload encoding")
+    arg_parser.add_argument("--points", type=int, default=1440)
+    arg_parser.add_argument("--rounds", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    benchmark(args.points, args.rounds)
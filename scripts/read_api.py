@@ -0,0 +1,330 @@
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import metrics
+from gap_fill import HOUR, MINUTE
+from measurement_csv import read_measurements_file, write_synthetic_days
+from measurement_index import read_range
+from measurement_rollup import HOUR_FILE, read_rollup_file, rollup_current, rollup_windows
+from measurement_store import MeasurementStore
+from miljodir_client import COMPRESSION_GZIP, compress_body
+from rolling_average import FixedWindowMean
+from structured_logging import setup_logging
+
+# Local HTTP/JSON API over the measurement files, so a dashboard fetches the series it shows instead
+# of whole CSV files:
+#
+#   GET /series?from=2023-10-18T00:00%2B01:00&to=2023-10-19T00:00%2B01:00&window=hour[&sensor=client-id]
+#
+# window is raw (the stored minute rows) or minute, hour, 8h or 24h: the mean of every fixed window
+# starting in the range, like FixedWindowMean and AggregateHelper. from and to are ISO 8601 or epoch
+# seconds, times without an offset are UTC+1 (a + in a query string is a space, send it as %2B, an
+# unencoded + before the offset is accepted as well). The coverage of a raw row is the share of frames the
+# minute got, from measurements.bin (measurement_store), null for minutes that are only in the CSV.
+#
+# Aggregates are computed per day and window and kept in an LRU cache. A day that has ended does not
+# change any more, its entry is kept until it is evicted. The entry of today is recomputed when the
+# day file has grown. Windows are aligned to local days (8h windows start at 00, 08 and 16).
+
+logger = logging.getLogger(__name__)
+
+RAW = "raw"
+WINDOWS = {"minute": MINUTE, "hour": HOUR, "8h": 8 * HOUR, "24h": 24 * HOUR}
+
+# raw and minute rows are read from the files for every request, larger ranges have to use a longer window
+MAX_RAW_DAYS = 31
+
+# the offset of a time whose + was decoded to a space: "2023-10-18T00:00 01:00"
+DECODED_OFFSET = re.compile(r"([T ]\d\d:\d\d(?::\d\d(?:\.\d+)?)?) (\d\d(?::?\d\d)?)$")
+
+# a day is closed this many seconds after it ended, the last minute is written shortly after midnight
+CLOSE_DELAY = 300
+
+cache_hits = metrics.counter("read_api_cache_hits_total", "Day aggregates served from the cache")
+cache_misses = metrics.counter("read_api_cache_misses_total", "Day aggregates computed from the files")
+request_seconds = metrics.histogram("read_api_request_seconds", "Time to answer a read API request")
+
+
+class AggregateCache:
+    def __init__(self, base_path=".", maxsize=2048, utc_offset=dt.timedelta(hours=1), clock=time.time):
+        self.base_path = base_path
+        self.maxsize = maxsize
+        self.utc_offset = utc_offset
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        # (day start, window) -> (file size, or None for a closed day, [Average])
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def day_start(self, timestamp):
+        # epoch seconds at local midnight of the day timestamp is in
+        offset = int(self.utc_offset.total_seconds())
+        return (timestamp + offset) // 86400 * 86400 - offset
+
+    def day_path(self, day_start):
+        day = dt.datetime.fromtimestamp(day_start, dt.timezone(self.utc_offset))
+        return os.path.join(self.base_path, f"{day.year}/{day.month:02d}/{day.day:02d}", "measurements.csv")
+
+    def day_aggregates(self, day_start, window):
+        # the window means of one day, oldest first
+        key = (day_start, window)
+        csv_path = self.day_path(day_start)
+        closed = day_start + 86400 + CLOSE_DELAY <= self.clock()
+        size = None
+        if not closed:
+            size = os.path.getsize(csv_path) if os.path.exists(csv_path) else 0
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] == size):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                cache_hits.inc()
+                return entry[1]
+
+        aggregates = self._compute(csv_path, window)
+
+        with self._lock:
+            self.misses += 1
+            cache_misses.inc()
+            self._entries[key] = (size, aggregates)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return aggregates
+
+    def _compute(self, csv_path, window):
+        if not os.path.exists(csv_path):
+            return []
+
+        if window % HOUR == 0 and rollup_current(csv_path):
+            # hours, 8 hours and days are sums of the hour rollups, the minute rows are not read
+            hours = read_rollup_file(os.path.join(os.path.dirname(csv_path), HOUR_FILE))
+            return rollup_windows(hours, window, self.utc_offset)
+
+        columns = read_measurements_file(csv_path)
+        means = FixedWindowMean(window, int(self.utc_offset.total_seconds()) // 60)
+        aggregates = []
+        for from_time, pm2, pm10 in zip(columns.from_time, columns.pm2, columns.pm10):
+            closed = means.add(from_time // 60, pm2, pm10)
+            if closed is not None:
+                aggregates.append(closed)
+
+        closed = means.close()
+        if closed is not None:
+            aggregates.append(closed)
+        return aggregates
+
+    def aggregate(self, start, end, window):
+        # the means of every window starting in start <= time < end (epoch seconds)
+        aggregates = []
+        day_start = self.day_start(start)
+        while day_start < end:
+            for average in self.day_aggregates(day_start, window):
+                if start <= average.minute * 60 < end:
+                    aggregates.append(average)
+            day_start += 86400
+        return aggregates
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def parse_time(text, utc_offset=dt.timedelta(hours=1)):
+    # ISO 8601 or epoch seconds to epoch seconds
+    if text.isdigit():
+        return int(text)
+    value = dt.datetime.fromisoformat(DECODED_OFFSET.sub(r"\1+\2", text.strip()))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone(utc_offset))
+    return int(value.timestamp())
+
+
+def series(cache, start, end, window):
+    # the JSON document for /series
+    tz = dt.timezone(cache.utc_offset)
+
+    def format_time(timestamp):
+        return dt.datetime.fromtimestamp(timestamp, tz).isoformat()
+
+    if window in (RAW, "minute") and end - start > MAX_RAW_DAYS * 86400:
+        raise ValueError(f"{window} ranges are limited to {MAX_RAW_DAYS} days, use a longer window")
+
+    if window == RAW:
+        rows = read_range(cache.base_path, start, end, cache.utc_offset)
+        store = MeasurementStore(cache.base_path, cache.utc_offset)
+        coverage = {
+            stored.epoch_minute: stored.coverage for stored in store.read_range(start // 60, (end + 59) // 60)
+        }
+        columns = ["time", "pm2", "pm10", "coverage"]
+        values = [
+            [format_time(from_time), pm2, pm10, coverage.get(from_time // 60)]
+            for pm2, pm10, from_time in zip(rows.pm2, rows.pm10, rows.from_time)
+        ]
+    else:
+        columns = ["time", "pm2", "pm10", "count", "coverage"]
+        values = [
+            [format_time(average.minute * 60), round(average.pm2, 2), round(average.pm10, 2), average.count, average.coverage]
+            for average in cache.aggregate(start, end, WINDOWS[window])
+        ]
+
+    return {"from": format_time(start), "to": format_time(end), "window": window, "columns": columns, "values": values}
+
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, document):
+        body = json.dumps(document, separators=(",", ":")).encode()
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "") and len(body) >= 1024
+        if compressed:
+            body = compress_body(body, COMPRESSION_GZIP)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if compressed:
+            self.send_header("Content-Encoding", COMPRESSION_GZIP)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        caches = self.server.caches
+
+        if url.path == "/stats":
+            self._reply(200, {sensor: cache.stats() for sensor, cache in caches.items()})
+            return
+
+        if url.path != "/series":
+            self._reply(404, {"error": "not found"})
+            return
+
+        with request_seconds.time():
+            try:
+                sensor = query.get("sensor")
+                if sensor is None and len(caches) == 1:
+                    sensor = next(iter(caches))
+                if sensor not in caches:
+                    raise ValueError(f"sensor must be one of: {', '.join(caches)}")
+                cache = caches[sensor]
+
+                window = query.get("window", "hour")
+                if window != RAW and window not in WINDOWS:
+                    raise ValueError(f"window must be one of: {RAW}, {', '.join(WINDOWS)}")
+
+                end = parse_time(query["to"], cache.utc_offset) if "to" in query else int(time.time())
+                start = parse_time(query["from"], cache.utc_offset) if "from" in query else end - 86400
+                if start >= end:
+                    raise ValueError("from must be before to")
+
+                document = series(cache, start, end, window)
+                document["sensor"] = sensor
+
+            except (KeyError, ValueError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+
+            except Exception as e:
+                logger.exception("Exception: %s", e)
+                self._reply(500, {"error": "internal error"})
+                return
+
+        self._reply(200, document)
+
+
+def serve(base_paths, port, host="127.0.0.1", maxsize=2048):
+    # base_paths maps a sensor name to the directory with its YYYY/MM/DD folders, served from a background thread
+    server = ThreadingHTTPServer((host, port), ReadApiHandler)
+    server.daemon_threads = True
+    server.caches = {sensor: AggregateCache(base_path, maxsize) for sensor, base_path in base_paths.items()}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Read API on http://%s:%d/series", host, server.server_address[1])
+    return server
+
+
+def start_from_env(base_paths):
+    # READ_API_PORT serves the measurement files, the API stays off if it is not set
+    port = os.getenv("READ_API_PORT")
+    if not port:
+        return None
+    return serve(base_paths, int(port), host=os.getenv("READ_API_HOST", "127.0.0.1"))
+
+
+def benchmark(days, requests):
+    base_path = tempfile.mkdtemp()
+    try:
+        first_day = dt.date(2023, 1, 1)
+        write_synthetic_days(base_path, first_day, days)
+        csv_bytes = sum(
+            os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(base_path) for name in names
+        )
+
+        server = serve({"bench": base_path}, 0)
+        url = f"http://127.0.0.1:{server.server_address[1]}/series"
+        start_time = f"{first_day.isoformat()}T00:00"
+        end_time = (first_day + dt.timedelta(days=days)).isoformat() + "T00:00"
+
+        def fetch(window, gzip=False):
+            request = urllib.request.Request(f"{url}?from={start_time}&to={end_time}&window={window}")
+            if gzip:
+                request.add_header("Accept-Encoding", "gzip")
+            with urllib.request.urlopen(request) as response:
+                return len(response.read())
+
+        print(f"{days} days of minute data, {csv_bytes / 1024:.0f} KiB of CSV")
+        for window in ("hour", "8h", "24h"):
+            start = time.perf_counter()
+            size = fetch(window)
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(requests):
+                fetch(window)
+            warm = (time.perf_counter() - start) / requests
+
+            print(
+                f"{window:>5}: {size / 1024:7.1f} KiB, gzip {fetch(window, gzip=True) / 1024:6.1f} KiB, "
+                f"first request {cold * 1000:7.1f} ms, cached {warm * 1000:6.2f} ms"
+            )
+        server.shutdown()
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Serve the measurement files as JSON series")
+    arg_parser.add_argument("base_path", nargs="?", default=".", help="directory with the YYYY/MM/DD folders")
+    arg_parser.add_argument("--port", type=int, default=8090)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--sensor", default="default", help="name of the sensor in /series?sensor=")
+    arg_parser.add_argument("--benchmark", type=int, metavar="DAYS", help="compare response sizes and cached timing")
+    arg_parser.add_argument("--requests", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.requests)
+    else:
+        setup_logging()
+        serve({args.sensor: args.base_path}, args.port, args.host)
+        threading.Event().wait()
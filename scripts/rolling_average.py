@@ -0,0 +1,271 @@
+import argparse
+import os
+import time
+from array import array
+from collections import namedtuple
+from gap_fill import HOUR
+from measurement_csv import read_measurements_file
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Streaming averages of the minute measurements, the same numbers as AggregateHelper in
+# AirQuality.Common, computed on the Pi one minute at a time. Times are epoch minutes.
+#
+#   MovingAverage:   simple moving average (CalculateSimpleMovingAverage) over the last window minutes
+#   FixedWindowMean: mean of every whole hour, 8 hours or day (CalculateAverageInWindow, GetHourAggregate)
+#
+# Unlike AggregateHelper the windows are measured in time, not in number of values: a window of 60
+# minutes with 45 measurements has coverage 75%. The moving average keeps its values in a ring
+# buffer with one slot per minute of the window, so adding a minute costs the same for a 24 hour
+# window as for an hour. The *_numpy functions compute the same for a whole file at once.
+
+WINDOWS = (HOUR, 8 * HOUR, 24 * HOUR)
+
+Average = namedtuple("Average", ["minute", "pm2", "pm10", "count", "coverage"])
+
+
+def _coverage(count, window):
+    return round(count / window * 100, 2)
+
+
+class MovingAverage:
+    def __init__(self, window=HOUR):
+        self.window = window
+
+        # slot minute % window holds the value of that minute, _minutes is -1 for empty slots
+        self._minutes = array("q", [-1]) * window
+        self._pm2 = array("d", [0.0]) * window
+        self._pm10 = array("d", [0.0]) * window
+
+        self.last_minute = None
+        self.count = 0
+        self.pm2_sum = 0.0
+        self.pm10_sum = 0.0
+
+        # the sums are recalculated from the buffer every window values, so rounding errors
+        # from adding and subtracting do not build up over weeks
+        self._adds = 0
+
+    def _evict(self, slot):
+        if self._minutes[slot] >= 0:
+            self._minutes[slot] = -1
+            self.count -= 1
+            self.pm2_sum -= self._pm2[slot]
+            self.pm10_sum -= self._pm10[slot]
+
+    def _resum(self):
+        self.count = 0
+        self.pm2_sum = 0.0
+        self.pm10_sum = 0.0
+        for slot, minute in enumerate(self._minutes):
+            if minute >= 0:
+                self.count += 1
+                self.pm2_sum += self._pm2[slot]
+                self.pm10_sum += self._pm10[slot]
+
+    def add(self, minute, pm2, pm10):
+        # add the value of minute, returns the average of the window ending with it
+        if self.last_minute is not None:
+            if minute <= self.last_minute:
+                raise ValueError(f"Minute {minute} is not after {self.last_minute}")
+
+            if minute - self.last_minute >= self.window:
+                # everything in the buffer is older than the window
+                for slot in range(self.window):
+                    self._minutes[slot] = -1
+                self._resum()
+            else:
+                # empty the slots of the minutes skipped over, they now belong to older values
+                for skipped in range(self.last_minute + 1, minute):
+                    self._evict(skipped % self.window)
+
+        slot = minute % self.window
+        self._evict(slot)
+        self._minutes[slot] = minute
+        self._pm2[slot] = pm2
+        self._pm10[slot] = pm10
+        self.count += 1
+        self.pm2_sum += pm2
+        self.pm10_sum += pm10
+        self.last_minute = minute
+
+        self._adds += 1
+        if self._adds >= self.window:
+            self._adds = 0
+            self._resum()
+
+        return Average(
+            minute,
+            self.pm2_sum / self.count,
+            self.pm10_sum / self.count,
+            self.count,
+            _coverage(self.count, self.window),
+        )
+
+
+class FixedWindowMean:
+    def __init__(self, window=HOUR, utc_offset_minutes=0):
+        # windows start at whole multiples of window in local time, utc_offset_minutes=60 for day windows in UTC+1
+        self.window = window
+        self.utc_offset_minutes = utc_offset_minutes
+
+        self.start = None
+        self.count = 0
+        self.pm2_sum = 0.0
+        self.pm10_sum = 0.0
+
+    def window_start(self, minute):
+        local_minute = minute + self.utc_offset_minutes
+        return local_minute - local_minute % self.window - self.utc_offset_minutes
+
+    def add(self, minute, pm2, pm10):
+        # returns the previous window when minute is the first value after it
+        start = self.window_start(minute)
+        closed = None
+        if start != self.start:
+            closed = self.close()
+            self.start = start
+
+        self.count += 1
+        self.pm2_sum += pm2
+        self.pm10_sum += pm10
+        return closed
+
+    def close(self):
+        # the open window, None if it has no values
+        if self.start is None or self.count == 0:
+            return None
+
+        closed = Average(
+            self.start,
+            self.pm2_sum / self.count,
+            self.pm10_sum / self.count,
+            self.count,
+            _coverage(self.count, self.window),
+        )
+        self.start = None
+        self.count = 0
+        self.pm2_sum = 0.0
+        self.pm10_sum = 0.0
+        return closed
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("numpy is not installed, use pip install numpy")
+
+
+def moving_average_numpy(minutes, pm2, pm10, window=HOUR):
+    # MovingAverage for a whole series, minutes sorted ascending without duplicates.
+    # returns arrays (pm2, pm10, count, coverage), one value per input minute
+    _require_numpy()
+    minutes = numpy.asarray(minutes, dtype=numpy.int64)
+    if len(minutes) == 0:
+        empty = numpy.zeros(0)
+        return empty, empty, numpy.zeros(0, dtype=numpy.int64), empty
+
+    # running totals over every minute between the first and last, missing minutes add nothing
+    index = minutes - minutes[0]
+    length = int(index[-1]) + 1
+
+    def windowed(values):
+        dense = numpy.zeros(length + 1)
+        dense[index + 1] = values
+        total = numpy.cumsum(dense)
+        return total[index + 1] - total[numpy.maximum(index + 1 - window, 0)]
+
+    count = numpy.rint(windowed(numpy.ones(len(minutes)))).astype(numpy.int64)
+    return (
+        windowed(numpy.asarray(pm2, dtype=numpy.float64)) / count,
+        windowed(numpy.asarray(pm10, dtype=numpy.float64)) / count,
+        count,
+        numpy.round(count / window * 100, 2),
+    )
+
+
+def window_mean_numpy(minutes, pm2, pm10, window=HOUR, utc_offset_minutes=0):
+    # FixedWindowMean for a whole series, minutes sorted ascending.
+    # returns arrays (start, pm2, pm10, count, coverage), one value per window with measurements
+    _require_numpy()
+    minutes = numpy.asarray(minutes, dtype=numpy.int64)
+    local_minutes = minutes + utc_offset_minutes
+    starts = local_minutes - local_minutes % window - utc_offset_minutes
+
+    start, first, count = numpy.unique(starts, return_index=True, return_counts=True)
+    if len(start) == 0:
+        empty = numpy.zeros(0)
+        return start, empty, empty, count, empty
+
+    return (
+        start,
+        numpy.add.reduceat(numpy.asarray(pm2, dtype=numpy.float64), first) / count,
+        numpy.add.reduceat(numpy.asarray(pm10, dtype=numpy.float64), first) / count,
+        count,
+        numpy.round(count / window * 100, 2),
+    )
+
+
+def read_tree(base_path):
+    # every measurements.csv in the YYYY/MM/DD tree as (minutes, pm2, pm10) arrays, oldest first
+    files = []
+    for root, dirs, names in os.walk(base_path):
+        if "measurements.csv" in names:
+            files.append(os.path.join(root, "measurements.csv"))
+
+    rows = {}
+    for file_path in files:
+        columns = read_measurements_file(file_path)
+        for pm2, pm10, from_time in zip(columns.pm2, columns.pm10, columns.from_time):
+            rows[from_time // 60] = (pm2, pm10)
+
+    minutes = array("q", sorted(rows))
+    return (
+        minutes,
+        array("d", (rows[minute][0] for minute in minutes)),
+        array("d", (rows[minute][1] for minute in minutes)),
+    )
+
+
+def benchmark(base_path, windows):
+    minutes, pm2, pm10 = read_tree(base_path)
+    print(f"{len(minutes)} minutes in {base_path}")
+
+    for window in windows:
+        moving = MovingAverage(window)
+        start = time.perf_counter()
+        for minute, pm2_value, pm10_value in zip(minutes, pm2, pm10):
+            last = moving.add(minute, pm2_value, pm10_value)
+        streaming_time = time.perf_counter() - start
+
+        fixed = FixedWindowMean(window)
+        windows_closed = 0
+        for minute, pm2_value, pm10_value in zip(minutes, pm2, pm10):
+            if fixed.add(minute, pm2_value, pm10_value) is not None:
+                windows_closed += 1
+
+        line = (
+            f"window {window:5d} min: streaming {streaming_time / max(len(minutes), 1) * 1e6:5.2f} us per minute, "
+            f"{windows_closed + 1} fixed windows"
+        )
+
+        if numpy is not None and len(minutes):
+            start = time.perf_counter()
+            numpy_pm2, numpy_pm10, count, coverage = moving_average_numpy(minutes, pm2, pm10, window)
+            numpy_time = time.perf_counter() - start
+            assert abs(numpy_pm2[-1] - last.pm2) < 1e-6 and count[-1] == last.count
+            line += f", numpy {numpy_time:6.3f} s for all"
+
+        print(line)
+        print(f"  last: {last}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Moving and fixed window averages of the measurement files")
+    arg_parser.add_argument("base_path", nargs="?", default=".")
+    arg_parser.add_argument("--window", type=int, nargs="+", default=list(WINDOWS), help="window in minutes")
+    args = arg_parser.parse_args()
+
+    benchmark(args.base_path, args.window)
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import time
+from collections import namedtuple
+import metrics
+
+# Fires at whole wall clock boundaries: every minute, every hour, every day at 07:00 (period 86400,
+# offset 6 * 3600 in UTC+1). Every boundary is computed from the previous one (boundary + period),
+# never from "now + period", so time spent processing a tick does not move the next one.
+#
+# The wait is done on the event loop's monotonic clock, in steps of at most max_sleep seconds, and
+# the wall clock is checked again after every step. When the wall clock is stepped (NTP) or the loop
+# was blocked for longer than a period, the boundaries that were passed are counted as missed and
+# skipped (or all fired at once with catch_up=True), a boundary is never fired twice.
+
+Tick = namedtuple("Tick", ["time", "lateness", "missed"])
+
+
+class Scheduler:
+    def __init__(self, period=60, offset=0, catch_up=False, max_sleep=5, clock=time.time, name=None):
+        self.period = period
+        self.offset = offset
+        self.catch_up = catch_up
+        self.max_sleep = max_sleep
+        # wall clock in epoch seconds, boundaries are whole multiples of period (plus offset) of it
+        self.clock = clock
+
+        self.fired = 0
+        self.missed = 0
+        self.lateness_sum = 0.0
+        self.lateness_max = 0.0
+
+        self._lateness = None
+        if name is not None:
+            self._lateness = metrics.histogram(
+                f"scheduler_{name}_lateness_seconds", f"Seconds between a {name} boundary and its tick"
+            )
+
+    def next_boundary(self, now):
+        # the first boundary after now
+        return (now - self.offset) // self.period * self.period + self.period + self.offset
+
+    async def _sleep_until(self, boundary):
+        while True:
+            remaining = boundary - self.clock()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, self.max_sleep))
+
+    async def ticks(self):
+        # yields a Tick for every boundary, tick.time is the boundary in epoch seconds
+        boundary = self.next_boundary(self.clock())
+
+        while True:
+            await self._sleep_until(boundary)
+
+            missed = 0
+            late = self.clock() - boundary
+            if late >= self.period and not self.catch_up:
+                missed = int(late // self.period)
+                boundary += missed * self.period
+
+            lateness = self.clock() - boundary
+            self.fired += 1
+            self.missed += missed
+            self.lateness_sum += lateness
+            self.lateness_max = max(self.lateness_max, lateness)
+            if self._lateness is not None:
+                self._lateness.observe(lateness)
+
+            yield Tick(boundary, lateness, missed)
+            boundary += self.period
+
+    def stats(self):
+        return {
+            "fired": self.fired,
+            "missed": self.missed,
+            "mean_lateness": round(self.lateness_sum / self.fired, 6) if self.fired else None,
+            "max_lateness": round(self.lateness_max, 6),
+        }
+
+
+async def benchmark(period, ticks, work):
+    # the old loop: sleep a period, then work, so every tick is later by the time the work took
+    start = time.time()
+    for index in range(ticks):
+        await asyncio.sleep(period)
+        fired = time.time()
+        await asyncio.sleep(work)
+    behind = fired - (start + ticks * period)
+
+    print(f"{ticks} ticks every {period} s, {work} s of work per tick")
+    print(f"{'sleep(period) after the work':>28}: last tick {behind:.3f} s late")
+
+    scheduler = Scheduler(period, max_sleep=period)
+    count = 0
+    async for tick in scheduler.ticks():
+        await asyncio.sleep(work)
+        count += 1
+        if count == ticks:
+            break
+    print(f"{'Scheduler':>28}: {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compare tick timing of the scheduler with a sleeping loop")
+    arg_parser.add_argument("--period", type=float, default=1.0)
+    arg_parser.add_argument("--ticks", type=int, default=20)
+    arg_parser.add_argument("--work", type=float, default=0.1, help="seconds of work per tick")
+    args = arg_parser.parse_args()
+
+    asyncio.run(benchmark(args.period, args.ticks, args.work))
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import logging
+import serial
+import metrics
+from sds011_decoder import FrameDecoder
+
+logger = logging.getLogger(__name__)
+
+SERIAL_PORT = "/dev/ttyUSB0"
+
+read_seconds = metrics.histogram("serial_read_seconds", "Time of a read from the serial port")
+bytes_read = metrics.counter("serial_bytes_total", "Bytes read from the serial port")
+frames_decoded = metrics.counter("serial_frames_total", "Frames decoded from the serial port")
+frames_dropped = metrics.counter("serial_frames_dropped_total", "Frames dropped because the reading queue was full")
+reconnects = metrics.counter("serial_reconnects_total", "Times the serial port was lost and opened again")
+
+
+class SerialFrameReader:
+    # Reads the sensor from the event loop: the port is opened non-blocking and registered with
+    # loop.add_reader, so bytes are only read when the kernel says they are there. Decoded
+    # readings are delivered through an asyncio.Queue. When the queue is full the oldest reading
+    # is dropped, a slow consumer always sees the newest data.
+    #
+    # The bytes are read with readinto straight into the decoder's buffer (FrameDecoder.read_from),
+    # through a FileIO on the port's file descriptor: pyserial's own readinto reads into a new bytes
+    # object and copies it.
+
+    def __init__(self, port=SERIAL_PORT, maxsize=120, reconnect_delay=5):
+        self.port = port
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.reconnect_delay = reconnect_delay
+        self.decoder = FrameDecoder()
+        self.dropped = 0
+
+        self._ser = None
+        self._raw = None
+        self._loop = None
+        self._reconnect_handle = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._open()
+
+    def stop(self):
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+            self._reconnect_handle = None
+        self._close()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _open(self):
+        self._reconnect_handle = None
+        try:
+            self._ser = serial.Serial(self.port, baudrate=9600, timeout=0)
+            self._raw = io.FileIO(self._ser.fileno(), "rb", closefd=False)
+            self._loop.add_reader(self._ser.fileno(), self._on_readable)
+            logger.info("Reading sensor on %s", self.port)
+
+        except (serial.SerialException, OSError) as e:
+            logger.warning("Could not open %s: %s, retrying in %s seconds", self.port, e, self.reconnect_delay)
+            self._ser = None
+            self._schedule_reconnect()
+
+    def _close(self):
+        if self._ser is None:
+            return
+
+        try:
+            self._loop.remove_reader(self._ser.fileno())
+            self._ser.close()
+        except Exception as e:
+            logger.warning("Exception: %s", e)
+
+        self._ser = None
+        self._raw = None
+
+    def _schedule_reconnect(self):
+        self._reconnect_handle = self._loop.call_later(self.reconnect_delay, self._open)
+
+    def _on_readable(self):
+        try:
+            with read_seconds.time():
+                received = self.decoder.received
+                readings = self.decoder.read_from(self._raw, self._ser.in_waiting)
+
+        except (serial.SerialException, OSError) as e:
+            # device disconnected or multiple access on port, reopen it after a delay
+            logger.warning("Lost connection to %s: %s", self.port, e)
+            reconnects.inc()
+            self._close()
+            self._schedule_reconnect()
+            return
+
+        except Exception as e:
+            logger.exception("Exception: %s", e)
+            return
+
+        bytes_read.inc(self.decoder.received - received)
+        for reading in readings:
+            frames_decoded.inc()
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+                frames_dropped.inc()
+            self.queue.put_nowait(reading)
+
+    async def get(self):
+        # next reading, in the order they were received
+        return await self.queue.get()
+
+    async def get_latest(self):
+        # newest reading, older readings waiting in the queue are discarded
+        reading = await self.queue.get()
+        while not self.queue.empty():
+            reading = self.queue.get_nowait()
+        return reading
+
+    async def readings(self):
+        while True:
+            yield await self.queue.get()
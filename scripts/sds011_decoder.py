@@ -0,0 +1,229 @@
+import argparse
+import os
+import time
+import tracemalloc
+from collections import namedtuple
+
+# SDS011 data frame (10 bytes, sent about once per second):
+#
+#   AA C0 PM25_LO PM25_HI PM10_LO PM10_HI ID_LO ID_HI CHECKSUM AB
+#
+# the checksum is the low byte of the sum of the six data bytes (PM25_LO..ID_HI)
+FRAME_LENGTH = 10
+FRAME_HEAD = 0xAA
+FRAME_TAIL = 0xAB
+COMMAND_DATA = 0xC0
+FRAME_START = bytes([FRAME_HEAD, COMMAND_DATA])
+
+Reading = namedtuple("Reading", ["pm25", "pm10", "device_id"])
+
+
+def encode_frame(pm25, pm10, device_id=0):
+    # build a valid data frame, used for replay captures and fake sensors
+    pm25_raw = int(round(pm25 * 10))
+    pm10_raw = int(round(pm10 * 10))
+    data = (
+        pm25_raw.to_bytes(2, byteorder="little")
+        + pm10_raw.to_bytes(2, byteorder="little")
+        + device_id.to_bytes(2, byteorder="little")
+    )
+    return FRAME_START + data + bytes([sum(data) & 0xFF, FRAME_TAIL])
+
+
+class FrameDecoder:
+    # Incremental decoder: bytes are copied into one preallocated buffer, frames are located by
+    # their AA C0 header and validated by checksum and tail byte. A corrupt or truncated frame
+    # only costs the bytes up to the next header, so a dropped byte no longer shifts every
+    # following frame.
+
+    def __init__(self, buffer_size=1024):
+        if buffer_size < FRAME_LENGTH * 2:
+            raise ValueError(f"buffer_size must be at least {FRAME_LENGTH * 2} bytes")
+
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+        self.received = 0
+        self.frames = 0
+        self.checksum_errors = 0
+        self.skipped_bytes = 0
+
+    def _make_room(self, size):
+        # move the unread tail to the front of the buffer so there is space for size bytes
+        if self._end + size <= len(self._buffer):
+            return
+
+        pending = self._end - self._start
+        self._buffer[0:pending] = self._view[self._start : self._end]
+        self._start = 0
+        self._end = pending
+
+        if pending + size > len(self._buffer):
+            # more unread data than we can hold, keep only the newest bytes
+            drop = pending + size - len(self._buffer)
+            self.skipped_bytes += drop
+            self._start = drop
+
+    def feed(self, data):
+        # copy data into the buffer and return all complete readings found
+        size = len(data)
+        offset = 0
+        self.received += size
+
+        readings = []
+        while offset < size:
+            chunk = min(size - offset, len(self._buffer) - FRAME_LENGTH)
+            self._make_room(chunk)
+            self._view[self._end : self._end + chunk] = data[offset : offset + chunk]
+            self._end += chunk
+            offset += chunk
+            readings.extend(self.decode())
+
+        return readings
+
+    def read_from(self, ser, available=None):
+        # bulk read from a serial port straight into the buffer, at least one frame worth of bytes
+        # available is the number of bytes waiting, read from ser.in_waiting if it is not given
+        if available is None:
+            available = ser.in_waiting
+        size = min(max(FRAME_LENGTH, available), len(self._buffer) - FRAME_LENGTH)
+        self._make_room(size)
+
+        count = ser.readinto(self._view[self._end : self._end + size])
+        if count:
+            self._end += count
+            self.received += count
+
+        return self.decode()
+
+    def decode(self):
+        buffer = self._buffer
+        readings = []
+
+        while self._end - self._start >= FRAME_LENGTH:
+            index = buffer.find(FRAME_START, self._start, self._end)
+
+            if index < 0:
+                # no header in the buffer, keep the last byte in case it is the first half of one
+                self.skipped_bytes += self._end - self._start - 1
+                self._start = self._end - 1
+                break
+
+            if index > self._start:
+                self.skipped_bytes += index - self._start
+                self._start = index
+
+            if self._end - index < FRAME_LENGTH:
+                break
+
+            checksum = sum(self._view[index + 2 : index + 8]) & 0xFF
+            if buffer[index + 8] != checksum or buffer[index + 9] != FRAME_TAIL:
+                # corrupt frame, skip the header and look for the next one
+                self.checksum_errors += 1
+                self.skipped_bytes += 1
+                self._start = index + 1
+                continue
+
+            readings.append(
+                Reading(
+                    (buffer[index + 2] | buffer[index + 3] << 8) / 10,
+                    (buffer[index + 4] | buffer[index + 5] << 8) / 10,
+                    buffer[index + 6] | buffer[index + 7] << 8,
+                )
+            )
+            self.frames += 1
+            self._start = index + FRAME_LENGTH
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        return readings
+
+    def read_frame(self, ser):
+        # block until the next valid reading has been received
+        while True:
+            readings = self.read_from(ser)
+            if readings:
+                return readings[-1]
+
+    def read_frames(self, ser):
+        while True:
+            yield from self.read_from(ser)
+
+
+def replay(file_path, chunk_size=64, decoder=None):
+    # feed a captured byte file through the decoder, as if it was read from the sensor
+    decoder = decoder if decoder is not None else FrameDecoder()
+    chunk = bytearray(chunk_size)
+    view = memoryview(chunk)
+
+    with open(file_path, "rb") as f:
+        while True:
+            count = f.readinto(chunk)
+            if not count:
+                break
+            yield from decoder.feed(view[:count])
+
+
+def write_capture(file_path, frames, corrupt_every=0):
+    # write a synthetic capture, optionally dropping a byte every n frames to exercise resync
+    with open(file_path, "wb") as f:
+        for index in range(frames):
+            frame = encode_frame(index % 1000 / 10, index % 2000 / 10, 0x1234)
+            if corrupt_every and index % corrupt_every == 0:
+                frame = frame[:4] + frame[5:]
+            f.write(frame)
+
+
+def capture(port, file_path, seconds):
+    import serial
+
+    ser = serial.Serial(port)
+    end = time.monotonic() + seconds
+
+    with open(file_path, "wb") as f:
+        while time.monotonic() < end:
+            f.write(ser.read(max(1, ser.in_waiting)))
+
+    print(f'Captured {os.path.getsize(file_path)} bytes from {port} to "{file_path}"')
+
+
+def benchmark(file_path, chunk_size):
+    decoder = FrameDecoder()
+
+    start = time.perf_counter()
+    count = sum(1 for _ in replay(file_path, chunk_size, decoder))
+    elapsed = time.perf_counter() - start
+
+    # second pass for memory, tracemalloc slows the decoder down too much for timing. The readings are
+    # not kept, so the peak is what decoding holds at once: the same for a capture of any length.
+    tracemalloc.start()
+    for _ in replay(file_path, chunk_size):
+        pass
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Frames decoded: {count}, in {elapsed:.3f} seconds, {count / elapsed:.0f} frames/sec")
+    print(
+        f"Checksum errors: {decoder.checksum_errors}, skipped bytes: {decoder.skipped_bytes}"
+    )
+    print(f"Peak traced memory while decoding: {peak / 1024:.1f} KiB, {current} bytes still allocated after")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Decode and benchmark SDS011 captures")
+    arg_parser.add_argument("file", help="captured byte file")
+    arg_parser.add_argument("--capture", metavar="PORT", help="record raw bytes from PORT")
+    arg_parser.add_argument("--seconds", type=int, default=60)
+    arg_parser.add_argument("--synthesize", type=int, metavar="FRAMES")
+    arg_parser.add_argument("--corrupt-every", type=int, default=0)
+    arg_parser.add_argument("--chunk-size", type=int, default=64)
+    args = arg_parser.parse_args()
+
+    if args.capture:
+        capture(args.capture, args.file, args.seconds)
+    elif args.synthesize:
+        write_capture(args.file, args.synthesize, args.corrupt_every)
+    else:
+        benchmark(args.file, args.chunk_size)
@@ -1,26 +1,30 @@
 import asyncio
+import logging
 import os
-import pprint
-import traceback
-import serial
+import threading
 import datetime as dt
-import requests
-import portalocker
 import urllib3
-from dateutil import parser
+import metrics
+import read_api
 from pytz import timezone
 from typing import Optional
 from typing import List
+from sds011_async import SERIAL_PORT
+from miljodir_client import MILJODIR_API_URL, MiljodirClient
+from miljodir_station import InputTimeValue, Station
+from measurement_csv import read_measurements_file
+from outbox import Outbox
+from payload_encoder import PayloadEncoder
+from station_daemon import UPLOAD_CHUNK_SIZE, Sensor, SensorConfig
+from structured_logging import setup_logging
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-ser = serial.Serial("/dev/ttyUSB0")
+logger = logging.getLogger("sendDataToMiljoDir")
 
 tz = timezone("Etc/GMT-1")
 
 CLIENT_ID = "raspberry-pi-jan"
-CSV_PAYLOAD = "{pm2},{pm10},{client_id},{fromTime},{toTime}"
-CSV_HEADER = "pm2,pm10,client_id,fromTime,toTime"
 APIKEY = os.getenv(
     "XAPIKEY"
 )  # use command export XAPIKEY=asdyoukeyhere to set the environment variable
@@ -29,103 +33,48 @@ STATION_ID_MILJODIR = 1178
 PM10_TIMESERIES_ID = 4375
 PM25_TIMESERIES_ID = 4376
 
-# Create temp arrays with InputTimeValue objects
-pm25_time_values = []
-pm10_time_values = []
-
-
-# Equivalent C# InputTimeValue class
-class InputTimeValue:
-    def __init__(
-        self, from_time, to_time, value, data_coverage=None, instrument_flag=None
-    ):
-        self.from_time = from_time
-        self.to_time = to_time
-        self.value = value
-        self.dataCoverage = data_coverage if data_coverage is not None else -9900
-        # self.instrument_flag = instrument_flag
-
-    def __str__(self):
-        return '{{"fromTime": "{}", "toTime": "{}", "value": {}, "dataCoverage": {}}}'.format(
-            self.from_time.isoformat(),
-            self.to_time.isoformat(),
-            self.value,
-            self.dataCoverage,
-            # self.instrument_flag if self.instrument_flag is not None else ""
-        )
-
-    def __repr__(self):
-        return self.__str__()
-
-    def to_dict(self):
-        return {
-            "fromTime": self.from_time.isoformat(),
-            "toTime": self.to_time.isoformat(),
-            "value": self.value,
-            "dataCoverage": self.dataCoverage,
-            # "instrumentFlag": self.instrument_flag,
-        }
-
-
-class InputTimeSeries:
-    def __init__(self, id, component, equipment_serial_number, time_values):
-        self.id = id
-        self.component = component
-        self.serialNumber = equipment_serial_number
-        self.timeValues = time_values
-
-    def __str__(self):
-        return '{{"id": {}, "component": "{}", "serialNumber": "{}", "timeValues": {}}}'.format(
-            self.id,
-            self.component,
-            self.serialNumber,
-            [tv.__str__() for tv in self.timeValues],
-        )
-
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "component": self.component,
-            "serialNumber": self.serialNumber,
-            "timeValues": [tv.to_dict() for tv in self.timeValues],
-        }
-
-    def fill_gaps(self):
-        filled_time_values = []
-        previous_to_time = None
-
-        for time_value in self.timeValues:
-            if previous_to_time is None:
-                previous_to_time = time_value.from_time
-                filled_time_values.append(time_value)
-                continue
-
-            gap_start = previous_to_time + dt.timedelta(hours=1)
-            gap_end = time_value.from_time
-
-            if gap_start < gap_end:
-                filled_time_values.extend(self._create_fill_values(gap_start, gap_end))
-
-            filled_time_values.append(time_value)
-            previous_to_time = time_value.from_time
-
-        self.timeValues = filled_time_values
-
-    # fill in missing values with -9900
-    def _create_fill_values(self, gap_start, gap_end):
-        fill_values = []
-        current_time = gap_start
-        while current_time < gap_end:
-            print(f"Creating fill value for {current_time}")
-            fill_values.append(
-                InputTimeValue(
-                    from_time=current_time,
-                    to_time=current_time + dt.timedelta(hours=1),
-                    value=-9900,
-                )
+# every measurement is stored in the outbox until the API has acknowledged it,
+# after an outage the unacknowledged measurements are sent in chunks of UPLOAD_CHUNK_SIZE
+OUTBOX_FILE = f"miljodir-station-{STATION_ID_MILJODIR}-outbox.db"
+
+# the station (with its outbox) and the client are created on first use, importing this module from
+# backfill.py or a benchmark does not create the outbox file or read the API settings
+_lock = threading.Lock()
+_station = None
+_client = None
+
+
+def get_station():
+    # the PM10 and PM2.5 timeseries of this sensor, sent from the outbox
+    global _station
+    with _lock:
+        if _station is None:
+            _station = Station(
+                STATION_ID_MILJODIR,
+                PM10_TIMESERIES_ID,
+                PM25_TIMESERIES_ID,
+                CLIENT_ID,
+                Outbox(OUTBOX_FILE),
+                # writes the JSON payload directly from the InputTimeSeries objects
+                encoder=PayloadEncoder(),
+                chunk_size=UPLOAD_CHUNK_SIZE,
             )
-            current_time += dt.timedelta(hours=1)
-        return fill_values
+        return _station
+
+
+def get_client():
+    # one client (and connection pool) for all API calls
+    # the access token is reused until it is about to expire, set MILJODIR_TOKEN_CACHE to a file path to keep it across restarts
+    # set MILJODIR_COMPRESSION to gzip or deflate to send compressed request bodies
+    global _client
+    with _lock:
+        if _client is None:
+            _client = MiljodirClient(
+                MILJODIR_API_URL,
+                token_cache_path=os.getenv("MILJODIR_TOKEN_CACHE"),
+                compression=os.getenv("MILJODIR_COMPRESSION") or None,
+            )
+        return _client
 
 
 class TimeSeriesLastReceived:
@@ -142,45 +91,6 @@ class TimeSeriesLastReceived:
         self.lastReceived = lastReceived if lastReceived else ""
 
 
-def pretty_print(obj):
-    if isinstance(obj, list):
-        for item in obj:
-            pprint.pprint(item.__dict__)
-    else:
-        pprint.pprint(obj.__dict__)
-
-
-def save_data_to_file(currentTime, data):
-    year, month, day = currentTime.year, currentTime.month, currentTime.day
-    base_path = f"{year}/{month:02d}/{day:02d}"
-
-    os.makedirs(base_path, exist_ok=True)
-    file_path = os.path.join(base_path, "measurements.csv")
-
-    timeout = 20  # Timeout in seconds
-
-    try:
-        # Check if the file exists, and write the header if it doesn't
-        if not os.path.exists(file_path):
-            with portalocker.Lock(file_path, mode="w", timeout=timeout) as f:
-                f.write(CSV_HEADER)
-                f.write("\n")
-
-        # Append the data to the file
-        with portalocker.Lock(file_path, mode="a", timeout=timeout) as f:
-            f.write(data)
-            f.write("\n")
-
-        print(f'Saved data: "{data}" to file: "{file_path}"')
-
-    except portalocker.exceptions.LockTimeout:
-        print(f"Could not acquire lock on {file_path} within {timeout} seconds")
-
-    except Exception as e:
-        print(f"Exception: {e}")
-        print(traceback.format_exc())
-
-
 def fileExist(year, month, day):
     base_path = f"{year}/{month:02d}/{day:02d}"
     file_path = os.path.join(base_path, "measurements.csv")
@@ -193,99 +103,41 @@ def fileExist(year, month, day):
 
 
 # read measurements from file, datetime is used to get measurement for that specific day
+# returns two lists with InputTimeValue objects: (pm10_time_values, pm25_time_values)
 def get_all_measurements_taken(year, month, day):
     base_path = f"{year}/{month:02d}/{day:02d}"
     file_path = os.path.join(base_path, "measurements.csv")
 
-    try:
-        with open(file_path, "r") as f:
-            content = f.readlines()
-            print(f'Read data from file: "{file_path}"')
-
-        pm10_time_values.clear()
-        pm25_time_values.clear()
-
-        # parse the data
-        for line in content:
-            # skip the header
-            if line.startswith("pm2"):
-                continue
+    pm10_time_values = []
+    pm25_time_values = []
 
-            values = line.split(",")
-
-            from_time = parser.parse(values[3])
-            to_time = parser.parse(values[4])
+    try:
+        columns = read_measurements_file(file_path)
+        logger.debug('Read data from file: "%s"', file_path)
 
-            # Calculate the total seconds of measurement
-            total_seconds = (to_time - from_time).total_seconds()
+        for pm2, pm10, from_epoch, to_epoch in zip(
+            columns.pm2, columns.pm10, columns.from_time, columns.to_time
+        ):
+            from_time = dt.datetime.fromtimestamp(from_epoch, tz)
+            to_time = dt.datetime.fromtimestamp(to_epoch, tz)
 
             # Corrected formula for coverage
-            coverage = int(total_seconds / 60 * 100)
+            coverage = int((to_epoch - from_epoch) / 60 * 100)
 
-            pm10_time_values.append(
-                InputTimeValue(from_time, to_time, float(values[0]), coverage)
-            )
-            pm25_time_values.append(
-                InputTimeValue(from_time, to_time, float(values[1]), coverage)
-            )
+            pm10_time_values.append(InputTimeValue(from_time, to_time, pm10, coverage))
+            pm25_time_values.append(InputTimeValue(from_time, to_time, pm2, coverage))
 
     except FileNotFoundError:
 
         # pm10_time_values.clear()
         # pm25_time_values.clear()
 
-        print(f"File not found: {file_path}")
-
-        # if file not found, set last sent to the next day (and then attempt to send data again for the next day)
-        # nextDay = dt.datetime(year, month, day) + dt.timedelta(days=1)
-
-        # save_last_sent_time_to_file(PM25_TIMESERIES_ID, nextDay)
-        # save_last_sent_time_to_file(PM10_TIMESERIES_ID, nextDay)
-
-    except Exception as e:
-        print(f"Exception: {e}")
-        print(traceback.format_exc())
-
-
-def save_last_sent_time_to_file(timeseriesId, lastSent):
-    # store last successful sent datetime
-    # name should be "nilu-station-" + stationId + "-timeseries-" + timeSeriesId + "-lastSent.txt";
-    # overwrite the file if it exists
-    file_name = (
-        f"miljodir-station-{STATION_ID_MILJODIR}-timeseries-{timeseriesId}-lastSent.txt"
-    )
-    print(f"Saving last sent time {lastSent}, to file: {file_name}")
-    with open(file_name, "w") as f:
-        f.write(lastSent.isoformat())
-
-
-def read_last_sent_time_from_file(timeSeriesId):
-    now_winter_time = dt.datetime.now(tz)
-    lastSent = now_winter_time - dt.timedelta(days=2)  # default to 2 days ago
-
-    try:
-        lastSentString = (
-            open(
-                f"miljodir-station-{STATION_ID_MILJODIR}-timeseries-{timeSeriesId}-lastSent.txt",
-                "r",
-            )
-            .read()
-            .strip()
-        )
-        lastSent = dt.datetime.fromisoformat(lastSentString)
-
-    except FileNotFoundError:
-        print(
-            f"File not found: miljodir-station-{STATION_ID_MILJODIR}-timeseries-{timeSeriesId}-lastSent.txt"
-        )
+        logger.debug("File not found: %s", file_path)
 
     except Exception as e:
-        print(f"Exception: {e}")
-        print(traceback.format_exc())
-
-    print(f"Last sent time for timeseries {timeSeriesId}: {lastSent}")
+        logger.exception("Exception: %s", e)
 
-    return lastSent
+    return pm10_time_values, pm25_time_values
 
 
 def parse_last_received_array(
@@ -306,38 +158,7 @@ def parse_last_received_array(
 def get_last_received_miljodir():
     try:
 
-        # update the APIKEY from the environment variable in case it has changed
-        APIKEY = os.getenv("XAPIKEY")
-
-        tokenUrl = f"https://luftmalinger-api.d.aks.miljodirektoratet.no/provider/maskinporten/token"
-        print(f"GET: {tokenUrl}, headers: {{X-API-Key: {APIKEY}}}")
-
-        # get access_token
-        tokenResponse = requests.get(
-            tokenUrl,
-            headers={"X-API-Key": APIKEY, "Content-Type": "application/json"},
-            verify=False,
-        )
-
-        print(f"MiljoDir Response status code: {tokenResponse.status_code}")
-        print(f"Token response: {tokenResponse.json()}")
-
-        access_token = tokenResponse.json()["access_token"]
-
-        lastReceivedUrl = f"https://luftmalinger-api.d.aks.miljodirektoratet.no/provider/stations/{STATION_ID_MILJODIR}/last-received"
-        print(
-            f"GET: {lastReceivedUrl}, headers: {{Authorization: Bearer {access_token}, Content-Type: application/json}}"
-        )
-
-        response = requests.get(
-            lastReceivedUrl,
-            headers={
-                "Authorization": "Bearer " + access_token,
-                "Content-Type": "application/json",
-            },
-            verify=False,
-        )
-        print(f"MiljoDir Response status code: {response.status_code}")
+        response = get_client().get_last_received(STATION_ID_MILJODIR)
 
         # set last received to 1 hour ago by default
         lastReceived = dt.datetime.now(tz) - dt.timedelta(hours=1)
@@ -354,10 +175,12 @@ def get_last_received_miljodir():
 
             # Now you can work with the list of TimeSeriesLastReceived objects
             for time_series in time_series_objects:
-                print("Time Series ID:", time_series.timeSeriesId)
-                print("Component:", time_series.component)
-                # print("AqtsGuid:", time_series.aqtsGuid)
-                print("lastReceived:", time_series.lastReceived)
+                logger.info(
+                    "Time Series ID: %s, Component: %s, lastReceived: %s",
+                    time_series.timeSeriesId,
+                    time_series.component,
+                    time_series.lastReceived,
+                )
 
                 parsedLastFromReceived = dt.datetime.fromisoformat(
                     time_series.lastReceived
@@ -368,281 +191,48 @@ def get_last_received_miljodir():
         return lastReceived
 
     except Exception as e:
-        print(f"Exception: {e}")
-        print(traceback.format_exc())
-
-
-def send_data_to_miljodir():
-    # TODO: filter out invalid data, where dataCoverage is less than 10 (10%)
-    # filtered_pm10_time_values = []
-    # for tv in pm10_time_values:
-    #     if tv.dataCoverage > 10:
-    #         pm10_time_values.append(tv)
-    #
-    # filtered_pm25_time_values = []
-    # for tv in pm25_time_values:
-    #     if tv.dataCoverage > 10:
-    #         filtered_pm25_time_values.append(tv)
+        logger.exception("Exception: %s", e)
 
-    # Create the JSON payload
-    pm10_timeseries = InputTimeSeries(
-        PM10_TIMESERIES_ID, "PM10", CLIENT_ID, pm10_time_values
-    )
-    pm25_timeseries = InputTimeSeries(
-        PM25_TIMESERIES_ID, "PM2.5", CLIENT_ID, pm25_time_values
-    )
 
-    combined = [pm10_timeseries, pm25_timeseries]
+# last_sent is an optional dict with the from_time of the last value the API has for each timeseries id
+def build_payload(pm10_time_values, pm25_time_values, last_sent=None):
+    return get_station().build_payload(pm10_time_values, pm25_time_values, last_sent)
 
-    print("")
-    print(f"request:")
-    pretty_print(combined)
-    print("")
 
-    # TODO: also need to fill gaps from the last sent time to the first from_time in the list
-
-    # fill gaps
-    pm25_timeseries.fill_gaps()
-    pm10_timeseries.fill_gaps()
-
-    # Convert your requests to dictionaries
-    pm10_request_dict = pm10_timeseries.to_dict()
-    pm25_request_dict = pm25_timeseries.to_dict()
-
-    combined_dict = [pm10_request_dict, pm25_request_dict]
-
-    try:
-
-        # update the APIKEY from the environment variable in case it has changed
-        APIKEY = os.getenv("XAPIKEY")
-
-        tokenUrl = f"https://luftmalinger-api.d.aks.miljodirektoratet.no/provider/maskinporten/token"
-        print(f"GET: {tokenUrl}, headers: {{X-API-Key: {APIKEY}}}")
-
-        # get access_token
-        tokenResponse = requests.get(
-            tokenUrl,
-            headers={"X-API-Key": APIKEY, "Content-Type": "application/json"},
-            verify=False,
-        )
-
-        print(f"MiljoDir Response status code: {tokenResponse.status_code}")
-        print(f"Token response: {tokenResponse.json()}")
-
-        access_token = tokenResponse.json()["access_token"]
-
-        measurementUrl = f"https://luftmalinger-api.d.aks.miljodirektoratet.no/provider/stations/{STATION_ID_MILJODIR}/measurements"
-        print(
-            f"POST: {measurementUrl}, headers: {{Authorization: Bearer {access_token}, Content-Type: application/json}}"
-        )
-
-        response = requests.post(
-            measurementUrl,
-            headers={
-                "Authorization": "Bearer " + access_token,
-                "Content-Type": "application/json",
-            },
-            json=combined_dict,
-            verify=False,
-        )
-        print(f"MiljoDir Response status code: {response.status_code}")
-
-        lastFromTime = pm10_time_values[pm10_time_values.__len__() - 1].from_time
-        if response.status_code == 200:
-            save_last_sent_time_to_file(PM10_TIMESERIES_ID, lastFromTime)
-            save_last_sent_time_to_file(PM25_TIMESERIES_ID, lastFromTime)
-
-        # response = requests.post(
-        #     f"https://192.168.1.12:7061/provider/stations/1179/measurements",
-        #     headers={"X-API-Key": APIKEY, "Content-Type": "application/json"},
-        #     json=combined_dict,
-        #     verify=False,
-        # )
-        # print(f"Local Network: Response status code: {response.status_code}")
-        # print("")
-
-    except Exception as e:
-        print(f"Exception: {e}")
-        print(traceback.format_exc())
+def send_data_to_miljodir(pm10_time_values, pm25_time_values, last_sent=None):
+    return get_station().send(get_client(), pm10_time_values, pm25_time_values, last_sent)
 
 
 def send_data_to_api():
-    # Check last sent time
-
-    # get last received from Miljødirektoratet
-    pm10_last_sent = get_last_received_miljodir()
-
-    # pm10_last_sent = read_last_sent_time_from_file(PM10_TIMESERIES_ID)
-    # print(f"Last sent time for PM10: {pm10_last_sent}")
-
-    if pm10_last_sent is not None:
-        # compare last sent and pm10_time_values[0].from_time
-        diff = pm10_time_values[0].from_time - pm10_last_sent
-        diffMinutes = diff.total_seconds() / 60
-        print(f"Pm10 last sent: {pm10_last_sent}, diff: {diffMinutes} minutes")
-
-        # Convert to dates to remove the time component
-        date1 = pm10_last_sent.date()
-        date2 = pm10_time_values[0].from_time.date()
-
-        if diffMinutes > 20:
-            print(
-                "More than 30 minutes since last sent, get all data from today and resend"
-            )
-
-            # read measurements from file, will get all data for today, and send up to 24 hours of minute data
-            today = dt.datetime.now(tz)
-            year, month, day = today.year, today.month, today.day
-
-            get_all_measurements_taken(year, month, day)
-            send_data_to_miljodir()
-
-        else:
-            # just send the last measurement
-            send_data_to_miljodir()
-
-        # # Check if it's the same day (ignoring hours)
-        # if date1 == date2:
-        #     print("Last sent and last measurement are on the same day.")
-
-        #     if diffMinutes > 20:
-        #         print(
-        #             "More than 30 minutes since last sent, get all data from today and resend"
-        #         )
-
-        #         # read measurements from file, will get all data for today, and send up to 24 hours of minute data
-        #         today = dt.datetime.now(tz)
-        #         year, month, day = today.year, today.month, today.day
-
-        #         get_all_measurements_taken(year, month, day)
-        #         send_data_to_miljodir()
-
-        #     else:
-        #         # just send the last measurement
-        #         send_data_to_miljodir()
-        # else:
-        #     print("The dates are not on the same day.")
-
-        #     # Calculate the exact day difference
-        #     day_difference = (date2 - date1).days
-        #     print(f"Exact day difference: {day_difference} day(s)")
-
-        #     # if it's not the same day, get the day difference and get the earlier data
-        #     # if it's 4 days ago, we go 4 days back and send all data from that day
-        #     # next check it will hopefully say last sent 3 days ago, and send all data from that day etc
-        #     # until all previous data is sent
-        #     if pm10_time_values[0].from_time.day != pm10_last_sent.day:
-        #         print(
-        #             f"Not the same day, get all data from {day_difference} day(s) ago"
-        #         )
-
-        #         # read measurements from file, will get all data for yesterday, and send up to 24 hours of minute data
-        #         previousDay = dt.datetime.now(tz) - dt.timedelta(days=day_difference)
-        #         year, month, day = previousDay.year, previousDay.month, previousDay.day
-
-        #         print(f"Get all measurements from: {year}-{month}-{day}")
-
-        #         exist = fileExist(year, month, day)
-        #         if (exist):
-        #             get_all_measurements_taken(year, month, day)
-        #             send_data_to_miljodir()
-
-        #         # manually set last sent time to the from time of the last measurement
-        #         # to avoid sending the same data again
-        #         nextDay = previousDay + dt.timedelta(days=1)
-
-        #         save_last_sent_time_to_file(PM25_TIMESERIES_ID, nextDay)
-        #         save_last_sent_time_to_file(PM10_TIMESERIES_ID, nextDay)
+    # send everything the API has not acknowledged yet, oldest first
+    return get_station().send_pending(get_client())
 
 
 async def main():
+    # LOG_LEVEL=DEBUG logs every request payload and the moving averages, LOG_FORMAT=text for plain lines
+    setup_logging()
+
     if APIKEY is None:
-        print("XAPIKEY environment variable not set")
+        logger.error("XAPIKEY environment variable not set")
         exit(1)
 
-    while True:
-
-        # Get the current time in the specified timezone
-        now = dt.datetime.now(tz)
-
-        # Calculate the seconds until the next whole minute
-        seconds_until_next_minute = 60 - now.second
-        print("Seconds until the next whole minute:", seconds_until_next_minute)
-
-        # Wait until the start of the next whole minute
-        await asyncio.sleep(seconds_until_next_minute)
-
-        # Start time of measurement (aligned with the whole minute)
-        from_time = dt.datetime.now(tz)
-        from_time = from_time.replace(second=0, microsecond=0)
-
-        print("from_time:", from_time)
-        print("Collecting and processing data...")
-
-        # [Your data collection and processing code goes here]
-        data = []
-        for index in range(0, 10):
-            # TODO: handle exception
-            # serial.serialutil.SerialException: device reports readiness to read but returned no data (device disconnected or multiple access on port?)
-
-            datum = ser.read()
-            data.append(datum)
+    # set METRICS_PORT to serve the metrics on /metrics, or METRICS_FILE to write them to a JSON file
+    metrics_task = metrics.start_from_env()
 
-        pmtwofive = int.from_bytes(b"".join(data[2:4]), byteorder="little") / 10
-        pmten = int.from_bytes(b"".join(data[4:6]), byteorder="little") / 10
+    # set READ_API_PORT to serve the measurement files as JSON series (read_api.py)
+    read_api.start_from_env({CLIENT_ID: "."})
 
-        to_time = from_time + dt.timedelta(minutes=1)
-
-        # Calculate the total seconds of measurement
-        # total_seconds = (dt.datetime.now(tz) - from_time).total_seconds()
-
-        # Corrected formula for coverage
-        # coverage = int(total_seconds / 60 * 100)
-
-        coverage = 100
-
-        print(
-            f"FromTime: {from_time}, ToTime: {to_time}, Data points: PM2.5 = {pmtwofive}, PM10 = {pmten}, Coverage: {coverage}%"
-        )
-
-        # only save and send data if coverage is above 10%
-        # if coverage > 10:
-
-        pm10_time_values.append(InputTimeValue(from_time, to_time, pmten, coverage))
-        pm25_time_values.append(InputTimeValue(from_time, to_time, pmtwofive, coverage))
-
-        cvs = CSV_PAYLOAD.format(
-            pm2=pmtwofive,
-            pm10=pmten,
-            client_id=CLIENT_ID,
-            fromTime=from_time,
-            toTime=to_time,
-        )
-
-        # TODO: do this as a background task, so we can continue to measure while saving data
-        # Save data to file
-        save_data_to_file(from_time, cvs)
-
-        # else:
-        #     print("Invalid data, coverage less than 10%, not saving to file")
-
-        # when the lists contains x items, send the data to the API
-        if pm10_time_values.__len__() >= 5:
-            # only send between 08:00 - 16:00 monday - friday
-
-            if 7 <= from_time.hour <= 15 and from_time.weekday() < 5:
-                # if fromTime.hour >= 8 and fromTime.hour <= 20:
-                # Send data to API
-                # TODO: to this as a background task, so we can continue to measure while sending data
-                send_data_to_api()
-
-            else:
-                # Handle gap in data when outside of working hours
-                print("Not sending data to API, outside of working hours")
-
-            # Clear the lists
-            pm10_time_values.clear()
-            pm25_time_values.clear()
+    # the same minute loop as station_daemon.py, for the one sensor of this station: outbox, CSV,
+    # measurements.bin and rollups every minute, uploaded from the outbox 07:00 - 16:00 monday - friday
+    config = SensorConfig(CLIENT_ID, SERIAL_PORT, STATION_ID_MILJODIR, PM10_TIMESERIES_ID, PM25_TIMESERIES_ID, ".")
+    station = get_station()
+    sensor = Sensor(config, get_client(), station.encoder, station=station)
+    try:
+        await sensor.run()
+    finally:
+        sensor.close()
+        if metrics_task is not None:
+            metrics_task.cancel()
 
 
 if __name__ == "__main__":
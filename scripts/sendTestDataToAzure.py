@@ -1,82 +1,104 @@
 import datetime
+import logging
 import os
 import asyncio
 import time
+from azure.iot.device import Message
 from azure.iot.device.aio import IoTHubDeviceClient
-import serial
-import portalocker
+from azure_sender import BatchSender
+from batch_message import CONTENT_TYPE
+from message_spool import MessageSpool
+from sds011_async import SerialFrameReader
+from structured_logging import setup_logging
+from measurement_writer import MeasurementWriter, SYNC_FLUSH
 
-ser = serial.Serial('/dev/ttyUSB0')
+logger = logging.getLogger("sendTestDataToAzure")
 
 CLIENT_ID = "raspberry-pi-jan"
 CONNECTION_STRING = os.getenv("IOTHUB_DEVICE_CONNECTION_STRING")
-JSON_PAYLOAD = '{{"pm2": {pm2}, "pm10": {pm10}, "client_id": "{client_id}"}}'
 CSV_PAYLOAD = '{pm2},{pm10},{client_id},{time}'
 CSV_HEADER = 'pm2,pm10,client_id,time'
 
-def save_data_to_file(currentTime, data):
-
-    year, month, day = currentTime.year, currentTime.month, currentTime.day
-    base_path = f"{year}/{month:02d}/{day:02d}"
-
-    os.makedirs(base_path, exist_ok=True)
-    file_path = os.path.join(base_path, "measurements.csv")
-
-    timeout = 20  # Timeout in seconds
+# readings are sent in batches (see batch_message.py), one message per MAX_BATCH readings or MAX_WAIT seconds
+MAX_BATCH = 60
+MAX_WAIT = 60
+MAX_IN_FLIGHT = 2
+COMPRESS = os.getenv("IOTHUB_COMPRESS") == "1"
 
-    try:
-        # Check if the file exists, and write the header if it doesn't
-        if not os.path.exists(file_path):
-            with portalocker.Lock(file_path, mode="w", timeout=timeout) as f:
-                f.write(CSV_HEADER)
-                f.write("\n")
+# messages are stored on disk until IoT Hub has accepted them, during an outage up to SPOOL_MAX_BYTES
+# (about eight weeks of readings), then the oldest are evicted. Sent at most DRAIN_RATE messages per second.
+SPOOL_FILE = os.getenv("IOTHUB_SPOOL", "iothub-spool.db")
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+DRAIN_RATE = 10
 
-        # Append the data to the file
-        with portalocker.Lock(file_path, mode="a", timeout=timeout) as f:
-            f.write(data)
-            f.write("\n")
+# the day file is kept open between writes, rows (one per second) are flushed once a minute
+writer = MeasurementWriter(CSV_HEADER, flush_every=60, flush_interval=60, sync=SYNC_FLUSH)
 
-        print(f"Saved data: \"{data}\" to file: \"{file_path}\"")
 
-    except portalocker.exceptions.LockTimeout:
-        print(f"Could not acquire lock on {file_path} within {timeout} seconds")
+def save_data_to_file(currentTime, data):
+    writer.append(currentTime, data)
 
 
 async def main():
+    setup_logging()
 
     # Create instance of the device client using the authentication provider
     device_client = IoTHubDeviceClient.create_from_connection_string(CONNECTION_STRING)
 
-    # Connect the device client.
-    await device_client.connect()
+    def create_message(body):
+        return Message(body, content_encoding="gzip" if COMPRESS else "utf-8", content_type=CONTENT_TYPE)
+
+    # sends in the background, reading the sensor never waits for IoT Hub
+    # the sender connects the device client, and connects again after a lost connection
+    sender = BatchSender(
+        device_client,
+        CLIENT_ID,
+        max_batch=MAX_BATCH,
+        max_wait=MAX_WAIT,
+        max_in_flight=MAX_IN_FLIGHT,
+        compress=COMPRESS,
+        message_factory=create_message,
+        spool=MessageSpool(SPOOL_FILE, max_bytes=SPOOL_MAX_BYTES),
+        drain_rate=DRAIN_RATE,
+    )
+    sender_task = asyncio.create_task(sender.run())
+
+    # rows waiting in the buffer are written after flush_interval even if no more frames arrive
+    flusher = asyncio.create_task(writer.flush_periodically())
+
+    reader = SerialFrameReader()
+    reader.start()
 
-    while True:
-        json = []
-        for index in range(0,10):
-            datum = ser.read()
-            json.append(datum)
+    async for reading in reader.readings():
 
         # get the data from the sensor
-        pmtwofive = int.from_bytes(b''.join(json[2:4]), byteorder='little') / 10
-        pmten = int.from_bytes(b''.join(json[4:6]), byteorder='little') / 10
+        pmtwofive = reading.pm25
+        pmten = reading.pm10
         currentTime = datetime.datetime.utcnow()
 
-        print(f"Time: {currentTime}, Data point: pm25 = {pmtwofive}, pm10 = {pmten}, client_id = {CLIENT_ID}")
+        logger.debug("Time: %s, Data point: pm25 = %s, pm10 = %s, client_id = %s", currentTime, pmtwofive, pmten, CLIENT_ID)
 
-        # Create the JSON and CSV payloads
-        json = JSON_PAYLOAD.format(pm2=pmtwofive, pm10=pmten, client_id=CLIENT_ID)
+        # Create the CSV payload
         cvs = CSV_PAYLOAD.format(pm2=pmtwofive, pm10=pmten, client_id=CLIENT_ID, time=currentTime)
 
         # Save data to file
-        save_data_to_file(currentTime, cvs)
+        await asyncio.to_thread(save_data_to_file, currentTime, cvs)
 
-        # Send a message to the IoT hub
-        print(f"Sending message: {json}")
-        await device_client.send_message(json)
+        # Add to the next message to the IoT hub
+        sender.add(currentTime.replace(tzinfo=datetime.timezone.utc).timestamp(), pmtwofive, pmten)
+        stats = sender.stats()
+        if stats["buffered"] == 0:
+            # a batch was just closed
+            logger.info("IoT hub: %s", stats)
 
         # time.sleep(10)
 
-    # finally, shut down the client
+    # finally, send what is left and shut down the client, what could not be sent stays in the spool
+    if not await sender.flush(timeout=30):
+        logger.warning("IoT hub: not everything was sent before shutting down: %s", sender.stats())
+    sender_task.cancel()
+    flusher.cancel()
+    writer.close()
     await device_client.shutdown()
 
 if __name__ == "__main__":
@@ -0,0 +1,277 @@
+import argparse
+import datetime as dt
+import itertools
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from measurement_csv import write_synthetic_days
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+# Loads the YYYY/MM/DD/measurements.csv history into the [dbo].[values] table of sql/create-tables.sql.
+# The files are streamed one day at a time and the rows are inserted in batches:
+#
+#   SQL Server: each batch goes into a temporary staging table (pyodbc fast_executemany, one round trip
+#               per batch) and is merged into [dbo].[values], rows whose (UtcTime, ClientId) is already
+#               there are skipped
+#   SQLite:     the same table (and unique constraint) in a local file, for tests and the benchmark,
+#               multi-row INSERT OR IGNORE statements
+#
+# Loading the same files again inserts nothing, so an interrupted load is simply started again.
+# Both file layouts are read: pm2,pm10,client_id,time (saveMeasurementsToFileContinuesly.py, UTC) and
+# pm2,pm10,client_id,fromTime,toTime (sendDataToMiljoDir.py, fromTime is the measurement time).
+
+BATCH_SIZE = 5000
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "values" (
+    Guid     TEXT    NOT NULL,
+    pm2      REAL    NOT NULL,
+    pm10     REAL    NOT NULL,
+    UtcTime  TEXT    NOT NULL,
+    UnixTime INTEGER,
+    ClientId TEXT    NOT NULL,
+    CONSTRAINT UQ_UtcTime_ClientId_Constraint UNIQUE (UtcTime, ClientId)
+);
+"""
+
+SQLSERVER_STAGING = """
+CREATE TABLE #values_staging (
+    pm2      float        NOT NULL,
+    pm10     float        NOT NULL,
+    UtcTime  datetime2(7) NOT NULL,
+    UnixTime bigint       NULL,
+    ClientId varchar(255) NOT NULL
+)
+"""
+
+# a batch can hold the same (UtcTime, ClientId) twice when a file has a duplicated line, only one is kept
+SQLSERVER_MERGE = """
+MERGE [dbo].[values] WITH (HOLDLOCK) AS target
+USING (
+    SELECT pm2, pm10, UtcTime, UnixTime, ClientId
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY UtcTime, ClientId ORDER BY UtcTime) AS n FROM #values_staging
+    ) AS numbered
+    WHERE n = 1
+) AS source
+ON target.UtcTime = source.UtcTime AND target.ClientId = source.ClientId
+WHEN NOT MATCHED THEN
+    INSERT (pm2, pm10, UtcTime, UnixTime, ClientId)
+    VALUES (source.pm2, source.pm10, source.UtcTime, source.UnixTime, source.ClientId);
+"""
+
+
+def parse_line(line):
+    # (pm2, pm10, UtcTime, UnixTime, ClientId) of a measurement line, None for the header and invalid lines
+    values = line.rstrip("\r\n").split(",")
+    if len(values) not in (4, 5) or values[0] == "pm2":
+        return None
+
+    try:
+        time_value = dt.datetime.fromisoformat(values[3])
+        if time_value.tzinfo is None:
+            # the four column files are written with utcnow()
+            time_value = time_value.replace(tzinfo=dt.timezone.utc)
+        utc_time = time_value.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        return float(values[0]), float(values[1]), utc_time, int(time_value.timestamp()), values[2].strip()
+    except ValueError:
+        return None
+
+
+def measurement_files(base_path, file_name="measurements.csv"):
+    # every day file under base_path, oldest first
+    for root, dirs, names in os.walk(base_path):
+        dirs.sort()
+        if file_name in names:
+            yield os.path.join(root, file_name)
+
+
+def read_rows(base_path, stats):
+    # streams the rows of every day file, counts files and skipped lines in stats
+    for file_path in measurement_files(base_path):
+        stats["files"] += 1
+        with open(file_path, "r") as f:
+            for line in f:
+                row = parse_line(line)
+                if row is None:
+                    if not line.startswith("pm2") and line.strip():
+                        stats["invalid"] += 1
+                    continue
+                yield row
+
+
+class SqliteValues:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SQLITE_SCHEMA)
+
+    def insert_batch(self, rows):
+        # one statement per chunk of rows, returns the number of rows inserted
+        before = self._db.total_changes
+        with self._db:
+            # SQLite allows at most 32766 parameters per statement, 6 per row
+            for start in range(0, len(rows), 5000):
+                chunk = rows[start:start + 5000]
+                self._db.execute(
+                    'INSERT OR IGNORE INTO "values" (Guid, pm2, pm10, UtcTime, UnixTime, ClientId) VALUES '
+                    + ",".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk)),
+                    [
+                        value
+                        for pm2, pm10, utc_time, unix_time, client_id in chunk
+                        for value in (str(uuid.uuid4()), pm2, pm10, utc_time.isoformat(" "), unix_time, client_id)
+                    ],
+                )
+        return self._db.total_changes - before
+
+    def insert_row(self, row):
+        # the row by row way, for the benchmark
+        pm2, pm10, utc_time, unix_time, client_id = row
+        with self._db:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO "values" (Guid, pm2, pm10, UtcTime, UnixTime, ClientId) VALUES (?, ?, ?, ?, ?, ?)',
+                (str(uuid.uuid4()), pm2, pm10, utc_time.isoformat(" "), unix_time, client_id),
+            )
+        return cursor.rowcount
+
+    def count(self):
+        return self._db.execute('SELECT COUNT(*) FROM "values"').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class SqlServerValues:
+    def __init__(self, connection_string):
+        if pyodbc is None:
+            raise ImportError("pyodbc is not installed, use pip install pyodbc")
+
+        self._db = pyodbc.connect(connection_string, autocommit=False)
+        self._cursor = self._db.cursor()
+        # the parameters of executemany are sent as one array instead of a round trip per row
+        self._cursor.fast_executemany = True
+        self._cursor.execute(SQLSERVER_STAGING)
+        self._db.commit()
+
+    def insert_batch(self, rows):
+        cursor = self._cursor
+        try:
+            cursor.execute("TRUNCATE TABLE #values_staging")
+            cursor.executemany(
+                "INSERT INTO #values_staging (pm2, pm10, UtcTime, UnixTime, ClientId) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            cursor.execute(SQLSERVER_MERGE)
+            inserted = cursor.rowcount
+            self._db.commit()
+            return inserted
+        except Exception:
+            self._db.rollback()
+            raise
+
+    def count(self):
+        return self._cursor.execute("SELECT COUNT_BIG(*) FROM [dbo].[values]").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def load(base_path, target, batch_size=BATCH_SIZE, report_every=10.0):
+    # loads every measurement file under base_path into target, returns the stats
+    stats = {"files": 0, "rows": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    start = time.perf_counter()
+    last_report = start
+
+    rows = read_rows(base_path, stats)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+
+        inserted = target.insert_batch(batch)
+        stats["rows"] += len(batch)
+        stats["inserted"] += inserted
+        stats["duplicates"] += len(batch) - inserted
+
+        now = time.perf_counter()
+        if report_every is not None and now - last_report >= report_every:
+            last_report = now
+            print(f"{stats['files']} file(s), {stats['rows']} rows, {stats['rows'] / (now - start):.0f} rows/s")
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["rows_per_second"] = round(stats["rows"] / elapsed)
+    return stats
+
+
+def benchmark(days, row_by_row_sample):
+    work_dir = tempfile.mkdtemp()
+    try:
+        base_path = os.path.join(work_dir, "measurements")
+        write_synthetic_days(base_path, dt.date(2023, 1, 1), days)
+
+        # row by row: one INSERT and one commit per row, measured on a sample and extrapolated
+        target = SqliteValues(os.path.join(work_dir, "row-by-row.db"))
+        rows = list(itertools.islice(read_rows(base_path, {"files": 0, "invalid": 0}), row_by_row_sample))
+        start = time.perf_counter()
+        for row in rows:
+            target.insert_row(row)
+        row_by_row = len(rows) / (time.perf_counter() - start)
+        target.close()
+        print(f"{'row by row':>20}: {row_by_row:9.0f} rows/s, {days * 1440 / row_by_row / 60:7.1f} minutes for {days} days")
+
+        target = SqliteValues(os.path.join(work_dir, "batched.db"))
+        for name in ("batched", "batched, loaded again"):
+            stats = load(base_path, target, report_every=None)
+            print(
+                f"{name:>20}: {stats['rows_per_second']:9.0f} rows/s, {stats['seconds'] / 60:7.1f} minutes for {days} days, "
+                f"{stats['inserted']} inserted, {stats['duplicates']} duplicates"
+            )
+        assert target.count() == days * 1440
+        target.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load the measurement files into the [dbo].[values] table")
+    arg_parser.add_argument("base_path", nargs="?", default=".", help="directory with the YYYY/MM/DD folders")
+    arg_parser.add_argument("--sqlite", metavar="FILE", help="load into a local SQLite file instead of SQL Server")
+    arg_parser.add_argument(
+        "--connection",
+        default=os.getenv("SQL_CONNECTION_STRING"),
+        help="ODBC connection string, default SQL_CONNECTION_STRING, e.g. "
+        "Driver={ODBC Driver 18 for SQL Server};Server=tcp:your-server.database.windows.net,1433;Database=...;Uid=...;Pwd=...",
+    )
+    arg_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    arg_parser.add_argument("--benchmark", type=int, metavar="DAYS", help="compare row by row and batched loads into SQLite")
+    arg_parser.add_argument("--sample", type=int, default=2000, help="rows inserted row by row in the benchmark")
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.sample)
+    else:
+        if args.sqlite:
+            target = SqliteValues(args.sqlite)
+        elif args.connection:
+            target = SqlServerValues(args.connection)
+        else:
+            arg_parser.error("--sqlite or --connection (SQL_CONNECTION_STRING) is needed")
+
+        try:
+            stats = load(args.base_path, target, args.batch_size)
+        finally:
+            target.close()
+        print(
+            f"Loaded {stats['files']} file(s): {stats['rows']} rows, {stats['inserted']} inserted, "
+            f"{stats['duplicates']} already there, {stats['invalid']} invalid lines, "
+            f"{stats['seconds']} s, {stats['rows_per_second']} rows/s"
+        )
@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+import metrics
+import read_api
+from pytz import timezone
+from fake_sds011 import open_fake_sensor
+from measurement_index import INDEX_MINUTES
+from measurement_rollup import RollupWriter
+from measurement_store import MeasurementStore
+from measurement_writer import MeasurementWriter, SYNC_FLUSH
+from miljodir_client import MILJODIR_API_URL, MiljodirClient
+from miljodir_station import Station
+from minute_aggregator import MinuteAggregator, aggregate_minutes
+from outbox import Outbox
+from payload_encoder import PayloadEncoder
+from rolling_average import WINDOWS, MovingAverage
+from scheduler import Scheduler
+from sds011_async import SerialFrameReader
+from sds011_decoder import encode_frame
+from structured_logging import setup_logging
+from upload_queue import UploadQueue, upload_worker
+
+# Runs any number of SDS011 sensors in one process, configured in a JSON file:
+#
+#   {
+#     "sensors": [
+#       {"client_id": "raspberry-pi-jan", "port": "/dev/ttyUSB0",
+#        "station_id": 1178, "pm10_timeseries_id": 4375, "pm25_timeseries_id": 4376},
+#       {"client_id": "raspberry-pi-jan-2", "port": "/dev/ttyUSB1"}
+#     ]
+#   }
+#
+# Every sensor has its own reader, minute scheduler, minute aggregates, measurement files (under
+# base_path, default the client id) and outbox, and is uploaded by its own worker. A sensor without
+# station_id is only stored. The event loop, the worker threads and the Miljødirektoratet client
+# (connection pool and access token) are shared, so a sensor costs a few objects instead of a process.
+# sendDataToMiljoDir.py runs the same Sensor loop for its one sensor.
+
+logger = logging.getLogger("station_daemon")
+
+tz = timezone("Etc/GMT-1")
+
+CSV_PAYLOAD = "{pm2},{pm10},{client_id},{fromTime},{toTime}"
+CSV_HEADER = "pm2,pm10,client_id,fromTime,toTime"
+UPLOAD_CHUNK_SIZE = 360
+UPLOAD_QUEUE_SIZE = 1440
+
+cycle_seconds = metrics.histogram("cycle_seconds", "Time to store a minute, from the end of the minute")
+save_seconds = metrics.histogram("save_seconds", "Time to save a minute to the outbox and the measurement files")
+upload_seconds = metrics.histogram("upload_seconds", "Time to send the outbox to the API")
+uploads_failed = metrics.counter("uploads_failed_total", "Uploads that did not get everything acknowledged")
+
+SensorConfig = namedtuple(
+    "SensorConfig",
+    ["client_id", "port", "station_id", "pm10_timeseries_id", "pm25_timeseries_id", "base_path"],
+)
+
+
+def load_config(path):
+    with open(path, "r") as f:
+        config = json.load(f)
+
+    sensors = []
+    for entry in config["sensors"]:
+        sensors.append(
+            SensorConfig(
+                entry["client_id"],
+                entry["port"],
+                entry.get("station_id"),
+                entry.get("pm10_timeseries_id"),
+                entry.get("pm25_timeseries_id"),
+                entry.get("base_path", entry["client_id"]),
+            )
+        )
+
+    if len({sensor.base_path for sensor in sensors}) != len(sensors):
+        raise ValueError(f"{path}: every sensor needs its own base_path")
+    return sensors
+
+
+class Sensor:
+    # One sensor: read, aggregated per minute, saved and (if it has a station) uploaded. station is an
+    # existing Station to upload with, by default one is created from the config.
+
+    def __init__(self, config, client, encoder, station=None):
+        self.config = config
+        self.client = client
+
+        os.makedirs(config.base_path, exist_ok=True)
+        self.reader = SerialFrameReader(config.port)
+        self.writer = MeasurementWriter(
+            CSV_HEADER, base_path=config.base_path, flush_every=1, sync=SYNC_FLUSH, index_minutes=INDEX_MINUTES
+        )
+        self.store = MeasurementStore(config.base_path, utc_offset=dt.timedelta(hours=1))
+        self.rollups = RollupWriter(config.base_path, utc_offset=dt.timedelta(hours=1))
+
+        # 1, 8 and 24 hour moving averages, updated every minute
+        self.moving_averages = [MovingAverage(window) for window in WINDOWS]
+
+        # the sensor's messages are rate limited per client_id (structured_logging.RateLimitFilter)
+        self.log_extra = {"client_id": config.client_id}
+
+        # gauges per sensor, the metric names can only have letters, digits and underscores
+        metric_name = re.sub(r"[^a-zA-Z0-9_]", "_", config.client_id)
+        self.minute_coverage = metrics.gauge(
+            f"sensor_{metric_name}_minute_coverage", f"Coverage of the last minute of {config.client_id} in percent"
+        )
+        self.upload_queue_depth = metrics.gauge(
+            f"sensor_{metric_name}_upload_queue_depth", f"Items of {config.client_id} waiting in the upload queue"
+        )
+
+        # its own scheduler, so the fired, missed and lateness stats (and scheduler_<name>_minute_lateness_seconds)
+        # are those of this sensor's minutes
+        self.scheduler = Scheduler(60, name=f"{metric_name}_minute")
+
+        self.outbox = None
+        self.station = None
+        self.upload_queue = None
+        if station is not None:
+            self.outbox = station.outbox
+            self.station = station
+            self.upload_queue = UploadQueue(maxsize=UPLOAD_QUEUE_SIZE)
+        elif config.station_id is not None:
+            self.outbox = Outbox(os.path.join(config.base_path, f"miljodir-station-{config.station_id}-outbox.db"))
+            self.station = Station(
+                config.station_id,
+                config.pm10_timeseries_id,
+                config.pm25_timeseries_id,
+                config.client_id,
+                self.outbox,
+                encoder=encoder,
+                chunk_size=UPLOAD_CHUNK_SIZE,
+            )
+            self.upload_queue = UploadQueue(maxsize=UPLOAD_QUEUE_SIZE)
+
+    def _save(self, from_time, to_time, aggregate):
+        # outbox first (before anything is sent), then the CSV and binary files, all in one worker
+        # thread call so the sensor keeps being read while we wait for the disk
+        with save_seconds.time():
+            seq = None
+            if self.outbox is not None:
+                seq = self.outbox.append(from_time, to_time, aggregate.pm25, aggregate.pm10, aggregate.coverage)
+
+            row = CSV_PAYLOAD.format(
+                pm2=aggregate.pm25,
+                pm10=aggregate.pm10,
+                client_id=self.config.client_id,
+                fromTime=from_time,
+                toTime=to_time,
+            )
+            self.writer.append(from_time, row)
+            self.store.write(aggregate.minute, aggregate.pm25, aggregate.pm10, aggregate.coverage)
+            self.rollups.add(from_time, aggregate.pm25, aggregate.pm10)
+        logger.debug('Saved data: "%s" to file: "%s"', row, self.writer.file_path(from_time.date()))
+        return seq
+
+    def _send_batch(self, batch):
+        # called by the upload worker (in a worker thread) with the outbox sequence numbers of new
+        # measurements, the measurements themselves are read from the outbox
+        with upload_seconds.time():
+            ok = self.station.send_pending(self.client)
+        if not ok:
+            uploads_failed.inc()
+        return ok
+
+    async def run(self):
+        # the sensor is read in the background, every reading is queued for the minute aggregator
+        self.reader.start()
+
+        # uploads run in their own task, a slow or unavailable API never delays the next sample
+        # the queue only tells the worker that there is new data, dropping from it loses nothing
+        uploader = None
+        if self.station is not None:
+            uploader = asyncio.create_task(upload_worker(self.upload_queue, self._send_batch, min_items=5))
+
+        try:
+            # every frame the sensor sends (about one per second) goes into the minute's mean, min and max,
+            # a minute is handed over as soon as it has ended, the scheduler closes it at the whole minute
+            # when the sensor has stopped sending
+            async for aggregate in aggregate_minutes(self.reader, MinuteAggregator(), self.scheduler):
+                # start time of the measurement (aligned with the whole minute)
+                from_time = dt.datetime.fromtimestamp(aggregate.minute * 60, tz)
+                to_time = from_time + dt.timedelta(minutes=1)
+
+                # share of the expected frames that were received in the minute
+                self.minute_coverage.set(aggregate.coverage)
+
+                logger.info(
+                    "%s: FromTime: %s, PM2.5 = %s, PM10 = %s, Frames: %d, Coverage: %d%%",
+                    self.config.client_id,
+                    from_time,
+                    aggregate.pm25,
+                    aggregate.pm10,
+                    aggregate.count,
+                    aggregate.coverage,
+                    extra={
+                        "client_id": self.config.client_id,
+                        "pm25_min": aggregate.pm25_min,
+                        "pm25_max": aggregate.pm25_max,
+                        "pm10_min": aggregate.pm10_min,
+                        "pm10_max": aggregate.pm10_max,
+                    },
+                )
+
+                for moving_average in self.moving_averages:
+                    average = moving_average.add(aggregate.minute, aggregate.pm25, aggregate.pm10)
+                    logger.debug(
+                        "%s: %dh average: PM2.5 = %.1f, PM10 = %.1f, Coverage: %s%%",
+                        self.config.client_id,
+                        moving_average.window // 60,
+                        average.pm2,
+                        average.pm10,
+                        average.coverage,
+                        extra=self.log_extra,
+                    )
+
+                seq = await asyncio.to_thread(self._save, from_time, to_time, aggregate)
+                cycle_seconds.observe(time.time() - to_time.timestamp())
+                logger.debug("%s: minute scheduler: %s", self.config.client_id, self.scheduler.stats(), extra=self.log_extra)
+
+                if uploader is None:
+                    continue
+
+                # only send between 08:00 - 16:00 monday - friday
+                if 7 <= from_time.hour <= 15 and from_time.weekday() < 5:
+                    # the upload worker sends the data to the API when there are at least 5 new measurements
+                    self.upload_queue.put(seq)
+                else:
+                    logger.debug(
+                        "%s: not sending data to API, outside of working hours", self.config.client_id, extra=self.log_extra
+                    )
+
+                self.upload_queue_depth.set(self.upload_queue.depth())
+                logger.debug("%s: upload queue: %s", self.config.client_id, self.upload_queue.stats(), extra=self.log_extra)
+
+                if uploader.done():
+                    # should never happen, restart the worker so queued data is not stuck
+                    logger.error(
+                        "%s: upload worker stopped: %s", self.config.client_id, uploader.exception(), extra=self.log_extra
+                    )
+                    uploader = asyncio.create_task(upload_worker(self.upload_queue, self._send_batch, min_items=5))
+
+        finally:
+            if uploader is not None:
+                uploader.cancel()
+            self.reader.stop()
+
+    def close(self):
+        self.writer.close()
+        self.store.close()
+        self.rollups.close()
+        if self.outbox is not None:
+            self.outbox.close()
+
+
+async def main(config_path, duration=None):
+    setup_logging()
+    metrics_task = metrics.start_from_env()
+
+    configs = load_config(config_path)
+    if any(config.station_id is not None for config in configs) and os.getenv("XAPIKEY") is None:
+        logger.error("XAPIKEY environment variable not set")
+        exit(1)
+
+    # one connection pool and access token for every station, large enough for one upload per sensor
+    client = MiljodirClient(
+        MILJODIR_API_URL,
+        token_cache_path=os.getenv("MILJODIR_TOKEN_CACHE"),
+        compression=os.getenv("MILJODIR_COMPRESSION") or None,
+        pool_maxsize=max(4, len(configs)),
+    )
+    encoder = PayloadEncoder()
+    sensors = [Sensor(config, client, encoder) for config in configs]
+    read_api.start_from_env({config.client_id: config.base_path for config in configs})
+    logger.info("Running %d sensor(s)", len(sensors))
+
+    tasks = [asyncio.create_task(sensor.run()) for sensor in sensors]
+
+    try:
+        # a sensor only stops on an unexpected exception, the others keep running
+        pending = set(tasks)
+        deadline = time.monotonic() + duration if duration is not None else None
+        while pending:
+            timeout = deadline - time.monotonic() if deadline is not None else None
+            if timeout is not None and timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                logger.error("Sensor stopped: %s", task.exception())
+
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for sensor in sensors:
+            sensor.close()
+        client.close()
+        if metrics_task is not None:
+            metrics_task.cancel()
+
+
+def benchmark(counts, duration, interval):
+    # N sensors in one daemon against N daemons with one sensor each, on fake pty sensors.
+    # The CPU time and peak memory of the daemon processes are read from wait4().
+    def feed(masters, stop):
+        while not stop.is_set():
+            for master in masters:
+                os.write(master, encode_frame(12.3, 23.4))
+            stop.wait(interval)
+
+    def run_daemons(work_dir, groups):
+        processes = []
+        for index, ports in enumerate(groups):
+            config_path = os.path.join(work_dir, f"sensors-{index}.json")
+            with open(config_path, "w") as f:
+                json.dump({"sensors": [{"client_id": f"sensor-{port.rsplit('/', 1)[-1]}", "port": port} for port in ports]}, f)
+            processes.append(
+                subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), config_path, "--duration", str(duration)],
+                    cwd=work_dir,
+                    stdout=subprocess.DEVNULL,
+                    env=dict(os.environ, LOG_LEVEL="WARNING"),
+                )
+            )
+
+        cpu = 0.0
+        rss_kb = 0
+        for process in processes:
+            _, _, usage = os.wait4(process.pid, 0)
+            cpu += usage.ru_utime + usage.ru_stime
+            rss_kb += usage.ru_maxrss
+        return cpu, rss_kb
+
+    print(f"{duration} s per run, a frame every {interval} s per sensor")
+    for count in counts:
+        sensors = [open_fake_sensor() for _ in range(count)]
+        ports = [port for _, _, port in sensors]
+        stop = threading.Event()
+        feeder = threading.Thread(target=feed, args=([master for master, _, _ in sensors], stop), daemon=True)
+        feeder.start()
+
+        try:
+            for name, groups in (("one daemon", [ports]), ("a daemon per sensor", [[port] for port in ports])):
+                cpu, rss_kb = run_daemons(tempfile.mkdtemp(), groups)
+                print(f"{count:3d} sensors, {name:>20}: CPU {cpu:6.2f} s, peak RSS {rss_kb / 1024:7.1f} MiB")
+        finally:
+            stop.set()
+            feeder.join()
+            for master, slave, _ in sensors:
+                os.close(master)
+                os.close(slave)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Read, store and upload several SDS011 sensors in one process")
+    arg_parser.add_argument("config", nargs="?", help="JSON file with the sensors")
+    arg_parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    arg_parser.add_argument("--benchmark", type=int, nargs="+", metavar="SENSORS", help="compare one daemon with a daemon per sensor")
+    arg_parser.add_argument("--interval", type=float, default=1.0, help="seconds between frames in the benchmark")
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.duration or 20, args.interval)
+    elif args.config:
+        asyncio.run(main(args.config, args.duration))
+    else:
+        arg_parser.error("a config file or --benchmark is needed")
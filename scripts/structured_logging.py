@@ -0,0 +1,178 @@
+import argparse
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Logging for the daemons, set up once by the script's main with setup_logging(). Modules log with
+# logging.getLogger(__name__) and %-style arguments, so a message below the level is never formatted.
+#
+#   - records are put on a bounded queue and written by a background thread, the caller never
+#     waits for the terminal, journald or the SD card. When the queue is full records are dropped.
+#   - the same message (logger and format string) is written at most burst times per interval
+#     seconds, the next one that gets through says how many were suppressed. Messages about a
+#     sensor, station or timeseries pass its id with extra={...}, they are limited per id, so
+#     every sensor's minute line gets through however many sensors there are.
+#   - the output is one JSON object per line (LOG_FORMAT=json, default) or plain text (LOG_FORMAT=text)
+#
+# The level is read from LOG_LEVEL (default INFO). Payload dumps and per-value messages are DEBUG.
+
+DEFAULT_FORMAT = "json"
+
+# attributes every LogRecord has, anything else was passed with extra={...} and is written as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# extra fields that say which sensor, station or timeseries a message is about
+RATE_LIMIT_KEYS = ("client_id", "station_id", "timeseries_id")
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=10, interval=60, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        # (logger, format string, ids) -> [window start, count in window, suppressed]
+        self._windows = {}
+
+    def filter(self, record):
+        key = (record.name, record.msg) + tuple(getattr(record, name, None) for name in RATE_LIMIT_KEYS)
+        now = self.clock()
+
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+
+            window[1] += 1
+            return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler that drops the record instead of blocking (or raising) when the queue is full.
+    # The record is queued as it is: QueueHandler.prepare would format the message (and the
+    # traceback) in the caller and clear args and exc_info, the listener thread formats it instead.
+    # The arguments are formatted after the call returns, log values and not objects that change.
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=None, format=None, stream=None, queue_size=10000, burst=10, interval=60):
+    # returns the QueueListener, it is stopped (and the queue written out) when the process exits
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    format = format or os.getenv("LOG_FORMAT", DEFAULT_FORMAT)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(burst, interval))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener):
+    # write out what is queued, can be called more than once
+    if listener._thread is not None:
+        listener.stop()
+
+
+def benchmark(cycles):
+    # one cycle of sendDataToMiljoDir: build a day of values, fill gaps, log the payload and encode it
+    import datetime as dt
+    import tempfile
+
+    os.chdir(tempfile.mkdtemp())
+    import sendDataToMiljoDir as miljodir
+
+    day = dt.datetime(2023, 10, 18, tzinfo=miljodir.tz)
+
+    def cycle():
+        pm10_values = []
+        pm25_values = []
+        for minute in range(0, 1440, 2):
+            from_time = day + dt.timedelta(minutes=minute)
+            to_time = from_time + dt.timedelta(minutes=1)
+            pm10_values.append(miljodir.InputTimeValue(from_time, to_time, 20.0, 100))
+            pm25_values.append(miljodir.InputTimeValue(from_time, to_time, 10.0, 100))
+        return miljodir.build_payload(pm10_values, pm25_values, None)
+
+    def run(name):
+        start = time.perf_counter()
+        for _ in range(cycles):
+            cycle()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>38}: {elapsed / cycles * 1000:7.2f} ms per cycle")
+
+    with open(os.devnull, "w") as devnull:
+        # like the old print calls: every message formatted and written in the caller
+        root = logging.getLogger()
+        root.handlers = [logging.StreamHandler(devnull)]
+        root.setLevel(logging.DEBUG)
+        run("DEBUG, written by the caller")
+
+        for level in ("DEBUG", "INFO", "WARNING"):
+            listener = setup_logging(level=level, stream=devnull, burst=1_000_000)
+            run(f"LOG_LEVEL={level}, queued")
+            stop_logging(listener)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark an upload cycle with verbose and quiet logging")
+    arg_parser.add_argument("--cycles", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    benchmark(args.cycles)
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from azure_sender import BatchSender
+from fake_iothub import FakeIoTHubClient
+from message_spool import MessageSpool
+
+# BatchSender with a spool against FakeIoTHubClient, which fails every connect and send while its
+# online flag is False.
+
+TIMESTAMP = 1_697_616_000
+
+
+def spooled_sender(tmp_path, client, **kwargs):
+    options = {"max_batch": 5, "max_wait": 0.05, "retry_delay": 0.05, "max_retry_delay": 0.1, "drain_rate": 0}
+    options.update(kwargs)
+    spool = MessageSpool(str(tmp_path / "spool.db"), max_bytes=options.pop("max_bytes", 64 * 1024 * 1024))
+    return BatchSender(client, "raspberry-pi-jan", spool=spool, **options)
+
+
+async def add_readings(sender, count, interval=0.0, start=0):
+    for index in range(start, start + count):
+        sender.add(TIMESTAMP + index, 10.0 + index % 10, 20.0 + index % 10)
+        await asyncio.sleep(interval)
+
+
+def test_outage_is_drained_in_order(tmp_path):
+    client = FakeIoTHubClient(latency=0.001)
+
+    async def run():
+        sender = spooled_sender(tmp_path, client)
+        task = asyncio.create_task(sender.run())
+
+        await add_readings(sender, 10)
+        await sender.flush(timeout=2)
+
+        client.online = False
+        await add_readings(sender, 40, start=10)
+        assert not await sender.flush(timeout=0.3)
+        spooled = sender.spool.count
+
+        client.online = True
+        sent = await sender.flush(timeout=5)
+        task.cancel()
+        return sender, spooled, sent
+
+    sender, spooled, sent = asyncio.run(run())
+
+    assert spooled > 0
+    assert sent
+    assert [reading[0] for reading in client.readings()] == [TIMESTAMP + index for index in range(50)]
+    assert sender.failed > 0
+    assert sender.spool.count == 0
+
+
+def test_drain_is_rate_limited(tmp_path):
+    client = FakeIoTHubClient(latency=0.001)
+    client.online = False
+    drain_rate = 20
+
+    async def run():
+        sender = spooled_sender(tmp_path, client, drain_rate=drain_rate)
+        task = asyncio.create_task(sender.run())
+
+        await add_readings(sender, 50)
+        await sender.flush(timeout=0.2)
+        spooled = sender.spool.count
+
+        client.online = True
+        start = time.monotonic()
+        assert await sender.flush(timeout=5)
+        task.cancel()
+        return spooled, time.monotonic() - start
+
+    spooled, elapsed = asyncio.run(run())
+
+    assert spooled == 10
+    # one send is started every 1 / drain_rate seconds
+    assert elapsed >= (spooled - 1) / drain_rate * 0.9
+    assert len(client.messages) == spooled
+
+
+def test_spool_evicts_the_oldest_messages_beyond_max_bytes(tmp_path):
+    spool = MessageSpool(str(tmp_path / "spool.db"), max_bytes=100)
+
+    evicted = [spool.append(bytes([index]) * 30, 5) for index in range(6)]
+
+    assert spool.bytes <= 100
+    assert spool.count == 3
+    assert sum(evicted) == 15
+    assert [message.body[0] for message in spool.peek(10)] == [3, 4, 5]
+
+    # a message larger than max_bytes is kept on its own
+    spool.append(b"x" * 500, 1)
+    assert spool.count == 1
+    assert spool.peek(1)[0].body == b"x" * 500
+
+
+def test_sender_counts_evicted_readings_as_dropped(tmp_path):
+    client = FakeIoTHubClient(latency=0.001)
+    client.online = False
+
+    async def run():
+        sender = spooled_sender(tmp_path, client, max_bytes=400)
+        task = asyncio.create_task(sender.run())
+        await add_readings(sender, 200)
+        await sender.flush(timeout=0.2)
+        task.cancel()
+        return sender
+
+    sender = asyncio.run(run())
+
+    assert sender.spool.bytes <= 400
+    assert sender.dropped > 0
+    assert sender.dropped + sender.spool.readings == 200
+
+
+def test_sampling_keeps_its_timing_during_a_drain(tmp_path):
+    client = FakeIoTHubClient(latency=0.02)
+    client.online = False
+
+    async def run():
+        sender = spooled_sender(tmp_path, client, drain_rate=50)
+        task = asyncio.create_task(sender.run())
+        await add_readings(sender, 300)
+        await sender.flush(timeout=0.2)
+        client.online = True
+
+        # a sampler adding a reading every 10 ms while the spool is drained
+        worst_add = 0.0
+        worst_lateness = 0.0
+        interval = 0.01
+        next_sample = time.monotonic()
+        for index in range(100):
+            next_sample += interval
+            await asyncio.sleep(max(next_sample - time.monotonic(), 0))
+            worst_lateness = max(worst_lateness, time.monotonic() - next_sample)
+
+            start = time.perf_counter()
+            sender.add(TIMESTAMP + 300 + index, 1.0, 2.0)
+            worst_add = max(worst_add, time.perf_counter() - start)
+
+        draining = sender.spool.count > 0
+        assert await sender.flush(timeout=10)
+        task.cancel()
+        return worst_add, worst_lateness, draining
+
+    worst_add, worst_lateness, draining = asyncio.run(run())
+
+    assert draining
+    assert worst_add < 0.005
+    assert worst_lateness < 0.05
+    assert [reading[0] for reading in client.readings()] == [TIMESTAMP + index for index in range(400)]
+
+
+def test_flush_gives_up_after_the_timeout(tmp_path):
+    client = FakeIoTHubClient(latency=0.001)
+    client.online = False
+
+    async def run():
+        sender = spooled_sender(tmp_path, client)
+        task = asyncio.create_task(sender.run())
+        await add_readings(sender, 3)
+        start = time.monotonic()
+        sent = await sender.flush(timeout=0.3)
+        elapsed = time.monotonic() - start
+        task.cancel()
+        return sender, sent, elapsed
+
+    sender, sent, elapsed = asyncio.run(run())
+
+    assert not sent
+    assert elapsed < 1
+    assert sender.spool.readings == 3
+
+
+def test_partial_batch_is_sent_after_max_wait():
+    client = FakeIoTHubClient(latency=0.001)
+
+    async def run():
+        sender = BatchSender(client, "raspberry-pi-jan", max_batch=60, max_wait=0.2)
+        task = asyncio.create_task(sender.run())
+        await asyncio.sleep(0)
+        await add_readings(sender, 5)
+        await asyncio.sleep(0.5)
+        task.cancel()
+        return sender.stats()
+
+    stats = asyncio.run(run())
+
+    assert len(client.readings()) == 5
+    assert stats["buffered"] == 0
@@ -0,0 +1,62 @@
+import datetime as dt
+import backfill
+from backfill import PM10_TIMESERIES_ID as PM10, PM25_TIMESERIES_ID as PM25, build_chunks, send_chunks, tz
+from miljodir_station import InputTimeValue
+from outbox import Outbox
+
+START = dt.datetime(2023, 10, 18, 8, tzinfo=tz)
+
+
+def minute(index):
+    return START + dt.timedelta(minutes=index)
+
+
+def parsed_day(minutes):
+    pm10 = [InputTimeValue(minute(index), minute(index + 1), 10.0, 100) for index in minutes]
+    pm25 = [InputTimeValue(minute(index), minute(index + 1), 5.0, 100) for index in minutes]
+    return START.date(), (pm10, pm25)
+
+
+def test_every_chunk_has_the_last_sent_time_of_each_timeseries():
+    sent_until = {PM10: minute(9), PM25: minute(4)}
+
+    chunks = build_chunks([parsed_day(range(30))], sent_until, minute(30), chunk_size=10)
+
+    assert [len(pm25) for last_time, last_sent, pm10, pm25 in chunks] == [10, 10, 5]
+    assert [len(pm10) for last_time, last_sent, pm10, pm25 in chunks] == [5, 10, 5]
+    first, second, third = (last_sent for last_time, last_sent, pm10, pm25 in chunks)
+    assert first == {PM10: minute(9), PM25: minute(4)}
+    assert second == {PM10: minute(14), PM25: minute(14)}
+    assert third == {PM10: minute(24), PM25: minute(24)}
+
+
+def test_the_leading_fill_is_limited_to_chunk_size():
+    sent_until = {PM10: minute(-3 * 24 * 60), PM25: minute(-3 * 24 * 60)}
+
+    chunks = build_chunks([parsed_day(range(5))], sent_until, minute(30), chunk_size=10)
+
+    assert chunks[0][1] == {PM10: minute(-10), PM25: minute(-10)}
+
+
+def test_sent_chunks_are_acknowledged_in_the_outbox(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    for index in range(30):
+        outbox.append(minute(index), minute(index + 1), 5.0, 10.0, 100)
+
+    # the second chunk fails, only the first one is acknowledged
+    requests = []
+
+    def send(pm10_time_values, pm25_time_values, last_sent):
+        requests.append(last_sent)
+        return pm10_time_values[0].from_time != minute(10)
+
+    monkeypatch.setattr(backfill, "send_data_to_miljodir", send)
+    sent_until = {PM10: minute(-1), PM25: minute(-1)}
+    chunks = build_chunks([parsed_day(range(30))], sent_until, minute(30), chunk_size=10)
+
+    assert not send_chunks(chunks, sent_until, max_in_flight=1, outbox=outbox)
+    assert len(requests) == 3
+    assert (outbox.acked(PM10), outbox.acked(PM25)) == (10, 10)
+    assert sent_until == {PM10: minute(9), PM25: minute(9)}
+    outbox.close()
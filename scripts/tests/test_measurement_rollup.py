@@ -0,0 +1,68 @@
+import datetime as dt
+import os
+from measurement_rollup import DAY_FILE, HOUR_FILE, RollupWriter, read_rollup_file
+
+TZ = dt.timezone(dt.timedelta(hours=1))
+START = dt.datetime(2023, 10, 18, 8, tzinfo=TZ)
+DAY_PATH = "2023/10/18"
+
+
+def minute(index):
+    return START + dt.timedelta(minutes=index)
+
+
+def append_rows(base_path, minutes):
+    # the rows station_daemon writes to measurements.csv before the minute is added to the rollups
+    path = os.path.join(base_path, DAY_PATH, "measurements.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new = not os.path.exists(path)
+    with open(path, "a") as f:
+        if new:
+            f.write("pm2,pm10,client_id,fromTime,toTime\n")
+        for index in minutes:
+            f.write(f"1.0,2.0,pi,{minute(index)},{minute(index + 1)}\n")
+
+
+def add_minutes(base_path, rollups, minutes):
+    for index in minutes:
+        append_rows(base_path, [index])
+        rollups.add(minute(index), 1.0, 2.0)
+
+
+def rollup(base_path, file_name):
+    return [(bucket.start, bucket.count) for bucket in read_rollup_file(os.path.join(base_path, DAY_PATH, file_name))]
+
+
+def test_rollups_are_written_when_an_hour_closes(tmp_path):
+    base_path = str(tmp_path)
+    rollups = RollupWriter(base_path)
+
+    add_minutes(base_path, rollups, range(60))
+    assert not os.path.exists(os.path.join(base_path, DAY_PATH, HOUR_FILE))
+
+    add_minutes(base_path, rollups, [60])
+    hour = int(START.timestamp())
+    assert rollup(base_path, HOUR_FILE) == [(hour, 60), (hour + 3600, 1)]
+    assert rollup(base_path, DAY_FILE) == [(hour - 8 * 3600, 61)]
+
+    add_minutes(base_path, rollups, range(61, 90))
+    assert rollup(base_path, HOUR_FILE) == [(hour, 60), (hour + 3600, 1)]
+
+    rollups.close()
+    assert rollup(base_path, HOUR_FILE) == [(hour, 60), (hour + 3600, 30)]
+    assert rollup(base_path, DAY_FILE) == [(hour - 8 * 3600, 90)]
+
+
+def test_a_restart_without_close_continues_from_the_minute_rows(tmp_path):
+    base_path = str(tmp_path)
+    rollups = RollupWriter(base_path)
+    add_minutes(base_path, rollups, range(70))
+    # the process stops without close, the minutes of the open hour were only in memory
+
+    rollups = RollupWriter(base_path)
+    add_minutes(base_path, rollups, range(70, 90))
+    rollups.close()
+
+    hour = int(START.timestamp())
+    assert rollup(base_path, HOUR_FILE) == [(hour, 60), (hour + 3600, 30)]
+    assert rollup(base_path, DAY_FILE) == [(hour - 8 * 3600, 90)]
@@ -0,0 +1,44 @@
+import asyncio
+import datetime as dt
+from measurement_writer import MeasurementWriter, SYNC_FLUSH
+
+HEADER = "pm2,pm10,client_id,time"
+NOW = dt.datetime(2023, 10, 18, 7, 0, 0)
+
+
+def read_file(writer):
+    with open(writer.file_path(NOW.date()), "r") as f:
+        return f.read().splitlines()
+
+
+def test_buffered_rows_are_flushed_after_the_interval_without_more_appends(tmp_path):
+    writer = MeasurementWriter(HEADER, base_path=str(tmp_path), flush_every=60, flush_interval=0.2, sync=SYNC_FLUSH)
+
+    async def run():
+        flusher = asyncio.create_task(writer.flush_periodically())
+        await asyncio.to_thread(writer.append, NOW, "1.0,2.0,pi,first")
+        await asyncio.to_thread(writer.append, NOW, "1.0,2.0,pi,second")
+        buffered = read_file(writer)
+        await asyncio.sleep(0.5)
+        flusher.cancel()
+        return buffered
+
+    buffered = asyncio.run(run())
+
+    assert buffered == []
+    assert read_file(writer) == [HEADER, "1.0,2.0,pi,first", "1.0,2.0,pi,second"]
+    writer.close()
+
+
+def test_flush_if_due_waits_for_the_interval(tmp_path):
+    writer = MeasurementWriter(HEADER, base_path=str(tmp_path), flush_every=60, flush_interval=60, sync=SYNC_FLUSH)
+    writer.flush()
+    writer.append(NOW, "1.0,2.0,pi,first")
+
+    assert 59 < writer.flush_if_due() <= 60
+    assert read_file(writer) == []
+
+    writer._last_flush -= 60
+    assert writer.flush_if_due() == 60
+    assert read_file(writer) == [HEADER, "1.0,2.0,pi,first"]
+    writer.close()
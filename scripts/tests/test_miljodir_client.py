@@ -0,0 +1,38 @@
+import logging
+import pytest
+import requests
+from miljodir_client import MiljodirClient
+from miljodir_stub import start_stub_server
+
+
+def test_only_get_requests_are_retried_after_an_error_status():
+    server, url = start_stub_server()
+    server.status = 503
+    client = MiljodirClient(url, api_key="stub", retries=2, backoff_factor=0)
+
+    try:
+        assert client.get_last_received(1178).status_code == 503
+        assert client.post_measurements(1178, b"[]").status_code == 503
+    finally:
+        client.close()
+        server.shutdown()
+
+    assert server.requests["last-received"] == 3
+    assert server.requests["measurements"] == 1
+
+
+def test_a_post_is_retried_when_the_connection_could_not_be_made(caplog):
+    server, url = start_stub_server()
+    client = MiljodirClient(url, api_key="stub", retries=2, backoff_factor=0)
+    client.tokens.get_token()
+    # nothing listens on the port anymore, every attempt is refused before anything is sent
+    server.shutdown()
+    server.server_close()
+
+    with caplog.at_level(logging.WARNING, logger="urllib3.connectionpool"):
+        with pytest.raises(requests.ConnectionError):
+            client.post_measurements(1178, b"[]")
+    client.close()
+
+    retries = [record for record in caplog.records if record.getMessage().startswith("Retrying")]
+    assert len(retries) == 2
@@ -0,0 +1,124 @@
+import datetime as dt
+import json
+import sqlite3
+from collections import namedtuple
+from miljodir_station import Station
+from outbox import Outbox
+
+PM10, PM25 = 4375, 4376
+UTC = dt.timezone.utc
+
+Response = namedtuple("Response", ["status_code"])
+
+
+class RecordingClient:
+    # stands in for MiljodirClient, keeps every posted payload
+    def __init__(self):
+        self.payloads = []
+
+    def post_measurements(self, station_id, payload):
+        self.payloads.append(json.loads(payload))
+        return Response(200)
+
+
+def append_minutes(outbox, start, count):
+    for minute in range(count):
+        from_time = start + dt.timedelta(minutes=minute)
+        outbox.append(from_time, from_time + dt.timedelta(minutes=1), 1.0, 2.0, 100)
+
+
+def test_prune_deletes_acknowledged_rows_older_than_keep_days(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    old = dt.datetime.now(UTC) - dt.timedelta(days=10)
+    append_minutes(outbox, old, 5)
+    append_minutes(outbox, dt.datetime.now(UTC) - dt.timedelta(hours=1), 5)
+
+    outbox.ack(PM10, 8)
+    outbox.ack(PM25, 3)
+
+    # only the rows both timeseries have acknowledged
+    assert outbox.prune([PM10, PM25]) == 3
+    assert [row.seq for row in outbox.pending(0, 100)] == [4, 5, 6, 7, 8, 9, 10]
+
+    outbox.ack(PM25, 10)
+    # recent rows are kept
+    assert outbox.prune([PM10, PM25]) == 2
+    assert outbox.pending(0, 100)[0].seq == 6
+    outbox.close()
+
+
+def test_prune_compares_times_with_an_offset(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    cutoff = dt.datetime.now(UTC) - dt.timedelta(days=7)
+    # stored as +01:00, the first row is before the cutoff and the second after it, a string
+    # comparison against the UTC cutoff would get both wrong
+    plus_one = dt.timezone(dt.timedelta(hours=1))
+    for from_time in (cutoff - dt.timedelta(minutes=30), cutoff + dt.timedelta(minutes=30)):
+        local = from_time.astimezone(plus_one)
+        outbox.append(local, local + dt.timedelta(minutes=1), 1.0, 2.0, 100)
+    outbox.ack(PM10, 2)
+    outbox.ack(PM25, 2)
+
+    assert outbox.prune([PM10, PM25]) == 1
+    assert [row.seq for row in outbox.pending(0, 10)] == [2]
+    outbox.close()
+
+
+def test_from_epoch_is_added_to_an_existing_outbox(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        """
+        CREATE TABLE measurements (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, from_time TEXT NOT NULL, to_time TEXT NOT NULL,
+            pm25 REAL NOT NULL, pm10 REAL NOT NULL, coverage INTEGER NOT NULL
+        )
+        """
+    )
+    db.execute(
+        "INSERT INTO measurements (from_time, to_time, pm25, pm10, coverage) VALUES (?, ?, 1.0, 2.0, 100)",
+        ("2023-10-18T08:00:00+01:00", "2023-10-18T08:01:00+01:00"),
+    )
+    db.commit()
+    db.close()
+
+    outbox = Outbox(path)
+    outbox.ack(PM10, 1)
+    outbox.ack(PM25, 1)
+
+    assert outbox._db.execute("SELECT from_epoch FROM measurements").fetchall() == [(1697612400,)]
+    assert outbox.prune([PM10, PM25]) == 1
+    outbox.close()
+
+
+def test_backlog_counts_rows_either_timeseries_has_not_acknowledged(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    append_minutes(outbox, dt.datetime(2023, 10, 18, 7, tzinfo=UTC), 10)
+
+    outbox.ack(PM10, 10)
+    outbox.ack(PM25, 4)
+
+    assert outbox.backlog([PM10, PM25]) == 6
+    outbox.close()
+
+
+def test_leading_fill_is_limited_to_chunk_size(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    # recent enough not to be pruned after the first send
+    start = (dt.datetime.now(UTC) - dt.timedelta(days=3)).replace(second=0, microsecond=0)
+    append_minutes(outbox, start, 1)
+    station = Station(1178, PM10, PM25, "pi", outbox, chunk_size=60)
+    client = RecordingClient()
+    assert station.send_pending(client)
+
+    # two days without measurements
+    append_minutes(outbox, start + dt.timedelta(days=2), 5)
+    assert station.send_pending(client)
+
+    for series in client.payloads[-1]:
+        values = series["timeValues"]
+        fills = [value for value in values if value["value"] == -9900]
+        assert len(values) == 5 + len(fills)
+        assert 0 < len(fills) < 60
+    assert outbox.backlog([PM10, PM25]) == 0
+    outbox.close()
@@ -0,0 +1,56 @@
+import datetime as dt
+import json
+import urllib.error
+import urllib.request
+import pytest
+import read_api
+from measurement_csv import write_synthetic_days
+
+
+@pytest.fixture
+def api(tmp_path):
+    write_synthetic_days(str(tmp_path), dt.date(2023, 10, 17), 2)
+    server = read_api.serve({"pi": str(tmp_path)}, 0)
+    yield f"http://127.0.0.1:{server.server_address[1]}/series"
+    server.shutdown()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_positive_offsets_in_the_query(api):
+    # %2B is a +, an unencoded + arrives as a space
+    for offset in ("%2B01:00", "+01:00"):
+        status, document = get(f"{api}?from=2023-10-18T00:00{offset}&to=2023-10-18T03:00{offset}&window=hour")
+        assert status == 200, document
+        assert document["from"] == "2023-10-18T00:00:00+01:00"
+        assert [row[0] for row in document["values"]] == [
+            "2023-10-18T00:00:00+01:00",
+            "2023-10-18T01:00:00+01:00",
+            "2023-10-18T02:00:00+01:00",
+        ]
+
+
+def test_raw_and_minute_ranges_are_limited(api):
+    for window in ("raw", "minute"):
+        status, document = get(f"{api}?from=2023-01-01T00:00&to=2023-03-01T00:00&window={window}")
+        assert status == 400
+        assert "limited" in document["error"]
+
+    status, document = get(f"{api}?from=2023-01-01T00:00&to=2023-03-01T00:00&window=24h")
+    assert status == 200
+
+
+def test_minute_window_matches_the_raw_rows(api):
+    query = "from=2023-10-18T08:00&to=2023-10-18T08:05"
+    _, raw = get(f"{api}?{query}&window=raw")
+    _, minutes = get(f"{api}?{query}&window=minute")
+
+    assert [row[:3] for row in raw["values"]] == [row[:3] for row in minutes["values"]]
+    # the synthetic files have no measurements.bin, so there is no stored coverage
+    assert [row[3] for row in raw["values"]] == [None] * 5
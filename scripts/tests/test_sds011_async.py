@@ -0,0 +1,121 @@
+import asyncio
+import os
+from fake_sds011 import open_fake_sensor
+from sds011_async import SerialFrameReader
+from sds011_decoder import encode_frame
+
+# SerialFrameReader against a fake sensor: a pty pair, the reader opens the slave like /dev/ttyUSB0
+# and the test writes frames to the master.
+
+
+async def wait_until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_reads_frames_from_the_port():
+    master, slave, port = open_fake_sensor()
+
+    async def run():
+        async with SerialFrameReader(port) as reader:
+            for pm25, pm10 in ((1.2, 3.4), (5.6, 7.8), (99.9, 100.0)):
+                os.write(master, encode_frame(pm25, pm10, 0x1234))
+            return [await asyncio.wait_for(reader.get(), 2) for _ in range(3)]
+
+    try:
+        readings = asyncio.run(run())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+    assert [(reading.pm25, reading.pm10, reading.device_id) for reading in readings] == [
+        (1.2, 3.4, 0x1234),
+        (5.6, 7.8, 0x1234),
+        (99.9, 100.0, 0x1234),
+    ]
+
+
+def test_skips_corrupt_frames_and_resyncs():
+    master, slave, port = open_fake_sensor()
+    frame = encode_frame(12.3, 23.4)
+    corrupt = bytearray(encode_frame(50.0, 60.0))
+    corrupt[8] ^= 0xFF
+
+    async def run():
+        async with SerialFrameReader(port) as reader:
+            # noise, a frame with a bad checksum, a frame with a dropped byte, then a frame split over two writes
+            os.write(master, b"\x00\xab\xaa" + bytes(corrupt) + frame[:4] + frame[5:])
+            os.write(master, frame[:6])
+            await asyncio.sleep(0.05)
+            os.write(master, frame[6:])
+            reading = await asyncio.wait_for(reader.get(), 2)
+            return reading, reader.queue.qsize(), reader.decoder
+
+    try:
+        reading, remaining, decoder = asyncio.run(run())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+    assert (reading.pm25, reading.pm10) == (12.3, 23.4)
+    assert remaining == 0
+    assert decoder.checksum_errors >= 1
+    assert decoder.skipped_bytes > 0
+
+
+def test_drops_the_oldest_reading_when_the_queue_is_full():
+    master, slave, port = open_fake_sensor()
+
+    async def run():
+        async with SerialFrameReader(port, maxsize=2) as reader:
+            os.write(master, b"".join(encode_frame(index, index) for index in range(5)))
+            await wait_until(lambda: reader.decoder.frames == 5)
+            return [reader.queue.get_nowait().pm25 for _ in range(reader.queue.qsize())], reader.dropped
+
+    try:
+        readings, dropped = asyncio.run(run())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+    assert readings == [3.0, 4.0]
+    assert dropped == 3
+
+
+def test_reconnects_after_the_port_is_lost(tmp_path):
+    # the reader opens a symlink, like a udev name for the sensor; the first pty is closed and the
+    # link is pointed at a new one, as if the USB adapter was unplugged and plugged in again
+    link = str(tmp_path / "ttySDS011")
+    first_master, first_slave, first_port = open_fake_sensor()
+    os.symlink(first_port, link)
+    second = None
+
+    async def run():
+        nonlocal second
+        async with SerialFrameReader(link, reconnect_delay=0.1) as reader:
+            os.write(first_master, encode_frame(1.0, 2.0))
+            first = await asyncio.wait_for(reader.get(), 2)
+
+            os.close(first_master)
+            await wait_until(lambda: reader._ser is None)
+
+            second = open_fake_sensor()
+            os.remove(link)
+            os.symlink(second[2], link)
+            await wait_until(lambda: reader._ser is not None)
+
+            os.write(second[0], encode_frame(3.0, 4.0))
+            return first, await asyncio.wait_for(reader.get(), 2)
+
+    try:
+        first, after = asyncio.run(run())
+    finally:
+        os.close(first_slave)
+        if second is not None:
+            os.close(second[0])
+            os.close(second[1])
+
+    assert (first.pm25, first.pm10) == (1.0, 2.0)
+    assert (after.pm25, after.pm10) == (3.0, 4.0)
@@ -0,0 +1,86 @@
+import os
+from sql_bulk_load import SqliteValues, load, parse_line
+
+
+def write_day(base_path, day, lines, newline="\n"):
+    directory = os.path.join(base_path, day)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "measurements.csv"), "w", newline="") as f:
+        f.write(newline.join(lines) + newline)
+
+
+def rows(target):
+    return target._db.execute('SELECT pm2, pm10, UtcTime, UnixTime, ClientId FROM "values" ORDER BY UtcTime').fetchall()
+
+
+def test_loads_four_and_five_column_files(tmp_path):
+    base_path = str(tmp_path / "measurements")
+    # saveMeasurementsToFileContinuesly.py: UTC time without an offset
+    write_day(
+        base_path,
+        "2023/10/17",
+        ["pm2,pm10,client_id,time", "1.5,3.0,pi,2023-10-17 07:00:00.123456", "2.5,4.0,pi,2023-10-17 07:00:01"],
+    )
+    # sendDataToMiljoDir.py: local fromTime and toTime
+    write_day(
+        base_path,
+        "2023/10/18",
+        [
+            "pm2,pm10,client_id,fromTime,toTime",
+            "5.0,7.5,pi,2023-10-18 08:00:00+01:00,2023-10-18 08:01:00+01:00",
+            "not,a,valid,line",
+            "6.0,8.5,pi,2023-10-18 08:01:00+01:00,2023-10-18 08:02:00+01:00",
+        ],
+    )
+    target = SqliteValues(str(tmp_path / "values.db"))
+
+    stats = load(base_path, target, batch_size=2, report_every=None)
+
+    assert (stats["files"], stats["rows"], stats["inserted"], stats["invalid"]) == (2, 4, 4, 1)
+    assert rows(target) == [
+        (1.5, 3.0, "2023-10-17 07:00:00.123456", 1697526000, "pi"),
+        (2.5, 4.0, "2023-10-17 07:00:01", 1697526001, "pi"),
+        (5.0, 7.5, "2023-10-18 07:00:00", 1697612400, "pi"),
+        (6.0, 8.5, "2023-10-18 07:01:00", 1697612460, "pi"),
+    ]
+    target.close()
+
+
+def test_loading_again_inserts_nothing(tmp_path):
+    base_path = str(tmp_path / "measurements")
+    lines = ["pm2,pm10,client_id,fromTime,toTime"] + [
+        f"{minute}.0,{minute}.5,pi,2023-10-18 08:{minute:02d}:00+01:00,2023-10-18 08:{minute + 1:02d}:00+01:00"
+        for minute in range(30)
+    ]
+    # a duplicated line is only inserted once
+    write_day(base_path, "2023/10/18", lines + [lines[5]])
+    target = SqliteValues(str(tmp_path / "values.db"))
+
+    first = load(base_path, target, batch_size=7, report_every=None)
+    count = target.count()
+    second = load(base_path, target, batch_size=7, report_every=None)
+
+    assert (first["rows"], first["inserted"], first["duplicates"]) == (31, 30, 1)
+    assert count == 30
+    assert (second["inserted"], second["duplicates"]) == (0, 31)
+    assert target.count() == 30
+    target.close()
+
+
+def test_crlf_files(tmp_path):
+    base_path = str(tmp_path / "measurements")
+    write_day(base_path, "2023/10/17", ["pm2,pm10,client_id,time", "1.5,3.0,pi,2023-10-17 07:00:00"], newline="\r\n")
+    write_day(
+        base_path,
+        "2023/10/18",
+        ["pm2,pm10,client_id,fromTime,toTime", "5.0,7.5,pi,2023-10-18 08:00:00+01:00,2023-10-18 08:01:00+01:00"],
+        newline="\r\n",
+    )
+    target = SqliteValues(str(tmp_path / "values.db"))
+
+    stats = load(base_path, target, report_every=None)
+
+    assert (stats["inserted"], stats["invalid"]) == (2, 0)
+    assert [row[2] for row in rows(target)] == ["2023-10-17 07:00:00", "2023-10-18 07:00:00"]
+    assert parse_line("1.5,3.0,pi,2023-10-17 07:00:00\r\n")[2].isoformat(" ") == "2023-10-17 07:00:00"
+    target.close()
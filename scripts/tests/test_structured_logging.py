@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+import pytest
+from structured_logging import RateLimitFilter, setup_logging, stop_logging
+
+
+@pytest.fixture
+def logging_setup():
+    stream = io.StringIO()
+    listener = setup_logging(level="INFO", format="json", stream=stream)
+    yield stream, listener
+    stop_logging(listener)
+    logging.getLogger().handlers = []
+
+
+def record(msg, **extra):
+    record = logging.LogRecord("station_daemon", logging.INFO, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_the_traceback_is_written_as_the_exception_field(logging_setup):
+    stream, listener = logging_setup
+    logger = logging.getLogger("test")
+    try:
+        raise ValueError("broken")
+    except ValueError as e:
+        logger.exception("Exception: %s", e)
+    stop_logging(listener)
+
+    (entry,) = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert entry["message"] == "Exception: broken"
+    assert entry["exception"].startswith("Traceback")
+    assert "ValueError: broken" in entry["exception"]
+
+
+def test_records_are_queued_with_their_arguments(logging_setup):
+    # the message is formatted by the listener thread, not by the caller
+    queued = []
+    logging.getLogger().handlers[0].enqueue = queued.append
+
+    logging.getLogger("test").info("PM2.5 = %s", 12.5)
+
+    (queued_record,) = queued
+    assert (queued_record.msg, queued_record.args) == ("PM2.5 = %s", (12.5,))
+
+
+def test_the_rate_limit_is_per_client_id():
+    rate_limit = RateLimitFilter(burst=2, interval=60, clock=lambda: 0)
+    message = "%s: FromTime: %s, PM2.5 = %s"
+
+    passed = [rate_limit.filter(record(message, client_id=f"sensor-{index}")) for index in range(20)]
+    assert all(passed)
+
+    passed = [rate_limit.filter(record(message, client_id="sensor-0")) for _ in range(3)]
+    assert passed == [True, False, False]
+    # without an id the format string alone is the key
+    assert [rate_limit.filter(record("Running %d sensor(s)")) for _ in range(3)] == [True, True, False]
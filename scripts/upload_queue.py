@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+
+
+class UploadQueue:
+    # Bounded queue between the minute sampler and the upload worker. put() never blocks, so the
+    # sampler keeps its timing whatever the network does. When the queue is full the overflow
+    # policy decides what happens:
+    #
+    #   drop-oldest: discard the oldest item (default)
+    #   drop-newest: discard the item being added
+    #
+    # The measurements themselves are kept in the outbox (outbox.py), the queue only wakes the
+    # worker, so a dropped item is sent with the next batch.
+
+    def __init__(self, maxsize=1440, policy=DROP_OLDEST):
+        self.maxsize = maxsize
+        self.policy = policy
+
+        self._items = deque()
+        self._changed = asyncio.Event()
+
+        self.high_watermark = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+
+    def depth(self):
+        # everything waiting to be uploaded
+        return len(self._items)
+
+    def put(self, item):
+        if len(self._items) >= self.maxsize:
+            self._overflow(item)
+        else:
+            self._items.append(item)
+
+        self.high_watermark = max(self.high_watermark, self.depth())
+        self._changed.set()
+
+    def _overflow(self, item):
+        if self.policy == DROP_NEWEST:
+            self.dropped += 1
+            return
+
+        self._items.popleft()
+        self._items.append(item)
+        self.dropped += 1
+
+    async def get_batch(self, min_items=1, max_items=100):
+        # wait until at least min_items are queued, then take up to max_items
+        while len(self._items) < min_items:
+            self._changed.clear()
+            await self._changed.wait()
+
+        count = min(max_items, len(self._items))
+        return [self._items.popleft() for _ in range(count)]
+
+    def requeue(self, batch):
+        # put a failed batch back in front, so it is retried before newer items
+        self._items.extendleft(reversed(batch))
+        while len(self._items) > self.maxsize:
+            self._items.pop()
+            self.dropped += 1
+        self._changed.set()
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "high_watermark": self.high_watermark,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+async def upload_worker(queue, send_batch, min_items=5, max_items=120, retry_delay=30, max_retry_delay=900):
+    # drain the queue in batches, send_batch is a blocking function returning True on success and
+    # is run in a worker thread so the event loop (and the sampler) never waits for the network
+    delay = retry_delay
+
+    while True:
+        batch = await queue.get_batch(min_items, max_items)
+
+        try:
+            ok = await asyncio.to_thread(send_batch, batch)
+        except Exception as e:
+            logger.exception("Exception: %s", e)
+            ok = False
+
+        if ok:
+            queue.sent += len(batch)
+            delay = retry_delay
+            continue
+
+        queue.failed += 1
+        queue.requeue(batch)
+        logger.warning("Upload failed, %d items queued, retrying in %d seconds", queue.depth(), delay)
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_retry_delay)